@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Batch Fetcher
+================
+
+Fetch many multipart responses concurrently over a shared, sized
+connection pool, streaming each through a response streamer:
+
+.. code-block:: python
+
+    def on_response(spec, streamer):
+        with streamer.get_next_part() as part:
+            return part.content.read()
+
+    with BatchFetcher(pool_size=20) as fetcher:
+        for result in fetcher.fetch(specs, on_response):
+            print(result.spec['url'], result.latency, result.value)
+
+This module requires :mod:`requests`.
+
+"""
+from __future__ import absolute_import
+import logging
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from .mime_response_streamer import XOPResponseStreamer
+
+
+log = logging.getLogger(__name__)
+
+
+class BatchResult(object):
+    """The outcome of a request made by :class:`BatchFetcher`.
+
+    Attributes:
+        spec (dict): The request spec.
+
+        value: The value returned by the callback, or `None` on error.
+
+        error (:class:`Exception`): The exception raised while making
+            the request or in the callback, or `None` on success.
+
+        latency (float): The seconds until the response headers were
+            received, or `None` if no response was received.
+
+        elapsed (float): The seconds until the callback returned or
+            the request failed.
+
+    """
+
+    def __init__(self, spec, value=None, error=None, latency=None,
+                 elapsed=None):
+        self.spec = spec
+        self.value = value
+        self.error = error
+        self.latency = latency
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(
+            self.__class__.__name__, self.spec.get('url'),
+            'error' if self.error is not None else 'ok')
+
+    @property
+    def ok(self):
+        """bool: Whether the request and the callback succeeded."""
+        return self.error is None
+
+
+class BatchFetcher(object):
+    """Concurrent fetcher of multipart responses with a pooled session.
+
+    Each request spec is a `dict` of keyword arguments to
+    :meth:`requests.Session.request`, which must include `method` and
+    `url`. Responses are always streamed.
+
+    Args:
+        pool_size (`int`, optional): The maximum number of connections
+            kept per host.
+
+        max_workers (`int`, optional): The number of worker threads.
+            Defaults to `pool_size`.
+
+        session (:class:`requests.Session`, optional): The session to
+            use. If omitted, a session with an adapter sized to
+            `pool_size` is created and owned by this object.
+
+        streamer_class (`type`, optional): The response streamer class
+            wrapping each response. Defaults to
+            :class:`XOPResponseStreamer`.
+
+        raise_for_status (`bool`, optional): Whether an HTTP error
+            status is reported as an error without calling back.
+
+    """
+
+    def __init__(self, pool_size=10, max_workers=None, session=None,
+                 streamer_class=XOPResponseStreamer, raise_for_status=True):
+        self._owns_session = session is None
+        if session is None:
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.streamer_class = streamer_class
+        self.raise_for_status = raise_for_status
+        self._pool = ThreadPool(max_workers or pool_size)
+
+    def __repr__(self):
+        return '<{}>'.format(self.__class__.__name__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker threads and close the session if owned."""
+        self._pool.close()
+        self._pool.join()
+        if self._owns_session:
+            self.session.close()
+
+    def _fetch_one(self, spec, callback):
+        kwargs = dict(spec)
+        kwargs['stream'] = True
+        result = BatchResult(spec)
+        started = default_timer()
+        resp = None
+        try:
+            resp = self.session.request(**kwargs)
+            result.latency = default_timer() - started
+            if self.raise_for_status:
+                resp.raise_for_status()
+            result.value = callback(spec, self.streamer_class(resp))
+        except Exception as exc:
+            log.debug('Request to %s failed', spec.get('url'), exc_info=True)
+            result.error = exc
+        finally:
+            if resp is not None:
+                resp.close()
+            result.elapsed = default_timer() - started
+        return result
+
+    def fetch(self, specs, callback):
+        """Fetch all `specs` and return their results in order.
+
+        Args:
+            specs (iterable): The request specs.
+
+            callback (`callable`): The function called in a worker
+                thread with the spec and the streamer wrapping the
+                response. Its return value is stored in
+                :attr:`BatchResult.value`.
+
+        Returns:
+            list: The :class:`BatchResult` objects in the order of
+                `specs`.
+
+        """
+        return self._pool.map(lambda spec: self._fetch_one(spec, callback),
+                              specs, chunksize=1)
+
+    def iter_fetch(self, specs, callback):
+        """Fetch all `specs`, yielding their results as they complete.
+
+        See :meth:`BatchFetcher.fetch` for the arguments.
+
+        """
+        return self._pool.imap_unordered(
+            lambda spec: self._fetch_one(spec, callback), specs)
@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Byte Ranges
+==============
+
+Stream `multipart/byteranges` responses to HTTP `Range` requests,
+writing each range straight to its offset in a file or buffer:
+
+.. code-block:: python
+
+    resp = requests.get(url, stream=True,
+                        headers={'Range': 'bytes=0-99,200-299'})
+    buff = bytearray(size)
+    ByteRangesStreamer(resp).write_to(buff)
+
+A large object can be fetched with range requests made in parallel:
+
+.. code-block:: python
+
+    data = fetch_ranges(url, parts=8)
+    fetch_ranges(url, target='/tmp/object.bin', parts=8)
+
+This module requires :mod:`requests`.
+
+"""
+from __future__ import absolute_import
+import logging
+import os
+import re
+import threading
+from multiprocessing.pool import ThreadPool
+
+import six
+from requests import Session
+
+from .exceptions import InvalidContentType
+from .exceptions import ParsingError
+from .exceptions import RangeError
+from .mime_response_streamer import MIMEResponseStreamer
+from .mime_streamer import parse_content_type
+from .mime_streamer import WRITE_CHUNK_SIZE
+
+
+log = logging.getLogger(__name__)
+
+
+_re_content_range = re.compile(r'^\s*bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$', re.I)
+
+# Serializes seek and write on platforms without `os.pwrite`
+_seek_lock = threading.Lock()
+
+
+def parse_content_range(text):
+    """Parse a `content-range` header value.
+
+    Args:
+        text (str): The `content-range` text, e.g., `bytes 0-99/1234`.
+
+    Returns:
+        tuple: The first and last byte positions of the range and the
+            total size, which is `None` if unknown.
+
+    Raises:
+        RangeError: When `text` is not a valid byte range.
+
+    """
+    matched = _re_content_range.match(text or '')
+    if not matched:
+        raise RangeError('Invalid content range: {!r}'.format(text))
+    start, end = int(matched.group(1)), int(matched.group(2))
+    if end < start:
+        raise RangeError('Invalid content range: {!r}'.format(text))
+    total = None if matched.group(3) == '*' else int(matched.group(3))
+    return start, end, total
+
+
+def _as_target(target):
+    """Normalize `target` to a file descriptor, a byte memoryview or a
+    file object.
+
+    """
+    if isinstance(target, int):
+        return target
+    try:
+        view = memoryview(target)
+    except TypeError:
+        return target
+    if view.readonly:
+        raise TypeError('Target buffer is read-only')
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast('B')
+    return view
+
+
+def _write_at(target, offset, data):
+    """Write `data` at `offset` of the normalized `target`."""
+    if isinstance(target, memoryview):
+        target[offset:offset + len(data)] = data
+    elif isinstance(target, int):
+        view = memoryview(data)
+        if hasattr(os, 'pwrite'):
+            while view:
+                n = os.pwrite(target, view, offset)
+                view = view[n:]
+                offset += n
+        else:
+            with _seek_lock:
+                os.lseek(target, offset, os.SEEK_SET)
+                while view:
+                    view = view[os.write(target, view):]
+    else:
+        target.seek(offset)
+        target.write(data)
+
+
+def _copy_range(content, target, offset, length):
+    """Copy at most `length` bytes from the file-like `content` to the
+    normalized `target` at `offset`.
+
+    Returns:
+        int: The number of bytes copied.
+
+    """
+    if isinstance(target, memoryview) and hasattr(content, 'readinto'):
+        # Read in place without intermediate bytes
+        view = target[offset:offset + length]
+        if len(view) < length:
+            raise RangeError('Range {}-{} is beyond the target'.format(
+                offset, offset + length - 1))
+        return content.readinto(view)
+
+    copied = 0
+    while copied < length:
+        chunk = content.read(min(length - copied, WRITE_CHUNK_SIZE))
+        if not chunk:
+            break
+        _write_at(target, offset + copied, chunk)
+        copied += len(chunk)
+    return copied
+
+
+class RangeContent(object):
+    """The content of a byte range, which ends at the size of range
+    without the new line preceding the boundary.
+
+    Args:
+        content (:class:`StreamContent`): The content of the part.
+
+        length (int): The size of the range.
+
+    """
+
+    def __init__(self, content, length):
+        self._content = content
+        self._remaining = length
+
+    def __repr__(self):
+        return '<{}>'.format(self.__class__.__name__)
+
+    def read(self, n=-1):
+        """Read at most `n` bytes, or the rest of range if negative."""
+        if n is None or n < 0 or n > self._remaining:
+            n = self._remaining
+        if n == 0:
+            return b''
+        data = self._content.read(n)
+        self._remaining -= len(data)
+        return data
+
+    def readinto(self, b):
+        """Read bytes into a pre-allocated, writable bytes-like object."""
+        view = memoryview(b)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        n = self._content.readinto(view[:self._remaining])
+        self._remaining -= n
+        return n
+
+    def tell(self):
+        """Return the number of bytes read so far."""
+        return self._content.tell()
+
+    def skip(self):
+        """Skip the rest of content through to the boundary."""
+        skipped = min(self._remaining, self._content.skip())
+        self._remaining = 0
+        return skipped
+
+
+class ByteRangesStreamer(MIMEResponseStreamer):
+    """A streamer for `multipart/byteranges` responses.
+
+    The content of each part is read as the size given by its
+    `content-range` header, as :class:`RangeContent`. Parts without the
+    header are skipped.
+
+    Args:
+        resp (:class:`requests.Response`): A response to an HTTP
+            request for multiple byte ranges.
+
+        **kwargs: Passed to :class:`MIMEResponseStreamer`.
+
+    """
+
+    def __init__(self, resp, **kwargs):
+        super(ByteRangesStreamer, self).__init__(resp, **kwargs)
+        ct = parse_content_type(self.stream.resp.headers['content-type'])
+        if ct['mime-type'] != 'multipart/byteranges':
+            raise InvalidContentType(
+                'Content must be of multipart/byteranges type')
+
+    def _content_length(self, part):
+        if 'content-range' in part.headers:
+            start, end, _ = parse_content_range(part.headers['content-range'])
+            return end - start + 1
+        return super(ByteRangesStreamer, self)._content_length(part)
+
+    def _open_content(self, part, preload=False):
+        super(ByteRangesStreamer, self)._open_content(part, preload=preload)
+        if 'content-range' in part.headers:
+            start, end, _ = parse_content_range(part.headers['content-range'])
+            length = end - start + 1
+            if isinstance(part.content, bytes):
+                part.content = part.content[:length]
+            else:
+                part.content = RangeContent(part.content, length)
+
+    def iter_ranges(self, size=None):
+        """Iterate over the byte ranges.
+
+        Args:
+            size (`int`, optional): The expected total size of the
+                object. If omitted, the total size of the first range
+                known is expected of the rest.
+
+        Yields:
+            tuple: The first and last byte positions of the range, the
+                total size, which is `None` if unknown, and the
+                :class:`Part` whose content is the range.
+
+        Raises:
+            RangeError: When the total size of a range differs from
+                that expected, as when the object changed.
+
+        """
+        for part in self.iter_parts(
+                select=lambda headers: 'content-range' in headers):
+            start, end, total = parse_content_range(
+                part.headers['content-range'])
+            if total is not None:
+                if size is None:
+                    size = total
+                elif total != size:
+                    raise RangeError(
+                        'Object size changed from {} to {}'.format(
+                            size, total))
+            yield start, end, total, part
+
+    def write_to(self, target, size=None):
+        """Write each byte range to its offset in `target`.
+
+        Args:
+            target: The file descriptor, the file object open for
+                writing, or the writable buffer, e.g., `bytearray`, to
+                write the ranges to.
+
+            size (`int`, optional): The expected total size of the
+                object, as for :meth:`ByteRangesStreamer.iter_ranges`.
+
+        Returns:
+            list: The `(start, end)` byte positions of ranges written.
+
+        Raises:
+            ParsingError: When the content of a range is truncated.
+
+            RangeError: When the total size of a range differs from
+                that expected.
+
+        """
+        target = _as_target(target)
+        ranges = []
+        for start, end, _, part in self.iter_ranges(size):
+            length = end - start + 1
+            copied = _copy_range(part.content, target, start, length)
+            if copied != length:
+                raise ParsingError('Range {}-{} ended after {} bytes'.format(
+                    start, end, copied))
+            ranges.append((start, end))
+        log.debug('Wrote %d byte ranges', len(ranges))
+        return ranges
+
+
+def split_ranges(size, parts):
+    """Split `size` bytes into at most `parts` contiguous byte ranges.
+
+    Returns:
+        list: The `(start, end)` byte positions of ranges.
+
+    """
+    step = max(1, -(-size // max(1, parts)))
+    return [(start, min(start + step, size) - 1)
+            for start in range(0, size, step)]
+
+
+def _covers(received, requested):
+    """Test if the `received` ranges cover all the `requested` ranges."""
+    merged = []
+    for start, end in sorted(received):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return all(any(m[0] <= start and end <= m[1] for m in merged)
+               for start, end in requested)
+
+
+def _fetch(session, url, ranges, target, size, validator, kwargs):
+    """Fetch `ranges` of `url` in a request and write them to `target`."""
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers['Range'] = 'bytes=' + ','.join(
+        '{}-{}'.format(start, end) for start, end in ranges)
+    if validator:
+        headers['If-Range'] = validator
+
+    resp = session.get(url, headers=headers, stream=True, **kwargs)
+    try:
+        if resp.status_code != 206:
+            raise RangeError('Expected partial content for {}, got status {}'
+                             .format(headers['Range'], resp.status_code))
+
+        ct = resp.headers.get('content-type', '')
+        if ct.lower().startswith('multipart/byteranges'):
+            received = ByteRangesStreamer(resp).write_to(target, size)
+        else:
+            start, end, total = parse_content_range(
+                resp.headers.get('content-range'))
+            if total is not None and total != size:
+                raise RangeError('Object size changed from {} to {}'.format(
+                    size, total))
+            length = end - start + 1
+            copied = 0
+            for chunk in resp.iter_content(WRITE_CHUNK_SIZE):
+                chunk = chunk[:length - copied]
+                _write_at(target, start + copied, chunk)
+                copied += len(chunk)
+            if copied != length:
+                raise ParsingError('Range {}-{} ended after {} bytes'.format(
+                    start, end, copied))
+            received = [(start, end)]
+    finally:
+        resp.close()
+
+    if not _covers(received, ranges):
+        raise RangeError('Ranges {} not covered by {}'.format(
+            ranges, received))
+    return received
+
+
+def fetch_ranges(url, target=None, size=None, parts=4, ranges_per_request=1,
+                 max_workers=None, session=None, **kwargs):
+    """Fetch the object at `url` with byte range requests made in
+    parallel, writing each range to its offset in `target`.
+
+    Args:
+        url (str): The URL of the object.
+
+        target (optional): The path of the file to create or
+            overwrite, the file descriptor open for writing, or the
+            writable buffer to write the object to. If omitted, a
+            `bytearray` is allocated.
+
+        size (`int`, optional): The size of the object. If omitted, it
+            is taken from the `content-length` of a `HEAD` request.
+
+        parts (`int`, optional): The number of ranges to split the
+            object into.
+
+        ranges_per_request (`int`, optional): The number of ranges
+            asked for in each request, i.e., in a `multipart/byteranges`
+            response when more than one.
+
+        max_workers (`int`, optional): The number of worker threads.
+            Defaults to the number of requests.
+
+        session (:class:`requests.Session`, optional): The session to
+            use. If omitted, one is created for the call.
+
+        **kwargs: Passed to :meth:`requests.Session.get`.
+
+    Returns:
+        The target written to.
+
+    Raises:
+        RangeError: When a response does not carry the ranges
+            requested, e.g., because the object has changed.
+
+    """
+    owns_session = session is None
+    if owns_session:
+        session = Session()
+
+    fd = None
+    pool = None
+    try:
+        validator = None
+        if size is None:
+            resp = session.head(url, allow_redirects=True, **kwargs)
+            resp.raise_for_status()
+            size = int(resp.headers['content-length'])
+            validator = resp.headers.get('etag')
+            if validator and validator.startswith('W/'):
+                # Weak validators cannot be used with `If-Range`
+                validator = None
+
+        if target is None:
+            target = bytearray(size)
+        if isinstance(target, six.string_types):
+            fd = os.open(target, os.O_RDWR | os.O_CREAT, 0o666)
+            os.ftruncate(fd, size)
+            out = fd
+        else:
+            out = _as_target(target)
+            if not isinstance(out, (int, memoryview)):
+                raise TypeError('Target must be a path, a file descriptor '
+                                'or a writable buffer')
+
+        ranges = split_ranges(size, parts)
+        n = max(1, ranges_per_request)
+        batches = [ranges[i:i + n] for i in range(0, len(ranges), n)]
+        if not batches:
+            return target
+
+        pool = ThreadPool(min(max_workers or len(batches), len(batches)))
+        pool.map(lambda batch: _fetch(session, url, batch, out, size,
+                                      validator, dict(kwargs)),
+                 batches, chunksize=1)
+        log.debug('Fetched %d bytes of %s in %d requests',
+                  size, url, len(batches))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if fd is not None:
+            os.close(fd)
+        if owns_session:
+            session.close()
+    return target
@@ -39,3 +39,39 @@ class InvalidContentType(Exception):
 
 class NoPartError(Exception):
     """Raised when no more part exists in the message."""
+
+
+class ResumeError(Exception):
+    """Raised when a stream cannot be resumed from a checkpoint."""
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when buffered bytes would exceed the memory budget."""
+
+
+class LimitExceeded(ParsingError):
+    """Raised when the content exceeds a limit set by :class:`Limits`."""
+
+
+class HeaderLimitExceeded(LimitExceeded):
+    """Raised when the headers of a part are too large or too many."""
+
+
+class PartLimitExceeded(LimitExceeded):
+    """Raised when the message has too many parts."""
+
+
+class LineLengthExceeded(LimitExceeded):
+    """Raised when a line is too long."""
+
+
+class PartSizeExceeded(LimitExceeded):
+    """Raised when the content of a part is too large."""
+
+
+class TotalSizeExceeded(LimitExceeded):
+    """Raised when the message is too large."""
+
+
+class RangeError(Exception):
+    """Raised when a response does not carry the byte ranges requested."""
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""MIME Feed Parser
+===================
+
+An I/O-free incremental parser for MIME content. Data is pushed in
+chunks of any size with :meth:`MIMEFeedParser.feed`, which returns the
+events for the data parsed so far:
+
+.. code-block:: python
+
+    parser = MIMEFeedParser(boundary=b'MIME_boundary')
+
+    for chunk in transport_chunks:
+        for event in parser.feed(chunk):
+            if isinstance(event, PartHeaders):
+                ...
+            elif isinstance(event, PartData):
+                ...
+
+    events = parser.close()
+
+Parts are delimited as by :class:`MIMEStreamer`, i.e., the content of
+a part includes the new line preceding the boundary.
+
+"""
+from __future__ import absolute_import
+import logging
+from email.parser import HeaderParser
+
+from .exceptions import ParsingError
+from .mime_streamer import NL
+from .mime_streamer import Part
+from .utils import ensure_binary
+from .utils import ensure_str
+
+
+log = logging.getLogger(__name__)
+
+
+class Event(object):
+    """The base class of events emitted by :class:`MIMEFeedParser`."""
+
+    def __repr__(self):
+        return '<{}>'.format(self.__class__.__name__)
+
+
+class PartHeaders(Event):
+    """Emitted when the headers of a part have been parsed.
+
+    Attributes:
+        part (:class:`Part`): The part with headers and no content.
+
+    """
+
+    def __init__(self, part):
+        self.part = part
+
+    @property
+    def headers(self):
+        return self.part.headers
+
+
+class PartData(Event):
+    """Emitted for a slice of the content of the current part.
+
+    Attributes:
+        data (bytes): The content bytes.
+
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __repr__(self):
+        return '<{} {} bytes>'.format(self.__class__.__name__, len(self.data))
+
+
+class PartEnd(Event):
+    """Emitted when the content of the current part ends."""
+
+
+class MessageEnd(Event):
+    """Emitted when the message ends."""
+
+
+# Parser states
+PREAMBLE = 'preamble'
+HEADERS = 'headers'
+CONTENT = 'content'
+END = 'end'
+
+
+class MIMEFeedParser(object):
+    """The incremental push parser for MIME content.
+
+    Args:
+        boundary (`str`, optional): The MIME part boundary text. If
+            omitted, the content is expected to start with headers,
+            which may define the boundary for the rest of the content.
+
+    """
+
+    def __init__(self, boundary=None):
+        self._boundary = ensure_binary(boundary) if boundary else None
+        self._state = PREAMBLE if self._boundary else HEADERS
+        self._buff = bytearray()
+
+        # The position in `_buff` from which to resume searching
+        self._scan_from = 0
+
+        # Whether the head of `_buff` is the head of a line
+        self._line_start = True
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self._state)
+
+    @property
+    def state(self):
+        """str: The current parser state."""
+        return self._state
+
+    def feed(self, data):
+        """Feed a chunk of data into the parser.
+
+        Args:
+            data (bytes): The next chunk of the MIME content.
+
+        Returns:
+            list: The :class:`Event` objects for the data parsed.
+
+        """
+        if self._state == END:
+            return []
+        self._buff += data
+        events = []
+        while self._step(events):
+            pass
+        return events
+
+    def close(self):
+        """Signal the end of data.
+
+        Returns:
+            list: The :class:`Event` objects for the remaining data.
+
+        Raises:
+            ParsingError: When data ends while reading headers.
+
+        """
+        if self._state == END:
+            return []
+
+        events = []
+        if self._state == HEADERS and self._buff.strip():
+            raise ParsingError('EOF while reading headers')
+        if self._state == CONTENT:
+            if self._buff:
+                events.append(PartData(bytes(self._buff)))
+            events.append(PartEnd())
+        events.append(MessageEnd())
+        self._buff = bytearray()
+        self._state = END
+        return events
+
+    def _step(self, events):
+        """Advance the parser on buffered data.
+
+        Returns:
+            bool: Whether to continue processing buffered data.
+
+        """
+        if self._state == CONTENT:
+            return self._step_content(events)
+        elif self._state == HEADERS:
+            return self._step_headers(events)
+        elif self._state == PREAMBLE:
+            return self._step_preamble(events)
+        return False
+
+    def _find_delimiter(self):
+        """Find the boundary at the head of a line in buffer.
+
+        Returns:
+            int: The position of the boundary, or -1 if not found.
+
+        """
+        dash_boundary = b'--' + self._boundary
+        if self._line_start and self._buff.startswith(dash_boundary):
+            return 0
+        idx = self._buff.find(NL + dash_boundary, self._scan_from)
+        if idx < 0:
+            # Rescan the tail which may be the head of a delimiter
+            self._scan_from = max(
+                0, len(self._buff) - len(NL + dash_boundary) + 1)
+            return -1
+        return idx + len(NL)
+
+    def _consume_boundary(self, pos, events):
+        """Consume the boundary line at `pos` if it is complete.
+
+        Returns:
+            bool: `True` if consumed, `False` if more data is needed.
+
+        """
+        eol = self._buff.find(NL, pos)
+        if eol < 0:
+            return False
+        line = bytes(self._buff[pos:eol])
+        del self._buff[:eol + len(NL)]
+        self._scan_from = 0
+        self._line_start = True
+        log.debug('%r read boundary %r', self, line)
+        if line[len(self._boundary) + 2:].strip().startswith(b'--'):
+            events.append(MessageEnd())
+            self._state = END
+            return False
+        self._state = HEADERS
+        return True
+
+    def _step_preamble(self, events):
+        pos = self._find_delimiter()
+        if pos < 0:
+            # Discard the preamble except for a potential delimiter
+            if self._scan_from:
+                del self._buff[:self._scan_from]
+                self._line_start = False
+                self._scan_from = 0
+            return False
+        return self._consume_boundary(pos, events)
+
+    def _step_headers(self, events):
+        if self._buff.startswith(NL):
+            end = 0
+        else:
+            end = self._buff.find(NL + NL, self._scan_from)
+            if end < 0:
+                self._scan_from = max(0, len(self._buff) - len(NL + NL) + 1)
+                return False
+            end += len(NL)
+        raw = bytes(self._buff[:end])
+        del self._buff[:end + len(NL)]
+        self._scan_from = 0
+        self._line_start = True
+
+        headers = HeaderParser().parsestr(ensure_str(raw))
+        part = Part(headers)
+        log.debug('%r parsed headers %r', self, list(headers.items()))
+
+        if not self._boundary:
+            boundary = part.get_multipart_boundary()
+            if boundary:
+                log.debug('Found boundary from headers: %s', boundary)
+                self._boundary = ensure_binary(boundary)
+
+        events.append(PartHeaders(part))
+        self._state = CONTENT
+        return True
+
+    def _step_content(self, events):
+        if self._boundary is None:
+            # Content continues to the end of data
+            if self._buff:
+                events.append(PartData(bytes(self._buff)))
+                self._buff = bytearray()
+            return False
+
+        end = self._find_delimiter()
+        if end < 0:
+            # Emit all but the tail which may be the head of a delimiter
+            if self._scan_from:
+                events.append(PartData(bytes(self._buff[:self._scan_from])))
+                del self._buff[:self._scan_from]
+                self._line_start = False
+                self._scan_from = 0
+            return False
+
+        if end:
+            events.append(PartData(bytes(self._buff[:end])))
+            del self._buff[:end]
+            self._line_start = True
+        events.append(PartEnd())
+        self._scan_from = 0
+        self._state = PREAMBLE
+        return self._consume_boundary(0, events)
+
+
+def parse_chunks(chunks, boundary=None):
+    """Parse MIME content from an iterable of byte chunks.
+
+    Args:
+        chunks (iterable): The byte chunks of the MIME content.
+
+        boundary (`str`, optional): The MIME part boundary text.
+
+    Yields:
+        :class:`Event`: The parser events.
+
+    """
+    parser = MIMEFeedParser(boundary=boundary)
+    for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Limits
+=========
+
+Caps on the resources a malformed or hostile message may use before
+parsing fails:
+
+.. code-block:: python
+
+    limits = Limits(max_header_bytes=16 * 1024, max_parts=1000,
+                    max_line_length=1 << 20)
+
+    streamer = XOPResponseStreamer(resp, limits=limits)
+
+The limits are checked as data is read, so that parsing fails with a
+specific :class:`LimitExceeded` error as soon as one is exceeded,
+instead of after the offending data has been buffered entirely.
+
+"""
+from __future__ import absolute_import
+
+
+class Limits(object):
+    """The resource limits for parsing a message.
+
+    Each limit is disabled when `None`, which is the default.
+
+    Args:
+        max_header_bytes (`int`, optional): The maximum size in bytes
+            of the headers of a part. Exceeding it raises
+            :class:`HeaderLimitExceeded`.
+
+        max_headers (`int`, optional): The maximum number of header
+            fields in a part, not counting folded lines. Exceeding it
+            raises :class:`HeaderLimitExceeded`.
+
+        max_parts (`int`, optional): The maximum number of parts in
+            the message. Exceeding it raises
+            :class:`PartLimitExceeded`.
+
+        max_line_length (`int`, optional): The maximum size in bytes
+            of a line read line by line, including content without
+            `content-length`. Exceeding it raises
+            :class:`LineLengthExceeded`.
+
+        max_part_size (`int`, optional): The maximum size in bytes of
+            the content of a part. Exceeding it raises
+            :class:`PartSizeExceeded`.
+
+        max_total_bytes (`int`, optional): The maximum size in bytes
+            of the message. Exceeding it raises
+            :class:`TotalSizeExceeded`.
+
+    """
+
+    def __init__(self, max_header_bytes=None, max_headers=None,
+                 max_parts=None, max_line_length=None, max_part_size=None,
+                 max_total_bytes=None):
+        self.max_header_bytes = max_header_bytes
+        self.max_headers = max_headers
+        self.max_parts = max_parts
+        self.max_line_length = max_line_length
+        self.max_part_size = max_part_size
+        self.max_total_bytes = max_total_bytes
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(k, v) for k, v in sorted(vars(self).items())
+            if v is not None))
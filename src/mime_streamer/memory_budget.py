@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Memory Budget
+================
+
+A cap on the bytes buffered by many streamers in a process:
+
+.. code-block:: python
+
+    budget = MemoryBudget(64 * 1024 * 1024)
+
+    # In each thread
+    streamer = XOPResponseStreamer(resp, memory_budget=budget)
+
+    log.info('Buffered %d bytes', budget.usage)
+
+A streamer about to read more data from its response waits until the
+other streamers have consumed enough of their buffers (backpressure),
+or raises :class:`MemoryBudgetExceeded` with `policy='raise'`. A
+streamer charges the block of the response it is parsing, released at
+the end of content, and data it holds itself, such as the XOP manifest
+part. Content handed to the caller, whether read from a part or
+preloaded, is the caller's and is not charged. The limit may be overrun
+by up to a read chunk per streamer reading at the same time.
+
+A streamer never waits for bytes that cannot be released: those pinned
+for the lifetime of a streamer, like the XOP manifest part, and those
+buffered by streamers that are themselves waiting or that are driven
+by the waiting thread, e.g., two streamers read in turns by a single
+thread. If the wait cannot be satisfied by the rest, it fails at once.
+
+"""
+from __future__ import absolute_import
+import logging
+import threading
+import weakref
+from timeit import default_timer
+
+from .exceptions import MemoryBudgetExceeded
+
+
+log = logging.getLogger(__name__)
+
+
+BLOCK = 'block'
+"""str: The policy to wait for buffers to be consumed"""
+
+RAISE = 'raise'
+"""str: The policy to raise :class:`MemoryBudgetExceeded` at once"""
+
+POLL_INTERVAL = 0.5
+"""float: The maximum seconds to wait before checking usage again"""
+
+
+class MemoryBudget(object):
+    """The budget of bytes buffered across streamers.
+
+    Args:
+        limit (int): The maximum number of bytes buffered in total.
+
+        policy (`str`, optional): What to do when reading more data
+            would exceed the limit, either :data:`BLOCK` or
+            :data:`RAISE`.
+
+        timeout (`float`, optional): The maximum seconds to wait with
+            the :data:`BLOCK` policy before raising. Waits forever if
+            omitted.
+
+    """
+
+    def __init__(self, limit, policy=BLOCK, timeout=None):
+        if policy not in (BLOCK, RAISE):
+            raise ValueError('Unknown policy {!r}'.format(policy))
+        self.limit = limit
+        self.policy = policy
+        self.timeout = timeout
+        self._cond = threading.Condition()
+
+        # Accounts of streamers dropped without being closed go away
+        # along with their charges
+        self._accounts = weakref.WeakSet()
+
+    def __repr__(self):
+        return '<{} {}/{}>'.format(
+            self.__class__.__name__, self.usage, self.limit)
+
+    @property
+    def usage(self):
+        """int: The number of bytes currently buffered in total."""
+        with self._cond:
+            return self._usage()
+
+    def _usage(self):
+        return sum(account.usage for account in list(self._accounts))
+
+    def report(self):
+        """Report the current usage per account.
+
+        Returns:
+            dict: The number of bytes buffered keyed by account name.
+
+        """
+        with self._cond:
+            return dict((account.name, account.usage)
+                        for account in self._accounts)
+
+    def register(self, name=None):
+        """Register a new account to charge buffered bytes to.
+
+        Args:
+            name (`str`, optional): The name identifying the account.
+
+        Returns:
+            :class:`MemoryAccount`: The account.
+
+        """
+        account = MemoryAccount(self, name)
+        with self._cond:
+            self._accounts.add(account)
+        return account
+
+    def _unregister(self, account):
+        with self._cond:
+            self._accounts.discard(account)
+            account._charges.clear()
+            self._cond.notify_all()
+
+    def _charge(self, account, key, nbytes, pinned):
+        with self._cond:
+            released = nbytes < account._charges.get(key, 0)
+            account._charges[key] = nbytes
+            if pinned:
+                account._pinned.add(key)
+            else:
+                account._pinned.discard(key)
+            account._thread = threading.current_thread()
+            if released:
+                self._cond.notify_all()
+
+    def _releasable(self, account):
+        """The number of bytes that others may release for `account`."""
+        thread = threading.current_thread()
+        return sum(other.releasable for other in list(self._accounts)
+                   if other is not account and not other._waiting and
+                   other._thread is not thread)
+
+    def _reserve(self, account, nbytes):
+        with self._cond:
+            if account.usage + nbytes > self.limit:
+                # Waiting is futile when the account alone exceeds
+                raise MemoryBudgetExceeded(
+                    '{} would buffer {} bytes over the limit of {} bytes'
+                    .format(account, account.usage + nbytes, self.limit))
+
+            account._thread = threading.current_thread()
+            deadline = (None if self.timeout is None
+                        else default_timer() + self.timeout)
+            while 1:
+                usage = self._usage()
+                if usage + nbytes <= self.limit:
+                    return
+                if self.policy == RAISE:
+                    raise MemoryBudgetExceeded(
+                        'Buffering {} more bytes exceeds the limit of {} '
+                        'bytes ({} bytes in use)'.format(
+                            nbytes, self.limit, usage))
+                if usage - self._releasable(account) + nbytes > self.limit:
+                    raise MemoryBudgetExceeded(
+                        'Buffering {} more bytes exceeds the limit of {} '
+                        'bytes ({} bytes in use), and not enough bytes can '
+                        'be released by others'.format(
+                            nbytes, self.limit, usage))
+                wait = POLL_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - default_timer()
+                    if remaining <= 0:
+                        raise MemoryBudgetExceeded(
+                            'Timed out waiting for {} bytes within the '
+                            'limit of {} bytes'.format(nbytes, self.limit))
+                    wait = min(wait, remaining)
+                log.debug('%r waits for %d bytes', account, nbytes)
+                account._waiting = True
+                # Let the others waiting check if they wait on this one
+                self._cond.notify_all()
+                try:
+                    self._cond.wait(wait)
+                finally:
+                    account._waiting = False
+
+
+class MemoryAccount(object):
+    """The bytes buffered by a streamer, charged to a
+    :class:`MemoryBudget`. Create it with :meth:`MemoryBudget.register`.
+
+    """
+
+    def __init__(self, budget, name=None):
+        self.budget = budget
+        self.name = name or 'account-{:x}'.format(id(self))
+        self._charges = {}
+
+        # The keys of charges held for the lifetime of this account
+        self._pinned = set()
+
+        # The thread last charging or reserving bytes for this account,
+        # and whether it is waiting in :meth:`MemoryAccount.reserve`
+        self._thread = threading.current_thread()
+        self._waiting = False
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.name)
+
+    @property
+    def usage(self):
+        """int: The number of bytes charged to this account."""
+        return sum(self._charges.values())
+
+    @property
+    def releasable(self):
+        """int: The number of bytes charged but not pinned."""
+        return sum(nbytes for key, nbytes in list(self._charges.items())
+                   if key not in self._pinned)
+
+    def charge(self, key, nbytes, pinned=False):
+        """Set the number of bytes held for `key`.
+
+        This never waits; use :meth:`MemoryAccount.reserve` before
+        reading more data.
+
+        Args:
+            key (str): The name of what holds the bytes.
+
+            nbytes (int): The number of bytes held.
+
+            pinned (`bool`, optional): Whether the bytes are held until
+                the account is closed, so that waiting for them to be
+                released is futile.
+
+        """
+        self.budget._charge(self, key, nbytes, pinned)
+
+    def reserve(self, nbytes):
+        """Wait until `nbytes` more bytes can be buffered.
+
+        Raises:
+            MemoryBudgetExceeded: When the bytes cannot be buffered
+                within the budget.
+
+        """
+        self.budget._reserve(self, nbytes)
+
+    def close(self):
+        """Release all charges and unregister from the budget."""
+        self.budget._unregister(self)
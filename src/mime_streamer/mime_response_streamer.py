@@ -25,86 +25,266 @@
 """MIME Response Streamer
 =========================
 
+A response streamer can resume a download interrupted halfway. Given
+a callable that reopens the response from a byte offset with an HTTP
+`Range` request, dropped connections are reopened transparently, and
+a checkpoint taken with :meth:`MIMEStreamer.checkpoint` can be used to
+resume parsing later, possibly in another process:
+
+.. code-block:: python
+
+    def reopen(offset):
+        return requests.get(url, stream=True,
+                            headers={'Range': 'bytes={}-'.format(offset)})
+
+    streamer = XOPResponseStreamer(reopen(0), reopen=reopen)
+    ...
+    checkpoint = streamer.checkpoint()
+    ...
+    streamer = XOPResponseStreamer.resume(checkpoint, reopen)
+
 """
 from __future__ import absolute_import
+import base64
 import logging
 import re
-from itertools import chain
 
 # This is just to avoid making `requests` a requirement
 try:
     from requests.exceptions import StreamConsumedError
-    from requests.models import ITER_CHUNK_SIZE
 except ImportError:
-    ITER_CHUNK_SIZE = 512
     StreamConsumedError = Exception
 
 from .exceptions import InvalidContentType
+from .exceptions import ResumeError
+from .exceptions import TotalSizeExceeded
+from .mime_streamer import make_headers
 from .mime_streamer import MIMEStreamer
 from .mime_streamer import NL  # noqa
 from .mime_streamer import parse_content_type
+from .mime_streamer import Part
 from .mime_streamer import StreamIO
+from .transports import make_transport
 from .utils import ensure_binary
+from .utils import ensure_str
 
 
 log = logging.getLogger(__name__)
 
 
+_re_content_range = re.compile(r'^\s*bytes\s+(\d+)-')
+
+
+def reopen_response(reopen, offset):
+    """Reopen a response from `offset` and check that it is the content
+    requested.
+
+    Args:
+        reopen (`callable`): A callable taking the absolute byte offset
+            and returning a new response for the content from that
+            offset.
+
+        offset (`int`): The absolute byte offset to reopen from.
+
+    Returns:
+        :class:`Transport`: The reopened response.
+
+    Raises:
+        ResumeError: When the reopened response does not start at
+            `offset`.
+
+    """
+    resp = make_transport(reopen(offset))
+    if offset and resp.status_code != 206:
+        raise ResumeError(
+            'Expected partial content from offset {}, got status {}'
+            .format(offset, resp.status_code))
+    matched = _re_content_range.match(resp.headers.get('content-range', ''))
+    if matched and int(matched.group(1)) != offset:
+        raise ResumeError(
+            'Expected content range from offset {}, got {}'
+            .format(offset, resp.headers['content-range']))
+    return resp
+
+
 class ResponseStreamIO(StreamIO):
+    """Wrapper for an HTTP response exposing the readline interface of
+    :class:`StreamIO`.
 
-    def __init__(self, resp):
-        super(ResponseStreamIO, self).__init__(stream=None)
-        self.resp = resp
-        self._il = self.iter_lines()
-        self._previous_line = None
+    The chunks received from the transport are taken as the blocks of
+    :class:`StreamIO`, in which lines are found without splitting each
+    chunk into lines.
 
-    _re_newline = re.compile(br'.*(\r\n|\n|\r|\n\r)$')
+    Args:
+        resp: A streamed response to an HTTP request of any client
+            supported by :func:`make_transport`.
 
-    def iter_lines(self, chunk_size=ITER_CHUNK_SIZE, decode_unicode=None):
-        pending = None
-        for chunk in self.resp.iter_content(chunk_size=chunk_size,
-                                            decode_unicode=decode_unicode):
-            if pending is not None:
-                chunk = pending + chunk
+        reopen (`callable`, optional): A callable taking the absolute
+            byte offset and returning a new response for the content
+            from that offset, usually via a `Range` request. If given,
+            the response is reopened when the connection drops.
 
-            lines = chunk.splitlines(True)
+        offset (`int`, optional): The absolute offset of the first
+            byte of `resp` in the entire content.
 
-            # If the last element in lines should continue on to the
-            # next chunk to be read, keep it in pending
-            if lines and lines[-1] and not self._re_newline.match(lines[-1]):
-                pending = lines.pop()
-            else:
-                pending = None
+        max_retries (`int`, optional): The maximum number of times in
+            a row the response is reopened without receiving data.
 
-            for line in lines:
-                yield line
+        memory (:class:`MemoryAccount`, optional): The account to
+            charge the block buffered to. The block is charged as a
+            whole when received and released at the end of content, so
+            that the account is not updated on every read.
 
-        if pending is not None:
-            yield pending
+        limits (:class:`Limits`, optional): The limits on line length
+            and total bytes read.
 
-    def readline(self, length=None):
-        try:
-            line = next(self._il)
-        except (StopIteration, StreamConsumedError):
-            line = b''
-        else:
-            self._previous_line = line
-        return line
+    """
 
-    def rollback_line(self):
-        self._il = chain([self._previous_line], self._il)
+    def __init__(self, resp, reopen=None, offset=0, max_retries=3,
+                 memory=None, limits=None):
+        super(ResponseStreamIO, self).__init__(stream=None, limits=limits)
+        self.resp = make_transport(resp)
+        self._reopen = reopen
+        self._max_retries = max_retries
+        self._memory = memory
+        self._chunks = self.iter_content()
+
+        # The absolute offsets of the head of the buffer and of the
+        # next byte to be received from the response
+        self._base = offset
+        self._received = offset
+
+    def iter_content(self, chunk_size=None):
+        """Iterate over the response content, reopening the response from
+        the last byte received whenever the connection drops.
+
+        """
+        chunk_size = chunk_size or self.resp.chunk_size
+        retries = 0
+        while 1:
+            try:
+                chunks = self.resp.iter_chunks(chunk_size)
+                while 1:
+                    if self._memory is not None:
+                        self._memory.reserve(chunk_size)
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        return
+                    self._received += len(chunk)
+                    retries = 0
+                    yield chunk
+            except self.resp.resumable_errors:
+                if self._reopen is None or retries >= self._max_retries:
+                    raise
+                retries += 1
+                log.warning('Connection lost at offset %d; reopening',
+                            self._received, exc_info=True)
+                self.resp.close()
+                self.resp = reopen_response(self._reopen, self._received)
+
+    def iter_lines(self):
+        """Iterate over the lines of the rest of content."""
+        return iter(self.readline, b'')
+
+    def _fill(self):
+        self._base += len(self._buff)
+        self._buff = b''
+        self._pos = 0
+        if self._eof:
+            return False
+        try:
+            block = next(self._chunks, b'')
+        except StreamConsumedError:
+            block = b''
+        if not block:
+            self._eof = True
+            self._charge(0)
+            return False
+        self._buff = block
+        self._charge(len(block))
+        return True
+
+    def read(self, n):
+        """Read at most `n` bytes regardless of lines, a block at a time.
+
+        Returns:
+            str: The bytes read, which are fewer than `n` only at EOF.
+
+        """
+        pieces = []
+        size = 0
+        while 1:
+            available = len(self._buff) - self._pos
+            if size + available >= n:
+                end = self._pos + n - size
+                pieces.append(self._buff[self._pos:end])
+                self._pos = end
+                break
+            pieces.append(self._buff[self._pos:])
+            size += available
+            self._pos = len(self._buff)
+            if not self._fill():
+                break
+        if (self._max_total_bytes is not None and
+                self.tell() > self._max_total_bytes):
+            raise TotalSizeExceeded(
+                'Content exceeds {} bytes'.format(self._max_total_bytes))
+        return b''.join(pieces)
+
+    def unread(self, data):
+        super(ResponseStreamIO, self).unread(data)
+        self._charge(len(self._buff))
+
+    def _charge(self, nbytes):
+        """Charge the block buffered to memory account."""
+        if self._memory is not None:
+            self._memory.charge('stream', nbytes)
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        """Close the response, releasing its connection without reading
+        the rest of content.
+
+        """
+        self.resp.close()
+        if self._memory is not None:
+            self._memory.close()
 
 
 class MIMEResponseStreamer(MIMEStreamer):
-    """An adapter for use with :class:`requests.Response`.
+    """An adapter for use with HTTP responses.
 
     Args:
-        resp (:class:`requests.Response`): A response to an HTTP
-            request.
+        resp: A streamed response to an HTTP request, of
+            :mod:`requests`, :mod:`urllib3`, :mod:`http.client` or
+            :mod:`httpx` (see :func:`make_transport`).
+
+        reopen (`callable`, optional): A callable taking the absolute
+            byte offset and returning a new response for the content
+            from that offset (see :class:`ResponseStreamIO`).
+
+        checkpoint (`dict`, optional): The checkpoint to resume from.
+            Use :meth:`MIMEResponseStreamer.resume` instead of passing
+            this directly.
+
+        max_retries (`int`, optional): The maximum number of times in
+            a row the response is reopened without receiving data.
+
+        memory_budget (:class:`MemoryBudget`, optional): The budget
+            to register this streamer with, capping the bytes buffered
+            across streamers.
+
+        limits (:class:`Limits`, optional): The resource limits to
+            enforce while parsing. A response whose `content-length`
+            exceeds the total bytes limit is rejected up front.
 
     """
 
-    def __init__(self, resp):
+    def __init__(self, resp, reopen=None, checkpoint=None, max_retries=3,
+                 memory_budget=None, limits=None):
+        resp = make_transport(resp)
         ct = resp.headers['content-type']
         if ct.lower().startswith('multipart/'):
             ct = parse_content_type(ct)
@@ -113,31 +293,84 @@ class MIMEResponseStreamer(MIMEStreamer):
         else:
             boundary = None
 
-        super(MIMEResponseStreamer, self).__init__(resp, boundary=boundary)
+        self._reopen = reopen
+        self._max_retries = max_retries
+        self._start_offset = checkpoint['offset'] if checkpoint else 0
+
+        max_total_bytes = limits.max_total_bytes if limits else None
+        if max_total_bytes is not None:
+            try:
+                length = self._start_offset + int(
+                    resp.headers.get('content-length'))
+            except (TypeError, ValueError):
+                length = None
+            if length is not None and length > max_total_bytes:
+                raise TotalSizeExceeded(
+                    'Content length {} exceeds {} bytes'.format(
+                        length, max_total_bytes))
+        self._memory = None
+        if memory_budget is not None:
+            self._memory = memory_budget.register('{}-{:x}'.format(
+                self.__class__.__name__, id(self)))
+
+        super(MIMEResponseStreamer, self).__init__(
+            resp, boundary=boundary, checkpoint=checkpoint, limits=limits)
+
+    @classmethod
+    def resume(cls, checkpoint, reopen, **kwargs):
+        """Resume parsing from `checkpoint`.
+
+        Args:
+            checkpoint (`dict`): The checkpoint as returned by
+                :meth:`MIMEStreamer.checkpoint`.
+
+            reopen (`callable`): A callable taking the absolute byte
+                offset and returning a new response for the content
+                from that offset.
+
+        Returns:
+            :class:`MIMEResponseStreamer`: The streamer reading the
+                response reopened at the checkpoint offset.
+
+        """
+        resp = reopen_response(reopen, checkpoint['offset'])
+        return cls(resp, reopen=reopen, checkpoint=checkpoint, **kwargs)
 
     def init_stream_io(self, resp):
-        return ResponseStreamIO(resp)
+        return ResponseStreamIO(resp, reopen=self._reopen,
+                                offset=self._start_offset,
+                                max_retries=self._max_retries,
+                                memory=self._memory, limits=self.limits)
 
 
 class XOPResponseStreamer(MIMEResponseStreamer):
     """An adapter for handling `XML-binary optimized packaging`_ contents
-    via :class:`requests.Response`.
+    via HTTP responses.
 
     This streamer loads the first part of the multipart message
     corresponding to `application/xop+xml` and makes it available as
     :attr:`XOPResponseStreamer.manifest_part`.
 
     Args:
-        resp (:class:`requests.Response`): A response to an HTTP
-            request.
+        resp: A streamed response to an HTTP request (see
+            :class:`MIMEResponseStreamer`).
 
     .. _XML-binary optimized packaging:
         https://www.w3.org/TR/xop10/
 
     """
 
-    def __init__(self, resp):
-        super(XOPResponseStreamer, self).__init__(resp)
+    def __init__(self, resp, reopen=None, checkpoint=None, max_retries=3,
+                 memory_budget=None, limits=None):
+        super(XOPResponseStreamer, self).__init__(
+            resp, reopen=reopen, checkpoint=checkpoint,
+            max_retries=max_retries, memory_budget=memory_budget,
+            limits=limits)
+        if checkpoint is not None:
+            # The content has been validated before the checkpoint
+            self._restore_manifest_part(checkpoint['manifest'])
+            return
+
         if self._ct_params['mime-type'].lower() != 'multipart/related':
             raise InvalidContentType(
                 'Content must be of multipart/related type')
@@ -147,6 +380,25 @@ class XOPResponseStreamer(MIMEResponseStreamer):
 
         self._load_manifest_part()
 
+    def checkpoint(self):
+        state = super(XOPResponseStreamer, self).checkpoint()
+        state['manifest'] = {
+            'headers': [[k, v] for k, v in self.manifest_part.headers.items()],
+            'content': ensure_str(
+                base64.b64encode(self.manifest_part.content)),
+            'delimited': self.manifest_part.delimited,
+        }
+        return state
+
+    def _restore_manifest_part(self, state):
+        """Restore the manifest part saved in a checkpoint."""
+        part = Part(make_headers(state['headers']))
+        part.content = base64.b64decode(state['content'])
+        part._delimited = state.get('delimited', False)
+        self.manifest_part = part
+        if self._memory is not None:
+            self._memory.charge('manifest', len(part.content), pinned=True)
+
     def _load_manifest_part(self):
         """Load the first part of application/xop+xml."""
         # Forward to the first boundary line
@@ -154,13 +406,12 @@ class XOPResponseStreamer(MIMEResponseStreamer):
         while not self._is_boundary(line):
             line = self.stream.readline()
 
-        with self.get_next_part() as part:
-            content = part.content.read()
-
-        if not part.headers['content-type'].lower().startswith(
-                'application/xop+xml'):
+        part = self._next_part()
+        if part is None or part.mime_type != 'application/xop+xml':
             raise InvalidContentType(
                 'Initial content type must be application/xop+xml')
 
-        part.content = content
+        self._open_content(part, preload=True)
         self.manifest_part = part
+        if self._memory is not None:
+            self._memory.charge('manifest', len(part.content), pinned=True)
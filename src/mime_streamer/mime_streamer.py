@@ -27,17 +27,34 @@
 
 """
 from __future__ import absolute_import
+import codecs
 import logging
+import os
 import re
 from contextlib import contextmanager
+from email.message import Message
 from email.parser import HeaderParser
 try:
     from StringIO import StringIO
 except ImportError:
     from io import BytesIO as StringIO
 
+from six.moves.urllib.parse import unquote
+
+# This is just to avoid making `numpy` a requirement
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .exceptions import HeaderLimitExceeded
+from .exceptions import LineLengthExceeded
 from .exceptions import NoPartError
 from .exceptions import ParsingError
+from .exceptions import PartLimitExceeded
+from .exceptions import PartSizeExceeded
+from .exceptions import TotalSizeExceeded
+from .limits import Limits
 from .utils import ensure_binary
 from .utils import ensure_str
 
@@ -49,6 +66,25 @@ NL = b'\r\n'
 """byte: The new line byte(s) used to delimit lines"""
 
 
+ARRAY_CHUNK_SIZE = 1 << 20
+"""int: The size in bytes by which an array of unknown size grows"""
+
+WRITE_CHUNK_SIZE = 1 << 20
+"""int: The size in bytes of blocks written to files"""
+
+READ_BLOCK_SIZE = 1 << 16
+"""int: The size in bytes of blocks read for content of known length"""
+
+TEXT_CHUNK_SIZE = 1 << 16
+"""int: The size in bytes of content chunks decoded at a time as text"""
+
+DEFAULT_CHARSET = 'utf-8'
+"""str: The charset of text assumed when `content-type` specifies none"""
+
+
+re_unsafe_filename = re.compile(r'[^A-Za-z0-9._@-]')
+
+
 re_split_content_type = re.compile(br'(;|' + NL + b')')
 
 
@@ -77,6 +113,41 @@ def parse_content_type(text):
     return d
 
 
+def parse_content_id(text):
+    """Normalize a `content-id` header value or a `cid:` URL.
+
+    Args:
+        text (str): The `content-id` text, e.g., `<foo@example.org>`,
+            or the `cid:` URL referring to it.
+
+    Returns:
+        str: The content ID without the angle brackets.
+
+    """
+    text = ensure_str(text).strip()
+    if text[:4].lower() == 'cid:':
+        text = unquote(text[4:])
+    if text.startswith('<') and text.endswith('>'):
+        text = text[1:-1]
+    return text
+
+
+def make_headers(items):
+    """Make part headers from `(name, value)` pairs.
+
+    Args:
+        items (list): The header name and value pairs.
+
+    Returns:
+        :class:`email.message.Message`: The headers.
+
+    """
+    headers = Message()
+    for k, v in items:
+        headers[k] = v
+    return headers
+
+
 class Part(object):
     """A part constituting (multipart) message."""
 
@@ -84,6 +155,10 @@ class Part(object):
         self._headers = headers or {}
         self._content = None
 
+        # Whether preloaded content ends with the new line preceding the
+        # boundary
+        self._delimited = False
+
     @property
     def content(self):
         return self._content
@@ -96,15 +171,298 @@ class Part(object):
     def headers(self):
         return self._headers
 
+    def strip_delimiter(self):
+        """Exclude the new line preceding the boundary from the rest of
+        content.
+
+        Content read from the stream otherwise ends with that new line,
+        which is not known to be part of the delimiter until the
+        boundary is read. Preloaded content includes it as well, being
+        the same as the content read from the stream, and is replaced
+        with the content without it.
+
+        """
+        content = self._content
+        if isinstance(content, bytes):
+            if self._delimited:
+                self._content = content[:-len(NL)]
+                self._delimited = False
+        elif hasattr(content, 'strip_delimiter'):
+            content.strip_delimiter = True
+
+    @property
+    def delimited(self):
+        """bool: Whether the content read ends with the new line
+        preceding the boundary, as :attr:`StreamContent.delimited`.
+
+        """
+        if isinstance(self._content, bytes):
+            return self._delimited
+        return getattr(self._content, 'delimited', False)
+
+    def _preloaded_size(self):
+        """Get the size of preloaded content less the new line preceding
+        the boundary, so that it is read without being copied.
+
+        """
+        size = len(self._content)
+        if self._delimited:
+            size -= len(NL)
+        return size
+
+    @property
+    def content_id(self):
+        """str: The content ID without the angle brackets, if any."""
+        if 'content-id' in self.headers:
+            return parse_content_id(self.headers['content-id'])
+
+    @property
+    def mime_type(self):
+        """str: The lower-cased MIME type from `content-type`, if any."""
+        if 'content-type' in self.headers:
+            return parse_content_type(
+                self.headers['content-type'])['mime-type']
+
+    @property
+    def content_length(self):
+        """int: The size of content from `content-length`, if valid."""
+        try:
+            length = int(self.headers['content-length'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return length if length >= 0 else None
+
+    @property
+    def charset(self):
+        """str: The charset from `content-type`, if any."""
+        if 'content-type' in self.headers:
+            pars = parse_content_type(self.headers['content-type'])
+            for k, v in pars.items():
+                if k.lower() == 'charset' and v:
+                    return v
+
+    def text_stream(self, encoding=None, errors='strict',
+                    chunk_size=TEXT_CHUNK_SIZE):
+        """Iterate over the rest of content decoded as text.
+
+        The content is read in chunks of `chunk_size` bytes and decoded
+        with an incremental decoder, which carries a multibyte sequence
+        split across chunks over to the next, so that text of any size
+        is decoded in bounded memory. The new line preceding the
+        boundary is excluded, as by :meth:`Part.strip_delimiter`, since
+        it is not encoded in the charset of content.
+
+        Args:
+            encoding (`str`, optional): The encoding overriding the
+                charset from `content-type`. If neither is given,
+                :data:`DEFAULT_CHARSET` is assumed.
+
+            errors (`str`, optional): The error handling scheme, as for
+                :meth:`bytes.decode`.
+
+            chunk_size (`int`, optional): The size in bytes of content
+                chunks decoded at a time.
+
+        Yields:
+            str: The decoded text.
+
+        Raises:
+            LookupError: When the encoding is unknown.
+
+            UnicodeDecodeError: When the content is invalid in the
+                encoding and `errors` is `'strict'`.
+
+        """
+        encoding = encoding or self.charset or DEFAULT_CHARSET
+        decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+
+        content = self._content
+        if isinstance(content, bytes):
+            size = self._preloaded_size()
+            chunks = (content[i:min(i + chunk_size, size)]
+                      for i in range(0, size, chunk_size))
+        else:
+            self.strip_delimiter()
+            chunks = iter(lambda: content.read(chunk_size), b'')
+
+        for chunk in chunks:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+    def read_array(self, dtype, shape=None, chunk_size=ARRAY_CHUNK_SIZE):
+        """Read the rest of content into a NumPy array.
+
+        The array is allocated up front and filled in place, without
+        the content being read into intermediate bytes. Its size is
+        taken from `shape` if given, or else from `content-length`. The
+        content is read up to where the parser finds its end, so that
+        the array grows by `chunk_size` bytes as the content is read if
+        the size is unknown or the boundary is not found at
+        `content-length`. The new line preceding the boundary is
+        excluded, as by :meth:`Part.strip_delimiter`.
+
+        Args:
+            dtype (:class:`numpy.dtype`): The data type of elements.
+
+            shape (tuple, optional): The shape of the array.
+
+            chunk_size (`int`, optional): The size in bytes by which
+                the array grows when its size is unknown.
+
+        Returns:
+            :class:`numpy.ndarray`: The array.
+
+        Raises:
+            ValueError: When the content size does not match the array
+                size.
+
+        """
+        if numpy is None:
+            raise ImportError('numpy is required to read content as array')
+
+        dtype = numpy.dtype(dtype)
+        if isinstance(self._content, bytes):
+            arr = numpy.frombuffer(
+                memoryview(self._content)[:self._preloaded_size()],
+                dtype=dtype)
+            return arr.reshape(shape) if shape is not None else arr
+
+        self.strip_delimiter()
+
+        if shape is not None:
+            arr = numpy.empty(shape, dtype=dtype)
+            nbytes = self._content.readinto(arr.reshape(-1).view(numpy.uint8))
+            if nbytes != arr.nbytes:
+                raise ValueError('Content ended after {} of {} bytes'.format(
+                    nbytes, arr.nbytes))
+            if self._content.read(1):
+                raise ValueError('Content exceeds {} bytes'.format(
+                    arr.nbytes))
+            return arr
+
+        capacity = chunk_size
+        length = self.content_length
+        if length is not None:
+            if hasattr(self._content, 'tell'):
+                # The rest of content after what has been read
+                length = max(0, length - self._content.tell())
+            # A byte more shows the end of content without growing
+            capacity = length + 1
+
+        buff = numpy.empty(capacity, dtype=numpy.uint8)
+        size = 0
+        while 1:
+            nbytes = self._content.readinto(buff[size:])
+            size += nbytes
+            if size < len(buff):
+                break
+            buff.resize(len(buff) + chunk_size, refcheck=False)
+        if size % dtype.itemsize:
+            raise ValueError(
+                'Content size {} is not a multiple of item size {}'
+                .format(size, dtype.itemsize))
+        buff.resize(size, refcheck=False)
+        return buff.view(dtype)
+
+    def save_to(self, target, fsync=False, chunk_size=WRITE_CHUNK_SIZE):
+        """Write the rest of content to a file.
+
+        The content is read in blocks of `chunk_size` bytes into a
+        reusable buffer and written straight to the file descriptor.
+        If `content-length` is known, the file space is preallocated
+        with :func:`os.posix_fallocate` where supported. The content is
+        written up to where the parser finds its end, which differs from
+        `content-length` if the boundary is not found there. The new
+        line preceding the boundary is excluded, as by
+        :meth:`Part.strip_delimiter`.
+
+        Args:
+            target (`str` or `int`): The path of the file to create or
+                overwrite, or the file descriptor open for writing.
+
+            fsync (`bool`, optional): Whether to flush the file to disk
+                before returning.
+
+            chunk_size (`int`, optional): The size in bytes of blocks
+                to write.
+
+        Returns:
+            int: The number of bytes written.
+
+        """
+        owns_fd = not isinstance(target, int)
+        if owns_fd:
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        else:
+            fd = target
+
+        content = self._content
+        if isinstance(content, bytes):
+            length = self._preloaded_size()
+        else:
+            self.strip_delimiter()
+            length = self.content_length
+            if length is not None and hasattr(content, 'tell'):
+                # The rest of content after what has been read
+                length = max(0, length - content.tell())
+
+        try:
+            start = os.lseek(fd, 0, os.SEEK_CUR)
+            preallocated = False
+            if length and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, start, length)
+                    preallocated = True
+                except OSError:
+                    log.debug('Preallocation unsupported', exc_info=True)
+
+            if isinstance(content, bytes):
+                written = _write_all(fd, memoryview(content)[:length])
+            elif hasattr(content, 'readinto'):
+                written = 0
+                buff = bytearray(chunk_size)
+                view = memoryview(buff)
+                while 1:
+                    n = content.readinto(buff)
+                    if n == 0:
+                        break
+                    written += _write_all(fd, view[:n])
+            else:
+                written = 0
+                for chunk in iter(lambda: content.read(chunk_size), b''):
+                    written += _write_all(fd, memoryview(chunk))
+
+            if preallocated and written < length:
+                # Drop the space preallocated but not filled
+                os.ftruncate(fd, start + written)
+            if fsync:
+                os.fsync(fd)
+        finally:
+            if owns_fd:
+                os.close(fd)
+
+        log.debug('Saved %d bytes of content', written)
+        return written
+
     def flush_content(self):
         """Read the entire stream for this part to ensure the cursor points to
         the byte right after the end of the content or the part.
 
         """
+        if isinstance(self._content, bytes):
+            # The content has been loaded entirely
+            return
+
         chunk_size = 256
         chunk = None
         flushed = 0
         try:
+            if hasattr(self._content, 'skip'):
+                flushed = self._content.skip()
             while chunk != b'':
                 chunk = self._content.read(chunk_size)
                 flushed += len(chunk)
@@ -126,6 +484,33 @@ class Part(object):
                 return pars.get('boundary')
 
 
+def _write_all(fd, view):
+    """Write all bytes in `view` to `fd`, returning the bytes written."""
+    total = len(view)
+    while view:
+        n = os.write(fd, view)
+        view = view[n:]
+    return total
+
+
+def _fsync_paths(paths):
+    """Flush files and their directories to disk."""
+    dirs = set()
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        dirs.add(os.path.dirname(os.path.abspath(path)))
+    for path in dirs:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
 class StreamContent(object):
     """The iterator interface for reading content from a
     :class:`MIMEStreamer` object.
@@ -134,20 +519,85 @@ class StreamContent(object):
         streamer (:class:`MIMEStreamer`): The streamer object
             representing the MIME content.
 
+        offset (`int`, optional): The number of content bytes already
+            consumed before this object was created. This is non-zero
+            only for a part resumed from a checkpoint.
+
+        line_start (`bool`, optional): Whether the stream is positioned
+            at the head of a line. If `False`, the first line read is
+            the remainder of a line and is never taken for a boundary.
+
+        cr_ended (`bool`, optional): Whether the last byte consumed
+            before this object was created is a CR. If so, a LF read
+            first completes that line, and what follows starts a new
+            line, which may be a boundary.
+
+        length (`int`, optional): The content length, if known. The
+            content is then read in blocks without checking each line
+            for a boundary, and the boundary is expected right after.
+            If it is not, the rest of content is read line by line.
+
+        strip_delimiter (`bool`, optional): Whether to exclude the new
+            line preceding the boundary from content. It is otherwise
+            included, being indistinguishable from content until the
+            boundary is read. This may also be set later as the
+            attribute of the same name, affecting the rest of content.
+
+    If the underlying stream is seekable, the content supports
+    :meth:`StreamContent.seek` within the bounds of the part, so that
+    formats needing random access, e.g., ZIP archives, can be read in
+    place. The end of content is found on the first seek, directly if
+    the content length is known or else by scanning up to the boundary.
+
     """
 
-    def __init__(self, streamer):
+    def __init__(self, streamer, offset=0, line_start=True, cr_ended=False,
+                 length=None, strip_delimiter=False):
         self._streamer = streamer
 
         # The buffer storing current line
         self._buff = b''
 
-        # The character position last read from `_buff`
+        # The character position next to be read from `_buff`
         self._pos = 0
 
         # Boolean flag of whether EOF/boundary has been seen or not
         self._eof_seen = False
 
+        # Boolean flag of whether the content ended at a boundary
+        self._boundary_seen = False
+
+        # The number of content bytes consumed so far
+        self._consumed = offset
+
+        # Boolean flag of whether the next line read continues a line
+        self._midline = not line_start
+
+        # Whether the new line preceding the boundary is excluded from
+        # content, and whether the new line ending the last line read is
+        # withheld until the next line shows if it precedes a boundary
+        self.strip_delimiter = strip_delimiter
+        self._held_new_line = False
+
+        # Boolean flags of whether the byte preceding `_buff` is a CR,
+        # and whether the next line read may complete a CRLF split at
+        # a checkpoint
+        self._cr_ended = cr_ended
+        self._split_crlf = cr_ended
+
+        # The number of bytes left to read in blocks, if length is known
+        self._remaining = length
+
+        # The number of content bytes read from stream so far, and the
+        # limit on it
+        self._size = offset
+        self._max_size = streamer.limits.max_part_size
+
+        # The absolute offsets of the head of content in stream, and of
+        # the end of content once known
+        self._start = streamer.stream.tell() - offset
+        self._end = None
+
     def __repr__(self):
         return '<{}>'.format(self.__class__.__name__)
 
@@ -157,6 +607,16 @@ class StreamContent(object):
     def __next__(self):
         return self.next()
 
+    @property
+    def delimited(self):
+        """bool: Whether the content read ended with the new line
+        preceding the boundary, i.e., the boundary has been read after
+        some content and the new line was not stripped.
+
+        """
+        return (self._boundary_seen and not self.strip_delimiter and
+                self._size > 0)
+
     def next(self):
         """Read a byte from stream.
 
@@ -167,31 +627,212 @@ class StreamContent(object):
             StopIteration: When EOF is reached.
 
         """
-        if self._eof_seen:
+        if self._pos >= len(self._buff) and not self._fill():
             raise StopIteration
 
-        if self._pos + 1 >= len(self._buff):
-            # The cursor points past the current line in the buffer,
-            # so read in the new line
-            line = self._streamer.stream.readline()
+        c = self._buff[self._pos:self._pos+1]
+        self._pos += 1
+        self._consumed += 1
+        return c
+
+    def _fill(self):
+        """Read in the next line of content into the buffer.
+
+        Returns:
+            bool: `False` if EOF/boundary is reached, `True` otherwise.
+
+        """
+        if self._eof_seen:
+            return False
+
+        if self._remaining is not None:
+            if self._remaining > 0:
+                return self._fill_block()
+            self._remaining = None
+            if self._end is not None:
+                # Read up to the end of content found before, which
+                # may fall short of the delimiter when stripped
+                self._eof_seen = True
+                if self._streamer.stream.tell() != self._end:
+                    self._streamer.stream.seek(self._end)
+                return False
+            if not self._check_delimiter():
+                log.warning('%r did not find boundary at content length; '
+                            'reading on up to boundary', self)
+
+        stream = self._streamer.stream
+        while 1:
+            # The cursor points past the current line in the buffer, so
+            # read in the new line
+            line = stream.readline()
             log.debug('%r read: %r%s',
                       self, line[:76], '...' if len(line) > 76 else '')
 
-            if self._streamer._is_boundary(line):
+            if self._split_crlf:
+                # The LF completing the line resumed in the middle of
+                # CRLF is followed by a new line
+                self._split_crlf = False
+                if line.startswith(b'\n') and len(line) > 1:
+                    stream.unread(line[1:])
+                    line = line[:1]
+
+            if not self._midline and self._streamer._is_boundary(line):
                 log.debug('%r detected boundary', self)
-                self._streamer.stream.rollback_line()
+                stream.rollback_line()
                 self._eof_seen = True
-                raise StopIteration
+                self._boundary_seen = True
+                self._end = stream.tell()
+                # The new line withheld is part of the delimiter
+                self._held_new_line = False
+                return False
             elif line == b'':
                 self._eof_seen = True
-                raise StopIteration
+                self._end = stream.tell()
+                if not self._held_new_line:
+                    return False
+                line = b''
+            else:
+                self._size += len(line)
+                if (self._max_size is not None and
+                        self._size > self._max_size):
+                    raise PartSizeExceeded(
+                        'Part content exceeds {} bytes'.format(
+                            self._max_size))
+
+            if self._held_new_line:
+                # Not followed by a boundary, so the new line is content
+                self._held_new_line = False
+                line = NL + line
+            if (self.strip_delimiter and not self._eof_seen and
+                    line.endswith(NL)):
+                line = line[:-len(NL)]
+                self._held_new_line = True
+                if not line:
+                    # Only the new line was read, ending a line
+                    self._midline = False
+                    continue
 
+            self._cr_ended = self._buff.endswith(b'\r')
             self._buff = line
             self._pos = 0
+            self._midline = False
+            return True
+
+    def _fill_block(self):
+        """Read in the next block of content of known length."""
+        stream = self._streamer.stream
+        block = stream.read(min(self._remaining, READ_BLOCK_SIZE))
+        if block == b'':
+            log.warning('%r reached EOF before content length', self)
+            self._remaining = None
+            self._eof_seen = True
+            self._end = stream.tell()
+            return False
+
+        # Guard against a content length running past the boundary,
+        # unless the end of content is known
+        idx = -1
+        if self._end is None:
+            idx = self._find_delimiter(block)
+        if idx >= 0:
+            log.warning('%r found boundary within content length', self)
+            if idx > len(block):
+                # The new line preceding the boundary straddles blocks
+                block += stream.read(idx - len(block))
+            stream.unread(block[idx:])
+            block = block[:idx]
+            self._remaining = None
+            if self.strip_delimiter:
+                # Leave the new line to be withheld as a line
+                stream.unread(NL)
+                block = block[:-len(NL)]
+                if not block:
+                    return self._fill()
         else:
-            self._pos += 1
+            self._remaining -= len(block)
+
+        self._size += len(block)
+        if self._max_size is not None and self._size > self._max_size:
+            raise PartSizeExceeded(
+                'Part content exceeds {} bytes'.format(self._max_size))
+
+        self._cr_ended = self._buff.endswith(b'\r')
+        self._buff = block
+        self._pos = 0
+        self._midline = not block.endswith(NL)
+        return True
+
+    def _find_delimiter(self, block):
+        """Find the boundary line starting in `block` or right after it.
+
+        The stream is looked ahead past `block` by the size of the
+        delimiter less a byte, so that a delimiter straddling blocks is
+        found as well.
+
+        Returns:
+            int: The position in `block` of the head of the boundary
+                line, which may be past the end of `block` by the size
+                of a partial new line, or -1 if not found.
+
+        """
+        stream = self._streamer.stream
+        dash_boundary = b'--' + self._streamer._boundary
+        data = block + stream.peek(len(NL + dash_boundary) - 1)
+        if not self._midline and data.startswith(dash_boundary):
+            return 0
+        # The delimiter right after `block` is left to the next block
+        idx = data.find(NL + dash_boundary, 0, len(block) + len(NL) - 1 +
+                        len(dash_boundary))
+        return idx + len(NL) if 0 <= idx < len(block) else -1
+
+    def _check_delimiter(self):
+        """Check that the stream is at the new line preceding a boundary.
+
+        Returns:
+            bool: `True` if so, `False` otherwise; the stream position
+                is unchanged.
+
+        """
+        stream = self._streamer.stream
+        line = stream.readline()
+        if line != NL:
+            stream.unread(line)
+            return False
+        next_line = stream.readline()
+        stream.unread(next_line)
+        stream.unread(line)
+        if next_line == b'' or self._streamer._is_boundary(next_line):
+            # The new line is the last line of content in this parser
+            self._midline = False
+            self._boundary_seen = next_line != b''
+            return True
+        return False
+
+    def skip(self):
+        """Skip the rest of content a line or block at a time.
 
-        return self._buff[self._pos:self._pos+1]
+        Returns:
+            int: The number of bytes skipped.
+
+        """
+        if self._end is not None and not self._eof_seen:
+            # Moved back by seek, so jump straight to the end
+            skipped = self._end - self._start - self._consumed
+            self._streamer.stream.seek(self._end)
+            self._buff = b''
+            self._pos = 0
+            self._remaining = None
+            self._eof_seen = True
+            self._consumed += skipped
+            return skipped
+
+        skipped = len(self._buff) - self._pos
+        self._pos = len(self._buff)
+        while self._fill():
+            skipped += len(self._buff)
+            self._pos = len(self._buff)
+        self._consumed += skipped
+        return skipped
 
     def read(self, n=-1):
         """Read at most `n` bytes, returned as string.
@@ -206,33 +847,195 @@ class StreamContent(object):
 
         """
         assert n != 0
-        buff = b''
-        # iter(int, 1) is a way to create an infinite loop
-        iterator = range(n) if n > 0 else iter(int, 1)
-        for i in iterator:
-            try:
-                c = next(self)
-            except StopIteration:
+        chunks = []
+        size = 0
+        while n < 0 or size < n:
+            if self._pos >= len(self._buff) and not self._fill():
+                break
+            end = len(self._buff)
+            if n > 0:
+                end = min(end, self._pos + n - size)
+            if self._pos == 0 and end == len(self._buff):
+                chunk = self._buff
+            else:
+                chunk = self._buff[self._pos:end]
+            chunks.append(chunk)
+            size += len(chunk)
+            self._pos = end
+        self._consumed += size
+        return b''.join(chunks)
+
+    def readinto(self, b):
+        """Read bytes into a pre-allocated, writable bytes-like object.
+
+        Args:
+            b (bytes-like): The buffer to fill, e.g., `bytearray`.
+
+        Returns:
+            int: The number of bytes read, which is less than the size
+                of `b` only when EOF or part boundary is reached.
+
+        """
+        view = memoryview(b)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        size = len(view)
+        n = 0
+        while n < size:
+            if self._pos >= len(self._buff) and not self._fill():
                 break
-            buff += c
-        return buff
+            k = min(size - n, len(self._buff) - self._pos)
+            view[n:n + k] = self._buff[self._pos:self._pos + k]
+            self._pos += k
+            n += k
+        self._consumed += n
+        return n
+
+    def tell(self):
+        """Return the number of content bytes consumed so far."""
+        return self._consumed
+
+    def seekable(self):
+        """Return whether the content supports random access."""
+        return self._streamer.stream.seekable()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to the content byte at `offset`.
+
+        Positions past the end of content are clamped to the end.
+
+        Args:
+            offset (int): The offset relative to `whence`.
+
+            whence (`int`, optional): One of :data:`os.SEEK_SET`,
+                :data:`os.SEEK_CUR` and :data:`os.SEEK_END`, relative to
+                the head of content, the current position and the end
+                of content, respectively.
+
+        Returns:
+            int: The new position in content.
+
+        Raises:
+            IOError: When the stream is not seekable.
+
+            ValueError: When the position would be negative.
+
+        """
+        if not self.seekable():
+            raise IOError('Content stream is not seekable')
+
+        size = self._find_end() - self._start
+        if self.strip_delimiter and self._boundary_seen:
+            size -= len(NL)
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._consumed + offset
+        elif whence == os.SEEK_END:
+            pos = size + offset
+        else:
+            raise ValueError('Invalid whence: {!r}'.format(whence))
+        if pos < 0:
+            raise ValueError('Negative seek position {}'.format(pos))
+        pos = min(pos, size)
+
+        self._streamer.stream.seek(self._start + pos)
+        self._buff = b''
+        self._pos = 0
+        self._remaining = size - pos
+        self._eof_seen = False
+        self._held_new_line = False
+        self._midline = False
+        self._consumed = pos
+        self._size = pos
+        return pos
+
+    def _find_end(self):
+        """Find the absolute offset of the end of content, leaving the
+        position in content unchanged.
+
+        """
+        if self._end is not None:
+            return self._end
+
+        stream = self._streamer.stream
+        if self._remaining is not None:
+            # Look for the boundary right after the content length
+            offset = stream.tell()
+            stream.seek(offset + self._remaining)
+            if self._check_delimiter():
+                self._end = stream.tell() + len(NL)
+            stream.seek(offset)
+
+        if self._end is None:
+            consumed = self._consumed
+            self.skip()
+            self._consumed = consumed
+        return self._end
+
+    def _unread(self):
+        """The number of bytes read from stream but not yet consumed."""
+        return (len(self._buff) - self._pos +
+                (len(NL) if self._held_new_line else 0))
+
+    def _state(self):
+        """Return the state of this object for use in a checkpoint."""
+        if self._pos:
+            cr_ended = self._buff[self._pos - 1:self._pos] == b'\r'
+        else:
+            cr_ended = self._cr_ended
+        return {
+            'offset': self._consumed,
+            'line_start': self._unread() == 0 and not self._midline,
+            'cr_ended': cr_ended,
+        }
 
 
 class StreamIO(object):
     """Wrapper for file-like object exposing only readline-related
     interface suitable for use with :class:`MIMEStreamer`.
 
+    The stream is read ahead in blocks, in which lines are found with
+    :meth:`bytes.find`, so that the cost of reading a line is linear in
+    its size no matter how many bare LF bytes it contains. A block is
+    read with `read1` if the stream has it, so that lines available
+    from a pipe or socket are returned without waiting for the block
+    to fill up. The stream need not be seekable; its position is asked
+    only once, to report absolute offsets.
+
     Args:
         stream (file): File-like object of byte stream.
 
+        limits (:class:`Limits`, optional): The limits on line length
+            and total bytes read.
+
     """
 
-    def __init__(self, stream):
+    block_size = READ_BLOCK_SIZE
+    """int: The size in bytes of blocks read ahead from the stream"""
+
+    def __init__(self, stream, limits=None):
         self.stream = stream
+        limits = limits or Limits()
+        self._max_line_length = limits.max_line_length
+        self._max_total_bytes = limits.max_total_bytes
+
+        # The block last read from the stream, and the position in it
+        # of the next byte to be returned
+        self._buff = b''
+        self._pos = 0
+
+        # The absolute offset of the head of `_buff`
+        try:
+            self._base = stream.tell() if stream is not None else 0
+        except (AttributeError, IOError, OSError):
+            self._base = 0
+
+        # Boolean flag of whether the stream has reached EOF
+        self._eof = False
 
-        # Points to the head position of the line just read by
-        # :meth:`StreamIO.readline`.
-        self._head_of_last_line = None
+        # The line just read by :meth:`StreamIO.readline`
+        self._last_line = b''
 
     def __iter__(self):
         return self
@@ -243,6 +1046,26 @@ class StreamIO(object):
     def next(self):
         return self.readline()
 
+    def _fill(self):
+        """Replace the buffer, read through, with the next block.
+
+        Returns:
+            bool: `False` if EOF is reached, `True` otherwise.
+
+        """
+        self._base += len(self._buff)
+        self._buff = b''
+        self._pos = 0
+        if self._eof:
+            return False
+        read = getattr(self.stream, 'read1', self.stream.read)
+        block = read(self.block_size)
+        if not block:
+            self._eof = True
+            return False
+        self._buff = block
+        return True
+
     def readline(self, length=None):
         """Read one entire line from the file.
 
@@ -253,26 +1076,144 @@ class StreamIO(object):
         if length is not None:
             raise NotImplementedError
 
-        self._head_of_last_line = self.stream.tell()
+        buff = self._buff
+        pos = self._pos
+        end = buff.find(NL, pos) + len(NL)
+        if end >= len(NL):
+            line = buff[pos:end]
+            self._pos = end
+        else:
+            line = self._readline_blocks()
+
+        if (self._max_line_length is not None and
+                len(line) > self._max_line_length):
+            raise LineLengthExceeded(
+                'Line exceeds {} bytes'.format(self._max_line_length))
+        if (self._max_total_bytes is not None and
+                self.tell() > self._max_total_bytes):
+            raise TotalSizeExceeded(
+                'Content exceeds {} bytes'.format(self._max_total_bytes))
+
+        self._last_line = line
+        return line
 
-        line = self.stream.readline()
-        if line == b'':
-            return line
+    def _readline_blocks(self):
+        """Read the line continuing past the buffer, collecting it in
+        pieces to join once.
 
-        while not line.endswith(NL):
-            s = self.stream.readline()
-            if s == b'':
+        """
+        pieces = [self._buff[self._pos:]]
+        size = len(pieces[0])
+        cr_ended = pieces[0].endswith(b'\r')
+        while 1:
+            if (self._max_line_length is not None and
+                    size > self._max_line_length):
+                # Fail before buffering the rest of a runaway line
+                raise LineLengthExceeded(
+                    'Line exceeds {} bytes'.format(self._max_line_length))
+            if not self._fill():
+                break
+            block = self._buff
+            if cr_ended and block.startswith(b'\n'):
+                end = 1
+            else:
+                end = block.find(NL) + len(NL)
+                if end < len(NL):
+                    end = 0
+            if end:
+                pieces.append(block[:end])
+                self._pos = end
                 break
-            line += s
+            pieces.append(block)
+            self._pos = len(block)
+            size += len(block)
+            cr_ended = block.endswith(b'\r')
+        return b''.join(pieces)
 
-        return line
+    def read(self, n):
+        """Read at most `n` bytes regardless of lines.
+
+        Returns:
+            str: The bytes read, which are fewer than `n` only at EOF.
+
+        """
+        if len(self._buff) - self._pos >= n:
+            data = self._buff[self._pos:self._pos + n]
+            self._pos += n
+        else:
+            # Read the rest directly past the buffer
+            data = self._buff[self._pos:]
+            self._base += len(self._buff)
+            self._buff = b''
+            self._pos = 0
+            if not self._eof:
+                rest = self.stream.read(n - len(data))
+                self._base += len(rest)
+                data += rest
+        if (self._max_total_bytes is not None and
+                self.tell() > self._max_total_bytes):
+            raise TotalSizeExceeded(
+                'Content exceeds {} bytes'.format(self._max_total_bytes))
+        return data
+
+    def peek(self, n):
+        """Return at most `n` bytes to be read next without consuming them."""
+        data = self.read(n)
+        self.unread(data)
+        return data
 
     def rollback_line(self):
         """Move the file's position to the head of previous line already read
         by :meth:`StreamIO.readline`.
 
         """
-        self.stream.seek(self._head_of_last_line)
+        self.unread(self._last_line)
+
+    def unread(self, data):
+        """Push back `data` just read so that it is read again next."""
+        if not data:
+            return
+        if self._pos >= len(data):
+            # The data is still in the buffer
+            self._pos -= len(data)
+        else:
+            # Put back the part of data already dropped from the buffer
+            self._buff = data + self._buff[self._pos:]
+            self._base -= len(data) - self._pos
+            self._pos = 0
+
+    def tell(self):
+        """Return the absolute offset of the next byte to be read."""
+        return self._base + self._pos
+
+    def seekable(self):
+        """Return whether the stream supports :meth:`StreamIO.seek`."""
+        seekable = getattr(self.stream, 'seekable', None)
+        if seekable is not None:
+            return seekable()
+        return hasattr(self.stream, 'seek') and hasattr(self.stream, 'tell')
+
+    def seek(self, offset):
+        """Move to the absolute `offset`, within the buffer if possible."""
+        self._last_line = b''
+        if self._base <= offset <= self._base + len(self._buff):
+            self._pos = offset - self._base
+            return
+        self.stream.seek(offset)
+        self._base = offset
+        self._buff = b''
+        self._pos = 0
+        self._eof = False
+
+    def close(self):
+        """Stop reading, leaving the file open for the caller owning it
+        to close.
+
+        """
+        self._base += len(self._buff)
+        self._buff = b''
+        self._pos = 0
+        self._eof = True
 
     def reaches_eof(self):
         """Test if the next line to be read reaches EOF."""
@@ -290,33 +1231,279 @@ class MIMEStreamer(object):
 
         boundary (`str`, optional): The MIME part boundary text.
 
+        checkpoint (`dict`, optional): The checkpoint, as returned by
+            :meth:`MIMEStreamer.checkpoint`, to resume parsing from. The
+            stream must be positioned at the checkpoint offset.
+
+        limits (:class:`Limits`, optional): The resource limits to
+            enforce while parsing.
+
     """
 
-    def __init__(self, stream, boundary=None):
+    def __init__(self, stream, boundary=None, checkpoint=None, limits=None):
+        self.limits = limits or Limits()
         self.stream = self.init_stream_io(stream)
         self._boundary = boundary or None
 
+        # The number of parts whose headers have been read
+        self._parts_read = 0
+
+        # The part currently handed out by :meth:`get_next_part`
+        self._current_part = None
+
+        # The part to be handed out next when resumed in its middle
+        self._resumed_part = None
+
+        if checkpoint is not None:
+            self._restore(checkpoint)
+
     def __repr__(self):
         return '<{}>'.format(self.__class__.__name__)
 
     def init_stream_io(self, stream):
-        return StreamIO(stream)
+        return StreamIO(stream, limits=self.limits)
 
     def _is_boundary(self, line):
         """Test if `line` is a part boundary."""
         return self._boundary and line.startswith(b'--' + self._boundary)
 
+    def checkpoint(self):
+        """Get the current parser state as a serializable checkpoint.
+
+        The checkpoint records the absolute byte offset of the next
+        byte to be consumed along with the part being read, if any, so
+        that parsing can be resumed from a stream reopened at that
+        offset. The returned object is JSON-serializable.
+
+        Returns:
+            dict: The checkpoint.
+
+        """
+        state = {
+            'offset': self.stream.tell(),
+            'boundary': (ensure_str(self._boundary)
+                         if self._boundary else None),
+            'part': None,
+            'parts_read': self._parts_read,
+        }
+
+        part = self._current_part
+        if (part is not None and isinstance(part.content, StreamContent) and
+                not part.content._eof_seen):
+            state['offset'] -= part.content._unread()
+            state['part'] = dict(part.content._state(), headers=[
+                [k, v] for k, v in part.headers.items()])
+
+        return state
+
+    def _restore(self, checkpoint):
+        """Restore the parser state from `checkpoint`."""
+        if checkpoint.get('boundary'):
+            self._boundary = ensure_binary(checkpoint['boundary'])
+        self._parts_read = checkpoint.get('parts_read', 0)
+
+        state = checkpoint.get('part')
+        if state:
+            part = Part(make_headers(state['headers']))
+            part.content = StreamContent(
+                self, offset=state['offset'], line_start=state['line_start'],
+                cr_ended=state.get('cr_ended', False))
+            self._resumed_part = part
+            log.debug('Resuming part at offset %d', state['offset'])
+
+    def close(self):
+        """Stop reading the underlying stream.
+
+        A file object given by the caller is left open for the caller
+        to close, whereas the response given to a response streamer is
+        closed, releasing its connection.
+
+        """
+        self.stream.close()
+
     @contextmanager
     def get_next_part(self):
         """Get the next part. Use this with the context manager (i.e., `with`
         statement).
 
         """
-        # Assume the cursor is at the first char of headers of a part
-        part = None
-        headers = []
+        part = self._next_part()
+        if part is None:
+            raise NoPartError('No more part to read')
+        self._open_content(part)
+
+        self._current_part = part
+        try:
+            yield part
+        finally:
+            part.flush_content()
+            self._current_part = None
+
+    def __iter__(self):
+        return self.iter_parts()
+
+    def iter_parts(self, select=None, content_ids=None, content_types=None,
+                   limit=None, close=True, preload=False):
+        """Iterate over the parts, optionally selecting some of them.
+
+        The content of a part is available only until the next part is
+        requested; any unread content is skipped. Non-selected parts
+        are skipped without their content being read by the caller.
+        Iterating over the streamer itself is the same as calling this
+        method without arguments.
+
+        Args:
+            select (`callable`, optional): A function taking the part
+                headers and returning whether the part is selected.
+
+            content_ids (iterable, optional): The content IDs of parts
+                to select, with or without the angle brackets.
+
+            content_types (iterable, optional): The MIME types of parts
+                to select.
+
+            limit (`int`, optional): The maximum number of parts to
+                select.
 
+            close (`bool`, optional): Whether to stop reading as soon
+                as all the parts in `content_ids` or `limit` parts have
+                been selected, instead of reading the rest, as by
+                :meth:`MIMEStreamer.close`.
+
+            preload (`bool`, optional): If `True`, the content of each
+                selected part is read into `bytes` before the part is
+                yielded. This is faster for messages of many small
+                parts. The content is the same as read from the stream,
+                ending with the new line preceding the boundary unless
+                :meth:`Part.strip_delimiter` is called.
+
+        Yields:
+            :class:`Part`: The selected part.
+
+        """
+        if content_ids is not None:
+            content_ids = set(parse_content_id(cid) for cid in content_ids)
+        if content_types is not None:
+            content_types = set(ct.lower() for ct in content_types)
+
+        selected = 0
         while 1:
+            if content_ids is not None and not content_ids:
+                break
+            if limit is not None and selected >= limit:
+                break
+
+            part = self._next_part()
+            if part is None:
+                return
+
+            if ((content_ids is None or part.content_id in content_ids) and
+                    (content_types is None or
+                     part.mime_type in content_types) and
+                    (select is None or select(part.headers))):
+                if content_ids is not None:
+                    content_ids.discard(part.content_id)
+                selected += 1
+                self._open_content(part, preload=preload)
+                self._current_part = part
+                try:
+                    yield part
+                finally:
+                    self._current_part = None
+                part.flush_content()
+            else:
+                log.debug('Skip part %r', part.content_id)
+                self._skip_content(part)
+
+        if close:
+            log.debug('All selected parts read; stop reading')
+            self.close()
+
+    def extract_all(self, directory, fsync_batch=0, **kwargs):
+        """Write the content of each part to a file in `directory`.
+
+        Files are named after the content ID of parts, or their index
+        for those without one. Parts of a multipart type, i.e., the
+        headers of the entire message, are not extracted.
+
+        Args:
+            directory (str): The directory to write files to.
+
+            fsync_batch (`int`, optional): If positive, files are
+                flushed to disk in batches of this many files, and at
+                the end.
+
+            **kwargs: Passed to :meth:`MIMEStreamer.iter_parts` to
+                select parts.
+
+        Returns:
+            list: The `(content_id, path)` pairs of extracted parts.
+
+        """
+        extracted = []
+        names = set()
+        unsynced = []
+        for index, part in enumerate(self.iter_parts(**kwargs)):
+            if (part.mime_type or '').startswith('multipart/'):
+                continue
+
+            name = re_unsafe_filename.sub('_', part.content_id or '')
+            if not name or name.startswith('.') or name in names:
+                name = 'part-{}{}'.format(index, '-' + name if name else '')
+            names.add(name)
+
+            path = os.path.join(directory, name)
+            part.save_to(path)
+            extracted.append((part.content_id, path))
+
+            if fsync_batch > 0:
+                unsynced.append(path)
+                if len(unsynced) >= fsync_batch:
+                    _fsync_paths(unsynced)
+                    unsynced = []
+
+        if unsynced:
+            _fsync_paths(unsynced)
+
+        return extracted
+
+    def share_parts(self, pool, **kwargs):
+        """Write the content of each part to shared memory for worker
+        processes.
+
+        Args:
+            pool (:class:`SharedMemoryPool`): The pool of shared memory
+                segments to write to, which owns the segments.
+
+            **kwargs: Passed to :meth:`MIMEStreamer.iter_parts` to
+                select parts.
+
+        Yields:
+            :class:`PartDescriptor`: The descriptor of the content of
+                each part, to release with
+                :meth:`SharedMemoryPool.release` when done.
+
+        """
+        for part in self.iter_parts(**kwargs):
+            yield pool.share(part)
+
+    def _next_part(self):
+        """Read the headers of the next part.
+
+        Returns:
+            :class:`Part`: The next part, or `None` if no more part
+                exists.
+
+        """
+        # Assume the cursor is at the first char of headers of a part,
+        # unless a part was left halfway when the checkpoint was made
+        part, self._resumed_part = self._resumed_part, None
+        headers = []
+        header_bytes = 0
+        header_count = 0
+        limits = self.limits
+
+        while part is None:
             line = self.stream.readline()
             log.debug('%r read: %r%s',
                       self, line[:76], '...' if len(line) > 76 else '')
@@ -332,10 +1519,26 @@ class MIMEStreamer(object):
             if part is None:
                 # Still reading headers
                 if line == b'':
+                    if not headers:
+                        log.debug('Content ends without closing boundary')
+                        break
                     raise ParsingError('EOF while reading headers')
 
                 if line != NL:
                     log.debug('%r read header line: %s', self, line[:-2])
+                    header_bytes += len(line)
+                    if (limits.max_header_bytes is not None and
+                            header_bytes > limits.max_header_bytes):
+                        raise HeaderLimitExceeded(
+                            'Headers exceed {} bytes'.format(
+                                limits.max_header_bytes))
+                    if not line.startswith((b' ', b'\t')):
+                        header_count += 1
+                        if (limits.max_headers is not None and
+                                header_count > limits.max_headers):
+                            raise HeaderLimitExceeded(
+                                'Headers exceed {} fields'.format(
+                                    limits.max_headers))
                     headers.append(line)
                     continue
 
@@ -348,33 +1551,117 @@ class MIMEStreamer(object):
 
                 part = Part(headers)
 
+                self._parts_read += 1
+                if (limits.max_parts is not None and
+                        self._parts_read > limits.max_parts):
+                    raise PartLimitExceeded(
+                        'Message exceeds {} parts'.format(limits.max_parts))
+
                 if not self._boundary:
                     boundary = part.get_multipart_boundary()
                     if boundary:
                         log.debug('Found boundary from headers: %s', boundary)
                         self._boundary = ensure_binary(boundary)
 
-                # Probe the line following the headers/content delimiter
-                if self.stream.reaches_eof():
-                    log.debug('EOF detected')
-                    part.content = StringIO(b'')
-                else:
-                    next_line = self.stream.readline()
-                    if self._is_boundary(next_line):
-                        log.debug('Content is empty for this part')
-                        part.content = StringIO(b'')
-                    else:
-                        log.debug('Content ready for read')
-                        self.stream.rollback_line()
-                        part.content = StreamContent(self)
-
                 break
 
-        if part is None:
-            raise NoPartError('No more part to read')
+        return part
 
-        try:
-            yield part
-        finally:
-            if part is not None:
-                part.flush_content()
+    def _content_length(self, part):
+        """Get the content length of `part` to trust, if any.
+
+        The content length of a multipart entity, e.g., the entire
+        message, covers the parts within and is never trusted.
+
+        """
+        if self._boundary and not (part.mime_type or '').startswith(
+                'multipart/'):
+            return part.content_length
+
+    def _open_content(self, part, preload=False):
+        """Set the content of `part` whose headers have just been read.
+
+        Args:
+            part (:class:`Part`): The part returned by
+                :meth:`MIMEStreamer._next_part`.
+
+            preload (`bool`, optional): If `True`, the entire content is
+                read into `bytes`; otherwise a file-like object reading
+                from the stream is set.
+
+        """
+        if part.content is not None:
+            # The part resumed from a checkpoint is already open
+            return
+
+        length = self._content_length(part)
+        max_size = self.limits.max_part_size
+        if length is not None and max_size is not None and length > max_size:
+            raise PartSizeExceeded(
+                'Part content length {} exceeds {} bytes'.format(
+                    length, max_size))
+        if length is not None:
+            log.debug('Content length %d', length)
+        if preload:
+            # Read all as bytes, the same as read from the stream, noting
+            # whether it ends with the new line preceding the boundary
+            content = StreamContent(self, length=length)
+            part.content = content.read()
+            part._delimited = content.delimited
+            return
+        if length is not None:
+            part.content = StreamContent(self, length=length)
+            return
+
+        # Probe the line following the headers/content delimiter; a
+        # blank line is content, as when preloaded
+        next_line = self.stream.readline()
+        if next_line == b'':
+            log.debug('EOF detected')
+            part.content = StringIO(b'')
+        elif self._is_boundary(next_line):
+            log.debug('Content is empty for this part')
+            part.content = StringIO(b'')
+        else:
+            log.debug('Content ready for read')
+            self.stream.rollback_line()
+            part.content = StreamContent(self)
+
+    def _skip_content(self, part):
+        """Skip the content of `part` without opening it.
+
+        Content of a valid length is skipped in blocks, falling back to
+        scanning lines for the boundary if it is not found at that
+        length, and other content is scanned line by line.
+
+        """
+        if part.content is not None:
+            part.flush_content()
+            return
+        length = self._content_length(part)
+        if length is not None:
+            skipped = StreamContent(self, length=length).skip()
+        else:
+            skipped = 0
+            for line in self._iter_content_lines():
+                skipped += len(line)
+        log.debug('Skipped content of size %d bytes', skipped)
+
+    def _iter_content_lines(self):
+        """Iterate over the lines of content up to EOF/boundary."""
+        readline = self.stream.readline
+        is_boundary = self._is_boundary
+        max_size = self.limits.max_part_size
+        size = 0
+        while 1:
+            line = readline()
+            if line == b'':
+                return
+            if is_boundary(line):
+                self.stream.rollback_line()
+                return
+            size += len(line)
+            if max_size is not None and size > max_size:
+                raise PartSizeExceeded(
+                    'Part content exceeds {} bytes'.format(max_size))
+            yield line
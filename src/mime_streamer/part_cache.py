@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Part Cache
+=============
+
+An on-disk cache of XOP messages, storing the manifest and the content
+of each part in files so that a message fetched again is served from
+memory-mapped files instead of the network:
+
+.. code-block:: python
+
+    cache = PartCache('/var/cache/xop', max_size=1 << 30)
+
+    resp = requests.get(url, stream=True)
+    with cache.open(resp) as message:
+        xml = message.manifest_part.content
+        for part in message:
+            data = part.content.read()
+
+A message is keyed by its response validator, i.e., a strong `ETag`
+with the URL, or by its content hash from a `Digest` or `Content-MD5`
+header. Without either, the message is fetched and stored under the
+hash of its content, which can be looked up with :meth:`PartCache.get`.
+
+Several processes may share the cache directory. A message is written
+to a temporary directory and renamed into place, so that it appears
+complete or not at all, and entries are evicted in least recently used
+order under a file lock when the cache grows beyond its size limit.
+An open message holds a shared lock on its entry, which is not evicted
+until the message is closed. Part files are mapped only while read, so
+that messages of any number of parts can be opened.
+
+"""
+from __future__ import absolute_import
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# This is just to avoid failing where file locking is unavailable
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .exceptions import NoPartError
+from .mime_response_streamer import XOPResponseStreamer
+from .mime_streamer import make_headers
+from .mime_streamer import NL
+from .mime_streamer import parse_content_id
+from .mime_streamer import Part
+from .mime_streamer import WRITE_CHUNK_SIZE
+from .utils import ensure_binary
+
+
+log = logging.getLogger(__name__)
+
+
+INDEX_FILE = 'index.json'
+"""str: The name of the file describing a cached message"""
+
+LOCK_FILE = '.lock'
+"""str: The name of the file locked while evicting entries"""
+
+
+def response_key(resp):
+    """Get the cache key of a response from its headers.
+
+    Args:
+        resp (:class:`requests.Response`): The response.
+
+    Returns:
+        str: The key, or `None` if the response has neither a strong
+            validator nor a content hash.
+
+    """
+    headers = resp.headers
+    for name in ('digest', 'content-md5'):
+        if headers.get(name):
+            return '{}:{}'.format(name, headers[name].strip())
+    etag = (headers.get('etag') or '').strip()
+    if etag and not etag.startswith('W/'):
+        return 'etag:{} {}'.format(resp.url, etag)
+
+
+class MappedContent(object):
+    """The file-like object reading the content of a cached part from a
+    memory-mapped file.
+
+    The file is mapped on the first read, and mapped again when read
+    after :meth:`MappedContent.close`.
+
+    Args:
+        path (str): The path of the file.
+
+        delimited (`bool`, optional): Whether the file ends with the new
+            line preceding the boundary, as the content was streamed.
+
+    Attributes:
+        strip_delimiter (bool): Whether to exclude the new line
+            preceding the boundary from content, as for
+            :class:`StreamContent`.
+
+    """
+
+    def __init__(self, path, delimited=False):
+        self._path = path
+        self._file_size = os.stat(path).st_size
+        self._delimited = delimited
+        self._map = None
+        self._pos = 0
+        self.strip_delimiter = False
+
+    def __repr__(self):
+        return '<{} {} bytes>'.format(self.__class__.__name__, self._size)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def _size(self):
+        """int: The size of content, less the stripped new line."""
+        if self.strip_delimiter and self._delimited:
+            return self._file_size - len(NL)
+        return self._file_size
+
+    @property
+    def mapped(self):
+        """bool: Whether the file is currently mapped."""
+        return self._map is not None
+
+    def _mapped(self):
+        """Get the map of the file, mapping it if not yet."""
+        if self._map is None:
+            if not self._file_size:
+                # An empty file cannot be mapped
+                self._map = b''
+            else:
+                with open(self._path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self, n=-1):
+        """Read at most `n` bytes, or the rest of content if negative."""
+        end = self._size if n is None or n < 0 else min(
+            self._size, self._pos + n)
+        data = self._mapped()[self._pos:end]
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, b):
+        """Read bytes into a pre-allocated, writable bytes-like object."""
+        view = memoryview(b)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        n = max(0, min(len(view), self._size - self._pos))
+        view[:n] = self._mapped()[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to `offset` relative to `whence`."""
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos,
+                os.SEEK_END: self._size}[whence]
+        if base + offset < 0:
+            raise ValueError('Negative seek position')
+        self._pos = base + offset
+        return self._pos
+
+    def tell(self):
+        """Return the number of content bytes read so far."""
+        return self._pos
+
+    def close(self):
+        """Unmap the file."""
+        if self._map is not None:
+            if self._file_size:
+                self._map.close()
+            self._map = None
+
+
+class CachedMessage(object):
+    """A message served from :class:`PartCache`.
+
+    This offers the part interface of :class:`XOPResponseStreamer`,
+    except that the parts can be read in any order and more than once.
+    A part file is mapped when read, and unmapped when the next part is
+    requested.
+
+    Attributes:
+        key (str): The cache key of the message.
+
+        manifest_part (:class:`Part`): The XOP manifest part with the
+            content loaded.
+
+        parts (list): The :class:`Part` objects following the
+            manifest, whose content is :class:`MappedContent`.
+
+    """
+
+    def __init__(self, key, path, index, lock_file=None):
+        self.key = key
+        self._path = path
+        self._next = 0
+
+        # The open index file holding a shared lock on the entry
+        self._lock_file = lock_file
+
+        # The part last handed out
+        self._current = None
+
+        manifest = Part(make_headers(index['manifest']['headers']))
+        with open(os.path.join(path, index['manifest']['file']), 'rb') as f:
+            manifest.content = f.read()
+        manifest._delimited = index['manifest'].get('delimited', False)
+        self.manifest_part = manifest
+
+        self.parts = []
+        try:
+            for item in index['parts']:
+                part = Part(make_headers(item['headers']))
+                part.content = MappedContent(
+                    os.path.join(path, item['file']),
+                    delimited=item.get('delimited', False))
+                self.parts.append(part)
+        except Exception:
+            self.close()
+            raise
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self.iter_parts()
+
+    def close(self):
+        """Unmap all the part files and release the entry."""
+        for part in self.parts:
+            part.content.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _hand_out(self, part):
+        """Rewind `part`, unmapping the part handed out before."""
+        if self._current is not None and self._current is not part:
+            self._current.content.close()
+        self._current = part
+        part.content.seek(0)
+        return part
+
+    @contextmanager
+    def get_next_part(self):
+        """Get the next part, as :meth:`MIMEStreamer.get_next_part`."""
+        if self._next >= len(self.parts):
+            raise NoPartError('No more part to read')
+        part = self.parts[self._next]
+        self._next += 1
+        yield self._hand_out(part)
+
+    def get_part(self, content_id):
+        """Get the part of `content_id`, or `None` if not found."""
+        content_id = parse_content_id(content_id)
+        for part in self.parts:
+            if part.content_id == content_id:
+                return self._hand_out(part)
+
+    def iter_parts(self, select=None, content_ids=None, content_types=None,
+                   limit=None):
+        """Iterate over the parts, as :meth:`MIMEStreamer.iter_parts`."""
+        if content_ids is not None:
+            content_ids = set(parse_content_id(cid) for cid in content_ids)
+        if content_types is not None:
+            content_types = set(ct.lower() for ct in content_types)
+
+        selected = 0
+        for part in self.parts:
+            if limit is not None and selected >= limit:
+                break
+            if ((content_ids is None or part.content_id in content_ids) and
+                    (content_types is None or
+                     part.mime_type in content_types) and
+                    (select is None or select(part.headers))):
+                selected += 1
+                yield self._hand_out(part)
+
+
+class PartCache(object):
+    """The on-disk cache of XOP messages.
+
+    Args:
+        directory (str): The cache directory, created if missing.
+
+        max_size (`int`, optional): The size in bytes beyond which the
+            least recently used entries are evicted. If omitted, the
+            cache grows without bound.
+
+        streamer_class (`type`, optional): The streamer class parsing
+            responses on cache misses.
+
+    """
+
+    def __init__(self, directory, max_size=None,
+                 streamer_class=XOPResponseStreamer):
+        self.directory = directory
+        self.max_size = max_size
+        self.streamer_class = streamer_class
+        try:
+            os.makedirs(directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.directory)
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory,
+                            hashlib.sha256(ensure_binary(key)).hexdigest())
+
+    def get(self, key):
+        """Open the message cached under `key`.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            :class:`CachedMessage`: The message, or `None` on a miss.
+
+        """
+        path = self._entry_path(key)
+        index_path = os.path.join(path, INDEX_FILE)
+        try:
+            f = open(index_path)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            log.debug('Cache miss for %s', key)
+            return None
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+            if os.fstat(f.fileno()).st_ino != os.stat(index_path).st_ino:
+                raise OSError(errno.ENOENT, 'Entry evicted', index_path)
+            index = json.load(f)
+            message = CachedMessage(key, path, index, lock_file=f)
+        except (IOError, OSError) as exc:
+            f.close()
+            if exc.errno != errno.ENOENT:
+                raise
+            # Evicted while being opened
+            log.debug('Cache miss for %s', key)
+            return None
+        except (KeyError, TypeError, ValueError):
+            f.close()
+            log.warning('Corrupt cache entry for %s', key, exc_info=True)
+            return None
+        except Exception:
+            f.close()
+            raise
+
+        try:
+            # Mark the entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        log.debug('Cache hit for %s', key)
+        return message
+
+    def open(self, resp, key=None, **kwargs):
+        """Open the message of `resp` from the cache, fetching and storing
+        it first on a miss.
+
+        On a hit, `resp` is closed without its content being read.
+
+        Args:
+            resp (:class:`requests.Response`): The streamed response.
+
+            key (`str`, optional): The cache key. Defaults to the key
+                given by :func:`response_key`.
+
+            **kwargs: Passed to the streamer class on a miss.
+
+        Returns:
+            :class:`CachedMessage`: The message.
+
+        """
+        key = key or response_key(resp)
+        if key is not None:
+            message = self.get(key)
+            if message is not None:
+                resp.close()
+                return message
+
+        streamer = self.streamer_class(resp, **kwargs)
+        try:
+            key = self.store(streamer, key=key)
+        finally:
+            streamer.close()
+        message = self.get(key)
+        if message is None:
+            raise IOError('Cached message evicted before opened: ' + key)
+        return message
+
+    def store(self, streamer, key=None):
+        """Store the message read by `streamer`.
+
+        The remaining parts of `streamer` are read and written to files.
+        If the key is already cached by another process in the meantime,
+        the entry written first is kept.
+
+        Args:
+            streamer (:class:`XOPResponseStreamer`): The streamer whose
+                manifest part is loaded.
+
+            key (`str`, optional): The cache key. Defaults to the
+                SHA-256 hash of the content.
+
+        Returns:
+            str: The cache key.
+
+        """
+        tmp = tempfile.mkdtemp(prefix='tmp-', dir=self.directory)
+        try:
+            digest = hashlib.sha256()
+            manifest = streamer.manifest_part
+            _write_file(os.path.join(tmp, 'manifest'), manifest.content,
+                        digest)
+
+            parts = []
+            for part in streamer.iter_parts(close=False):
+                name = str(len(parts))
+                digest.update(ensure_binary(part.content_id or ''))
+                _write_file(os.path.join(tmp, name), part.content, digest)
+                parts.append({
+                    'headers': [[k, v] for k, v in part.headers.items()],
+                    'file': name,
+                    'delimited': getattr(part.content, 'delimited', False),
+                })
+
+            key = key or 'sha256:' + digest.hexdigest()
+            index = {
+                'key': key,
+                'manifest': {
+                    'headers': [[k, v] for k, v in manifest.headers.items()],
+                    'file': 'manifest',
+                    'delimited': manifest.delimited,
+                },
+                'parts': parts,
+            }
+            with open(os.path.join(tmp, INDEX_FILE), 'w') as f:
+                json.dump(index, f)
+
+            path = self._entry_path(key)
+            try:
+                os.rename(tmp, path)
+            except OSError as exc:
+                if exc.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+                log.debug('%s was cached by another process', key)
+            else:
+                tmp = None
+                log.debug('Cached %s with %d parts', key, len(parts))
+        finally:
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict(keep=path)
+        return key
+
+    def evict(self, keep=None):
+        """Evict the least recently used entries beyond the size limit.
+
+        Args:
+            keep (`str`, optional): The path of an entry never evicted.
+
+        Returns:
+            int: The number of entries evicted.
+
+        """
+        if self.max_size is None:
+            return 0
+
+        with self._lock():
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if len(name) != 64 or not os.path.isdir(path):
+                    continue
+                try:
+                    size = _tree_size(path)
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                total += size
+                entries.append((mtime, size, path))
+
+            evicted = 0
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                if path == keep:
+                    continue
+                if self._evict_entry(path):
+                    total -= size
+                    evicted += 1
+                    log.debug('Evicted %s of %d bytes', path, size)
+        return evicted
+
+    def _evict_entry(self, path):
+        """Remove the entry at `path` unless a message of it is open.
+
+        Returns:
+            bool: Whether the entry was removed.
+
+        """
+        try:
+            index = open(os.path.join(path, INDEX_FILE))
+        except (IOError, OSError):
+            # An entry without index is never opened
+            index = None
+        try:
+            if index is not None and fcntl is not None:
+                try:
+                    fcntl.flock(index.fileno(),
+                                fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError) as exc:
+                    if exc.errno not in (errno.EAGAIN, errno.EACCES,
+                                         errno.EWOULDBLOCK):
+                        raise
+                    log.debug('%s is in use; not evicted', path)
+                    return False
+
+            # Move out of the way atomically before removal, so that
+            # no other process opens a half-removed entry
+            trash = tempfile.mkdtemp(prefix='del-', dir=self.directory)
+            try:
+                os.rename(path, os.path.join(trash, 'entry'))
+            except OSError:
+                os.rmdir(trash)
+                return False
+            shutil.rmtree(trash, ignore_errors=True)
+            return True
+        finally:
+            if index is not None:
+                index.close()
+
+    @contextmanager
+    def _lock(self):
+        """Lock the cache directory exclusively across processes."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _write_file(path, content, digest):
+    """Write `content`, either bytes or file-like, to `path`, updating
+    `digest` with the bytes written.
+
+    """
+    with open(path, 'wb') as f:
+        if isinstance(content, bytes):
+            digest.update(content)
+            f.write(content)
+            return
+        for chunk in iter(lambda: content.read(WRITE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            f.write(chunk)
+
+
+def _tree_size(path):
+    """Return the total size of files directly in `path`."""
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
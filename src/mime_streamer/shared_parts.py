@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Shared Memory Handoff
+========================
+
+Hand the content of parts to worker processes through shared memory,
+so that it is neither pickled nor copied on the way:
+
+.. code-block:: python
+
+    def work(descriptor):
+        with attach(descriptor) as view:
+            return checksum(view)
+
+    with SharedMemoryPool() as pool, ProcessPoolExecutor() as executor:
+        for descriptor in streamer.share_parts(pool):
+            future = executor.submit(work, descriptor)
+            future.add_done_callback(
+                lambda f, d=descriptor: pool.release(d))
+
+The content of each part is written to a segment of the pool, and a
+small :class:`PartDescriptor` locating it is passed to the worker.
+Segments are created, reused and unlinked only by the process that
+streams; workers merely attach to them. Parts up to `segment_size`
+bytes are packed into pooled segments, each reused once all the parts
+in it are released, and a larger part gets a segment of its own,
+unlinked when released. All segments are unlinked when the pool is
+closed.
+
+This module requires :mod:`multiprocessing.shared_memory` of Python 3.8
+or later.
+
+"""
+from __future__ import absolute_import
+import logging
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from .exceptions import MemoryBudgetExceeded
+from .memory_budget import BLOCK
+from .memory_budget import POLL_INTERVAL
+from .memory_budget import RAISE
+
+
+log = logging.getLogger(__name__)
+
+
+SEGMENT_SIZE = 1 << 24
+"""int: The default size in bytes of pooled segments"""
+
+OVERFLOW_CHUNK_SIZE = 1 << 20
+"""int: The size in bytes of chunks read past the space reserved for
+content of unknown length"""
+
+
+class PartDescriptor(object):
+    """The location of the content of a part in shared memory, to pass
+    to a worker process.
+
+    Attributes:
+        name (str): The name of the shared memory segment.
+
+        offset (int): The offset of content in the segment.
+
+        length (int): The size of content in bytes.
+
+        headers (list): The `(name, value)` pairs of part headers.
+
+    """
+
+    def __init__(self, name, offset, length, headers):
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.headers = headers
+
+    def __repr__(self):
+        return '<{} {}[{}:{}]>'.format(
+            self.__class__.__name__, self.name, self.offset,
+            self.offset + self.length)
+
+
+class _Segment(object):
+    """A shared memory segment and the parts written to it."""
+
+    def __init__(self, size, dedicated=False):
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.size = size
+        self.dedicated = dedicated
+
+        # The number of bytes reserved from the head of the segment
+        self.used = 0
+
+        # The number of parts in the segment not yet released
+        self.refs = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, offset, data):
+        with self.shm.buf[offset:offset + len(data)] as view:
+            view[:] = data
+
+    def destroy(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedMemoryPool(object):
+    """The pool of shared memory segments holding part content.
+
+    Parts are written with :meth:`SharedMemoryPool.share` from a single
+    thread, whereas :meth:`SharedMemoryPool.release` may be called from
+    any thread.
+
+    Args:
+        segment_size (`int`, optional): The size in bytes of pooled
+            segments.
+
+        max_segments (`int`, optional): The maximum number of pooled
+            segments. Unlimited if omitted.
+
+        policy (`str`, optional): What to do when all the pooled
+            segments are in use, either :data:`BLOCK` to wait for parts
+            to be released or :data:`RAISE`.
+
+        timeout (`float`, optional): The maximum seconds to wait with
+            the :data:`BLOCK` policy before raising. Waits forever if
+            omitted.
+
+    """
+
+    def __init__(self, segment_size=SEGMENT_SIZE, max_segments=None,
+                 policy=BLOCK, timeout=None):
+        if shared_memory is None:
+            raise ImportError('Python 3.8 or later is required for '
+                              'shared memory')
+        if policy not in (BLOCK, RAISE):
+            raise ValueError('Unknown policy {!r}'.format(policy))
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.policy = policy
+        self.timeout = timeout
+        self._cond = threading.Condition()
+
+        # All live segments keyed by name
+        self._segments = {}
+
+        # The number of pooled segments, the pooled segments holding no
+        # parts, and the pooled segment being filled
+        self._pooled = 0
+        self._free = []
+        self._current = None
+
+    def __repr__(self):
+        return '<{} {} segments>'.format(
+            self.__class__.__name__, self.segment_count)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def segment_count(self):
+        """int: The number of segments currently allocated."""
+        with self._cond:
+            return len(self._segments)
+
+    def share(self, part):
+        """Write the rest of content of `part` to shared memory.
+
+        If the content length is known, the content is read straight
+        into a segment of that size. Otherwise, it is read into the free
+        space of the pooled segment being filled. Either way, it is read
+        up to where the parser finds its end, and moved elsewhere only
+        if it does not fit, as when the boundary is not found at the
+        content length. The new line preceding the boundary is
+        excluded, as by :meth:`Part.strip_delimiter`, so that content is
+        shared alike whether preloaded or not.
+
+        Args:
+            part (:class:`Part`): The part whose content to write.
+
+        Returns:
+            :class:`PartDescriptor`: The descriptor of the content.
+
+        """
+        headers = list(part.headers.items())
+        content = part.content
+
+        if isinstance(content, bytes):
+            size = part._preloaded_size()
+            segment, offset = self._reserve(size)
+            segment.write(offset, memoryview(content)[:size])
+        else:
+            part.strip_delimiter()
+            length = part.content_length
+            if length is not None and hasattr(content, 'tell'):
+                # The rest of content after what has been read
+                length = max(0, length - content.tell())
+            segment, offset, size = self._share_stream(content, length)
+            if length is not None and size != length:
+                log.warning('Content of %d bytes differs from length %d',
+                            size, length)
+
+        descriptor = PartDescriptor(segment.name, offset, size, headers)
+        log.debug('%r shared %r', self, descriptor)
+        return descriptor
+
+    def _share_stream(self, content, length=None):
+        """Write content read from the stream, returning the segment, the
+        offset and the size.
+
+        """
+        if length is not None:
+            # A byte more shows the end of content without moving it
+            capacity = length + 1
+        else:
+            with self._cond:
+                current = self._current
+                if current is not None and current.used < current.size:
+                    capacity = current.size - current.used
+                else:
+                    capacity = self.segment_size
+        segment, offset = self._reserve(capacity)
+
+        with segment.shm.buf[offset:offset + capacity] as view:
+            size = content.readinto(view)
+            rest = []
+            if size == capacity:
+                rest = list(iter(
+                    lambda: content.read(OVERFLOW_CHUNK_SIZE), b''))
+        if not rest:
+            self._shrink(segment, offset, capacity, size)
+            return segment, offset, size
+
+        # Move the content to where it all fits
+        total = size + sum(len(chunk) for chunk in rest)
+        moved, moved_offset = self._reserve(total)
+        with segment.shm.buf[offset:offset + size] as view:
+            moved.write(moved_offset, view)
+        self._shrink(segment, offset, capacity, 0)
+        self._unref(segment)
+        pos = moved_offset + size
+        for chunk in rest:
+            moved.write(pos, chunk)
+            pos += len(chunk)
+        return moved, moved_offset, total
+
+    def _reserve(self, length):
+        """Reserve `length` bytes for a part, returning the segment and
+        the offset.
+
+        """
+        with self._cond:
+            if length > self.segment_size:
+                segment = _Segment(length, dedicated=True)
+                self._segments[segment.name] = segment
+            else:
+                segment = self._current
+                if segment is None or segment.used + length > segment.size:
+                    self._retire_current()
+                    segment = self._current = self._take_segment()
+            offset = segment.used
+            segment.used += length
+            segment.refs += 1
+            return segment, offset
+
+    def _shrink(self, segment, offset, reserved, size):
+        """Give back the reserved bytes not written to."""
+        with self._cond:
+            if segment.used == offset + reserved:
+                segment.used = offset + size
+
+    def _retire_current(self):
+        segment, self._current = self._current, None
+        if segment is not None and segment.refs == 0:
+            segment.used = 0
+            self._free.append(segment)
+
+    def _take_segment(self):
+        """Take a free pooled segment, or create one if allowed."""
+        deadline = (None if self.timeout is None
+                    else default_timer() + self.timeout)
+        while 1:
+            if self._free:
+                return self._free.pop()
+            if self.max_segments is None or self._pooled < self.max_segments:
+                segment = _Segment(self.segment_size)
+                self._segments[segment.name] = segment
+                self._pooled += 1
+                return segment
+            if self.policy == RAISE:
+                raise MemoryBudgetExceeded(
+                    'All {} shared memory segments are in use'.format(
+                        self.max_segments))
+            wait = POLL_INTERVAL
+            if deadline is not None:
+                remaining = deadline - default_timer()
+                if remaining <= 0:
+                    raise MemoryBudgetExceeded(
+                        'Timed out waiting for a shared memory segment')
+                wait = min(wait, remaining)
+            log.debug('%r waits for a segment', self)
+            self._cond.wait(wait)
+
+    def _unref(self, segment):
+        with self._cond:
+            segment.refs -= 1
+            if segment.refs > 0:
+                return
+            if segment.dedicated:
+                del self._segments[segment.name]
+                segment.destroy()
+            elif segment is self._current:
+                segment.used = 0
+            else:
+                segment.used = 0
+                self._free.append(segment)
+                self._cond.notify_all()
+
+    def release(self, descriptor):
+        """Release the content of a part once the worker is done with it.
+
+        Args:
+            descriptor (:class:`PartDescriptor`): The descriptor
+                returned by :meth:`SharedMemoryPool.share`.
+
+        """
+        with self._cond:
+            segment = self._segments.get(descriptor.name)
+            if segment is None:
+                raise ValueError('Unknown segment {!r}'.format(
+                    descriptor.name))
+            self._unref(segment)
+
+    def close(self):
+        """Unlink all segments, whether released or not."""
+        with self._cond:
+            for segment in self._segments.values():
+                segment.destroy()
+            self._segments.clear()
+            self._free = []
+            self._current = None
+            self._pooled = 0
+            self._cond.notify_all()
+
+
+def _attach_segment(name):
+    try:
+        # Leave the segment to be unlinked by the pool only
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+@contextmanager
+def attach(descriptor):
+    """Map the content of a part in a worker process, without copying.
+
+    The view must not be used after the block exits.
+
+    Args:
+        descriptor (:class:`PartDescriptor`): The descriptor of the
+            content.
+
+    Yields:
+        memoryview: The read-only view of content.
+
+    """
+    if shared_memory is None:
+        raise ImportError('Python 3.8 or later is required for shared memory')
+    shm = _attach_segment(descriptor.name)
+    try:
+        end = descriptor.offset + descriptor.length
+        with shm.buf[descriptor.offset:end] as view:
+            with view.toreadonly() as readonly:
+                yield readonly
+    finally:
+        shm.close()
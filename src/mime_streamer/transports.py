@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Transports
+=============
+
+Adapters giving the response streamers uniform access to responses of
+different HTTP clients:
+
+.. code-block:: python
+
+    # requests
+    resp = requests.get(url, stream=True)
+
+    # urllib3
+    resp = pool.request('GET', url, preload_content=False)
+
+    # http.client
+    conn.request('GET', path)
+    resp = conn.getresponse()
+
+    # httpx
+    with client.stream('GET', url) as resp:
+        streamer = XOPResponseStreamer(resp)
+
+    streamer = XOPResponseStreamer(resp)
+
+A response is wrapped in its adapter by :func:`make_transport`, which
+the streamers call on the response given. Except with :mod:`requests`,
+whose streaming is kept as before, the body is read in large chunks
+straight from the client (`read_chunked`, `read1` and `iter_raw`) to
+keep up with the socket.
+
+"""
+from __future__ import absolute_import
+import logging
+import socket
+
+from six.moves import http_client
+
+
+log = logging.getLogger(__name__)
+
+
+RAW_CHUNK_SIZE = 1 << 16
+"""int: The size in bytes of chunks read from clients other than
+requests"""
+
+
+def _optional_errors(*names):
+    """Import the exception classes of optional clients that exist."""
+    errors = []
+    for name in names:
+        module, attr = name.rsplit('.', 1)
+        try:
+            errors.append(getattr(__import__(module, fromlist=[attr]), attr))
+        except (ImportError, AttributeError):
+            pass
+    return tuple(errors)
+
+
+class Transport(object):
+    """The base class of adapters for HTTP responses.
+
+    Args:
+        resp: The streamed response of an HTTP client.
+
+    Attributes:
+        resp: The response wrapped.
+
+        resumable_errors (tuple): The exception classes raised when the
+            connection drops while reading the body.
+
+        chunk_size (int): The default size in bytes of chunks read.
+
+    """
+
+    resumable_errors = ()
+
+    chunk_size = RAW_CHUNK_SIZE
+
+    def __init__(self, resp):
+        self.resp = resp
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(self.__class__.__name__, self.resp)
+
+    @property
+    def headers(self):
+        """The case-insensitive mapping of response headers."""
+        return self.resp.headers
+
+    @property
+    def status_code(self):
+        """int: The HTTP status code."""
+        return self.resp.status
+
+    def iter_chunks(self, chunk_size=None):
+        """Iterate over chunks of the decoded response body.
+
+        Args:
+            chunk_size (`int`, optional): The maximum size in bytes of
+                chunks.
+
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Close the response, releasing its connection."""
+        self.resp.close()
+
+
+class RequestsTransport(Transport):
+    """The adapter for :class:`requests.Response`."""
+
+    resumable_errors = _optional_errors(
+        'requests.exceptions.ChunkedEncodingError',
+        'requests.exceptions.ConnectionError')
+
+    # The default of :meth:`requests.Response.iter_content`
+    chunk_size = 512
+
+    @property
+    def status_code(self):
+        return self.resp.status_code
+
+    def iter_chunks(self, chunk_size=None):
+        return self.resp.iter_content(chunk_size=chunk_size or self.chunk_size)
+
+
+class Urllib3Transport(Transport):
+    """The adapter for :class:`urllib3.response.HTTPResponse` opened
+    with `preload_content=False`.
+
+    """
+
+    resumable_errors = _optional_errors(
+        'urllib3.exceptions.ProtocolError',
+        'urllib3.exceptions.ReadTimeoutError')
+
+    def iter_chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        resp = self.resp
+        if resp.chunked and resp.supports_chunked_reads():
+            return resp.read_chunked(chunk_size, decode_content=True)
+        return resp.stream(chunk_size, decode_content=True)
+
+    def close(self):
+        self.resp.close()
+        self.resp.release_conn()
+
+
+class HTTPClientTransport(Transport):
+    """The adapter for :class:`http.client.HTTPResponse`.
+
+    The body is read with `read1`, taking what a single read from the
+    socket gives as a chunk without copying it again. Content encodings
+    are not decoded.
+
+    """
+
+    resumable_errors = (http_client.IncompleteRead, socket.error)
+
+    def __init__(self, resp):
+        super(HTTPClientTransport, self).__init__(resp)
+        self._headers = dict((k.lower(), v) for k, v in resp.getheaders())
+
+    @property
+    def headers(self):
+        # Header names are lower-cased for lookup
+        return self._headers
+
+    def iter_chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        resp = self.resp
+        # Python 2 has no `read1`
+        read = getattr(resp, 'read1', resp.read)
+        while 1:
+            chunk = read(chunk_size)
+            if not chunk:
+                # A body cut short ends silently
+                if resp.length:
+                    raise http_client.IncompleteRead(b'', resp.length)
+                return
+            yield chunk
+
+
+class HttpxTransport(Transport):
+    """The adapter for :class:`httpx.Response` opened for streaming.
+
+    The raw body is read with `iter_raw`, unless it has a content
+    encoding to decode.
+
+    """
+
+    resumable_errors = _optional_errors('httpx.TransportError')
+
+    @property
+    def status_code(self):
+        return self.resp.status_code
+
+    def iter_chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        if self.resp.headers.get('content-encoding', 'identity') != 'identity':
+            return self.resp.iter_bytes(chunk_size)
+        return self.resp.iter_raw(chunk_size)
+
+
+def make_transport(resp):
+    """Wrap a response of an HTTP client in its adapter.
+
+    Args:
+        resp: The streamed response of :mod:`requests`, :mod:`urllib3`,
+            :mod:`http.client` or :mod:`httpx`, or a :class:`Transport`
+            object, which is returned as is.
+
+    Returns:
+        :class:`Transport`: The adapter.
+
+    Raises:
+        TypeError: When the response is of an unknown client.
+
+    """
+    if isinstance(resp, Transport):
+        return resp
+    if hasattr(resp, 'iter_content'):
+        return RequestsTransport(resp)
+    if hasattr(resp, 'iter_raw'):
+        return HttpxTransport(resp)
+    if hasattr(resp, 'read_chunked'):
+        return Urllib3Transport(resp)
+    if hasattr(resp, 'getheaders') and hasattr(resp, 'read'):
+        return HTTPClientTransport(resp)
+    raise TypeError('Unsupported response type: {}'.format(type(resp)))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""XOP Reconstructor
+====================
+
+Reconstruct the original XML of an XOP message, with each
+`xop:Include` element replaced by the base64 text of the attachment it
+refers to, writing it to an output stream as the message is streamed:
+
+.. code-block:: python
+
+    streamer = XOPResponseStreamer(resp)
+    with open('message.xml', 'wb') as out:
+        reconstruct(streamer, out)
+
+Attachments are encoded in chunks as they are read. Only those that
+arrive before the point where they are included, or are included more
+than once, are spooled, in memory up to a size and then on disk.
+
+The manifest is processed as bytes, so its encoding must be compatible
+with ASCII, e.g., UTF-8. An `Include` element is recognized by the
+namespace prefix declared for XOP anywhere in the manifest.
+
+"""
+from __future__ import absolute_import
+import binascii
+import logging
+import re
+from collections import Counter
+from tempfile import SpooledTemporaryFile
+
+from .exceptions import ParsingError
+from .mime_streamer import NL
+from .mime_streamer import parse_content_id
+
+
+log = logging.getLogger(__name__)
+
+
+XOP_NAMESPACE = b'http://www.w3.org/2004/08/xop/include'
+"""bytes: The namespace of the XOP `Include` element"""
+
+ENCODE_CHUNK_SIZE = 3 << 16
+"""int: The size in bytes of attachment chunks encoded at a time, a
+multiple of 3 for the chunks to encode without padding"""
+
+SPOOL_MAX_SIZE = 1 << 22
+"""int: The size in bytes of a spooled attachment kept in memory"""
+
+
+_re_include = re.compile(
+    br'<(?:([A-Za-z_][\w.-]*):)?Include\b([^>]*?)'
+    br'(?:/>|>\s*</(?:[A-Za-z_][\w.-]*:)?Include\s*>)')
+
+_re_href = re.compile(br'''\bhref\s*=\s*(["'])(.*?)\1''', re.S)
+
+
+def _xop_prefixes(text):
+    """Find the namespace prefixes declared for XOP in `text`."""
+    return set(re.findall(
+        br'''\bxmlns:([A-Za-z_][\w.-]*)\s*=\s*["']''' +
+        re.escape(XOP_NAMESPACE) + br'''["']''', text))
+
+
+def find_includes(manifest):
+    """Find the XOP `Include` elements in a manifest.
+
+    Args:
+        manifest (bytes): The XML of the manifest part.
+
+    Returns:
+        list: The `(start, end, content_id)` of each element, where
+            `start` and `end` are its offsets in `manifest`.
+
+    """
+    prefixes = _xop_prefixes(manifest)
+    default_ns = re.compile(br'''\bxmlns\s*=\s*["']''' +
+                            re.escape(XOP_NAMESPACE) + br'''["']''')
+    includes = []
+    for matched in _re_include.finditer(manifest):
+        prefix, attrs = matched.group(1), matched.group(2)
+        if prefix is not None and prefix not in prefixes:
+            continue
+        if prefix is None and not default_ns.search(attrs):
+            continue
+        href = _re_href.search(attrs)
+        if href is None:
+            raise ParsingError('Include without href: {!r}'.format(
+                matched.group(0)))
+        includes.append((matched.start(), matched.end(),
+                         parse_content_id(href.group(2))))
+    return includes
+
+
+def _iter_data(part, chunk_size):
+    """Iterate over chunks of the attachment data in `part`, without
+    the new line preceding the boundary.
+
+    """
+    part.strip_delimiter()
+    content = part.content
+    return iter(lambda: content.read(chunk_size), b'')
+
+
+def _write_base64(chunks, write):
+    """Write `chunks` of data encoded in base64.
+
+    Returns:
+        int: The number of bytes written.
+
+    """
+    written = 0
+    rest = b''
+    for chunk in chunks:
+        if rest:
+            chunk = rest + chunk
+        n = len(chunk) - len(chunk) % 3
+        if n:
+            encoded = binascii.b2a_base64(chunk[:n])[:-1]
+            write(encoded)
+            written += len(encoded)
+        rest = chunk[n:]
+    if rest:
+        encoded = binascii.b2a_base64(rest)[:-1]
+        write(encoded)
+        written += len(encoded)
+    return written
+
+
+def reconstruct(streamer, out, chunk_size=ENCODE_CHUNK_SIZE,
+                spool_max_size=SPOOL_MAX_SIZE, spool_dir=None):
+    """Write the XML of an XOP message with attachments inlined.
+
+    The remaining parts of `streamer` are read in order. Parts not
+    referred to by the manifest are skipped.
+
+    Args:
+        streamer (:class:`XOPResponseStreamer`): The streamer whose
+            manifest part is loaded.
+
+        out (file): The binary stream to write the XML to.
+
+        chunk_size (`int`, optional): The size in bytes of attachment
+            chunks encoded at a time.
+
+        spool_max_size (`int`, optional): The size in bytes beyond
+            which a spooled attachment is moved to a temporary file.
+
+        spool_dir (`str`, optional): The directory of temporary files.
+
+    Returns:
+        int: The number of bytes written.
+
+    Raises:
+        ParsingError: When an attachment referred to is not found.
+
+    """
+    manifest = streamer.manifest_part.content
+    if streamer.manifest_part.delimited:
+        # The new line preceding the boundary
+        manifest = manifest[:-len(NL)]
+
+    includes = find_includes(manifest)
+    refs = Counter(cid for _, _, cid in includes)
+    spooled = {}
+    parts = streamer.iter_parts(close=False)
+    write = out.write
+    written = 0
+    pos = 0
+
+    def spool(part):
+        f = SpooledTemporaryFile(max_size=spool_max_size, dir=spool_dir)
+        for chunk in _iter_data(part, chunk_size):
+            f.write(chunk)
+        f.seek(0)
+        return f
+
+    try:
+        for start, end, cid in includes:
+            write(manifest[pos:start])
+            written += start - pos
+            pos = end
+            refs[cid] -= 1
+
+            if cid not in spooled:
+                for part in parts:
+                    if part.content_id == cid:
+                        if refs[cid]:
+                            # Included again later
+                            spooled[cid] = spool(part)
+                        else:
+                            written += _write_base64(
+                                _iter_data(part, chunk_size), write)
+                        break
+                    if refs.get(part.content_id):
+                        log.debug('Spool attachment %s arrived early',
+                                  part.content_id)
+                        spooled[part.content_id] = spool(part)
+                else:
+                    raise ParsingError(
+                        'Attachment not found: {}'.format(cid))
+
+            if cid in spooled:
+                f = spooled[cid]
+                f.seek(0)
+                written += _write_base64(
+                    iter(lambda: f.read(chunk_size), b''), write)
+                if not refs[cid]:
+                    spooled.pop(cid).close()
+
+        write(manifest[pos:])
+        written += len(manifest) - pos
+    finally:
+        for f in spooled.values():
+            f.close()
+
+    log.debug('Reconstructed %d bytes of XML with %d attachments',
+              written, len(includes))
+    return written
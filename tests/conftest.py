@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Fixtures shared by the test modules."""
+from __future__ import absolute_import
+import threading
+from pkg_resources import resource_string
+
+import pytest
+import responses
+from six.moves.BaseHTTPServer import HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from .helpers import XOP_CONTENT_TYPE
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def xop_raw():
+    """The raw XOP example message."""
+    return resource_string(__name__, 'data/xop_example')
+
+
+@pytest.fixture
+def xop_url(xop_raw):
+    """The URL at which :mod:`responses` serves the XOP example to
+    `GET` and `POST` requests.
+
+    """
+    url = 'http://mockapi/xop'
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        for method in (responses.GET, responses.POST):
+            rsps.add(method, url, body=xop_raw,
+                     content_type=XOP_CONTENT_TYPE)
+        yield url
+
+
+@pytest.fixture
+def serve():
+    """A function starting a local HTTP server with a handler class,
+    setting the given attributes on the server. The servers are shut
+    down after the test.
+
+    """
+    servers = []
+
+    def serve(handler, **attrs):
+        httpd = ThreadingServer(('127.0.0.1', 0), handler)
+        for k, v in attrs.items():
+            setattr(httpd, k, v)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        httpd.url = 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+        servers.append(httpd)
+        return httpd
+
+    yield serve
+
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
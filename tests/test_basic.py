@@ -23,7 +23,12 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import email
+import io
+import json
 import logging
+import os
+import threading
+import zipfile
 from pkg_resources import resource_string
 try:
     from StringIO import StringIO
@@ -33,14 +38,21 @@ except ImportError:
 import pytest
 import requests
 import responses
+from urllib3.exceptions import ProtocolError
 
+from mime_streamer import MIMEResponseStreamer
 from mime_streamer import MIMEStreamer
 from mime_streamer import XOPResponseStreamer
 from mime_streamer.exceptions import NoPartError
 from mime_streamer.exceptions import ParsingError
+from mime_streamer.exceptions import ResumeError
+from mime_streamer.mime_streamer import StreamIO
+from mime_streamer.transports import RequestsTransport
 from mime_streamer.utils import ensure_binary
 from mime_streamer.utils import ensure_text
 
+from .helpers import XOP_CONTENT_TYPE
+
 
 log = logging.getLogger(__name__)
 
@@ -66,6 +78,55 @@ class TestMIMEStreamer(object):
             content = part.content.read()
             assert content == ensure_binary(body)
 
+    def test_text_stream(self):
+        raw = load_raw('text_html')
+        body = email.message_from_string(ensure_text(raw)).get_payload()
+        streamer = MIMEStreamer(StringIO(raw))
+        with streamer.get_next_part() as part:
+            assert part.charset == 'utf-8'
+            assert ''.join(part.text_stream(chunk_size=7)) == body
+
+    @pytest.mark.parametrize('charset', ['utf-8', 'utf-16', 'shift_jis'])
+    @pytest.mark.parametrize('content_length', [False, True])
+    def test_text_stream_split_sequences(self, charset, content_length):
+        text = u'\u65e5\u672c\u8a9e\u306e\u30c6\u30ad\u30b9\u30c8 ' * 100
+        data = text.encode(charset)
+        raw = (b'--b\r\nContent-Type: text/plain;\r\n\tcharset="' +
+               charset.encode() + b'"\r\n')
+        if content_length:
+            raw += b'Content-Length: ' + str(len(data)).encode() + b'\r\n'
+        raw += b'\r\n' + data + b'\r\n--b--\r\n'
+
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            chunks = list(part.text_stream(chunk_size=5))
+        assert len(chunks) > 1
+        assert ''.join(chunks) == text
+
+    @pytest.mark.parametrize('charset', ['utf-8', 'utf-16-le'])
+    @pytest.mark.parametrize('text', [u'hello', u'\u65e5\u672c\u8a9e\r\n'])
+    def test_text_stream_preloaded(self, charset, text):
+        raw = (b'--b\r\nContent-Type: text/plain; charset=' +
+               charset.encode() + b'\r\n\r\n' + text.encode(charset) +
+               b'\r\n--b--\r\n')
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        part, = streamer.iter_parts(preload=True)
+        assert ''.join(part.text_stream(chunk_size=2)) == text
+
+    def test_text_stream_encoding(self):
+        raw = b'--b\r\nContent-Type: text/plain\r\n\r\ncaf\xe9\r\n--b--\r\n'
+
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            assert part.charset is None
+            with pytest.raises(UnicodeDecodeError):
+                list(part.text_stream())
+
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            assert ''.join(part.text_stream(encoding='latin-1')) == (
+                u'caf\xe9')
+
     def test_text_html_empty(self):
         raw = load_raw('text_html_empty')
         streamer = MIMEStreamer(StringIO(raw))
@@ -97,30 +158,574 @@ class TestMIMEStreamer(object):
             with streamer.get_next_part() as part:
                 assert True
 
+    def test_iter_parts(self):
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(StringIO(raw))
+
+        content_ids = [part.content_id for part in streamer.iter_parts()]
+        assert content_ids == [
+            None, '950120.aaCC@XIson.com', '950120.aaCB@XIson.com']
 
-@pytest.fixture
-def post_url():
-    url = 'http://mockapi/ep'
-    content_type = ('multipart/related; '
-                    'type="application/xop+xml"; '
-                    'start="<mymessage.xml@example.org>"; '
-                    'start-info="text/xml";\r\n\tboundary="MIME_boundary"')
-    responses.add(
-        responses.POST, url, status=200,
-        body=resource_string(__name__, 'data/xop_example'),
-        content_type=content_type)
+    def test_iter_parts_preload(self):
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(StringIO(raw))
+
+        contents = [p.content for p in streamer.iter_parts(preload=True)]
+        assert contents[0] == b''
+        assert contents[1] == (
+            b'25\r\n10\r\n34\r\n10\r\n25\r\n21\r\n26\r\n10\r\n')
+        assert contents[2].startswith(b'T2xkIE1hY0RvbmFsZCBoYWQgYSBmYXJt')
+
+    def test_iter_parts_partially_read(self):
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(StringIO(raw))
+
+        heads = [part.content.read(2) for part in streamer]
+        assert heads == [b'', b'25', b'T2']
+
+    def test_iter_parts_select(self):
+        raw = load_raw('multipart_related_basic')
+
+        streamer = MIMEStreamer(StringIO(raw))
+        parts = streamer.iter_parts(
+            select=lambda headers: 'content-description' in headers)
+        assert [part.content.read()[:10] for part in parts] == [
+            b'T2xkIE1hY0']
+
+        streamer = MIMEStreamer(StringIO(raw))
+        parts = streamer.iter_parts(
+            content_types=['application/x-fixedrecord'])
+        assert [part.content_id for part in parts] == [
+            '950120.aaCC@XIson.com']
+
+    def test_iter_parts_stops_when_selection_done(self):
+        stream = StringIO(load_raw('multipart_related_basic'))
+        streamer = MIMEStreamer(stream)
+
+        parts = streamer.iter_parts(content_ids=['<950120.aaCC@XIson.com>'])
+        assert [part.content.read(2) for part in parts] == [b'25']
+        # The file given by the caller is left open
+        assert not stream.closed
+        assert list(streamer) == []
+
+    def test_iter_parts_skips_sized_content_in_blocks(self):
+        class CountingStreamIO(StreamIO):
+            readlines = 0
+
+            def readline(self, length=None):
+                CountingStreamIO.readlines += 1
+                return super(CountingStreamIO, self).readline(length)
+
+        class CountingStreamer(MIMEStreamer):
+            def init_stream_io(self, stream):
+                return CountingStreamIO(stream)
+
+        data = b'\r\n'.join([b'0123456789'] * 1000)
+        for length in (len(data), 10):
+            CountingStreamIO.readlines = 0
+            streamer = CountingStreamer(
+                StringIO(self._sized_message(data, length)), boundary=b'b')
+            parts = streamer.iter_parts(content_ids=['next'])
+            assert [p.content.read() for p in parts] == [b'next\r\n']
+            if length == len(data):
+                assert CountingStreamIO.readlines < 20
+            else:
+                # Scanned for the boundary past the wrong length
+                assert CountingStreamIO.readlines > 1000
+
+    def test_iter_parts_without_closing_boundary(self):
+        raw = load_raw('xop_example')
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'MIME_boundary')
+
+        content_ids = [part.content_id for part in streamer]
+        assert content_ids[-2:] == [
+            'http://example.org/me.png', 'http://example.org/my.hsh']
+
+    def _array_message(self, arr, content_length=True):
+        data = arr.tobytes()
+        headers = b'Content-Type: application/octet-stream\r\n'
+        if content_length:
+            headers += 'Content-Length: {}\r\n'.format(len(data)).encode()
+        return (b'--b\r\n' + headers + b'\r\n' + data + b'\r\n--b--\r\n')
+
+    @pytest.mark.parametrize('content_length', [True, False])
+    def test_read_array(self, content_length):
+        numpy = pytest.importorskip('numpy')
+        arr = numpy.arange(1000, dtype='<f8')
+        raw = self._array_message(arr, content_length=content_length)
+
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            result = part.read_array('<f8', chunk_size=1024)
+        assert result.dtype == numpy.dtype('<f8')
+        assert (result == arr).all()
+
+    @pytest.mark.parametrize('content_length', [True, False])
+    def test_read_array_preloaded(self, content_length):
+        numpy = pytest.importorskip('numpy')
+        arr = numpy.arange(1000, dtype='<f8')
+        raw = self._array_message(arr, content_length=content_length)
+
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        part, = streamer.iter_parts(preload=True)
+        assert (part.read_array('<f8') == arr).all()
+        assert (part.read_array('<f8', shape=(10, 100)) ==
+                arr.reshape(10, 100)).all()
+
+    def test_read_array_with_shape(self):
+        numpy = pytest.importorskip('numpy')
+        arr = numpy.arange(24, dtype='<i4').reshape(2, 3, 4)
+        raw = self._array_message(arr, content_length=False)
+
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            result = part.read_array('<i4', shape=(2, 3, 4))
+        assert (result == arr).all()
+
+        for shape in [(3, 3, 4), (2, 3, 3)]:
+            streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+            with streamer.get_next_part() as part:
+                with pytest.raises(ValueError):
+                    part.read_array('<i4', shape=shape)
+
+    @pytest.mark.parametrize('length', [0, 800, 7992, 8008, 9000])
+    def test_read_array_wrong_content_length(self, length):
+        numpy = pytest.importorskip('numpy')
+        arr = numpy.arange(1000, dtype='<f8')
+        raw = (b'--b\r\nContent-Length: ' + str(length).encode() +
+               b'\r\n\r\n' + arr.tobytes() + b'\r\n--b--\r\n')
+
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            result = part.read_array('<f8', chunk_size=1024)
+        assert (result == arr).all()
+
+    def test_readinto(self):
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(StringIO(raw))
+        with streamer.get_next_part():
+            pass
+
+        with streamer.get_next_part() as part:
+            buff = bytearray(8)
+            assert part.content.readinto(buff) == 8
+            assert bytes(buff) == b'25\r\n10\r\n'
+            assert part.content.read(4) == b'34\r\n'
+
+    def test_save_to(self, tmpdir):
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(StringIO(raw))
+        with streamer.get_next_part():
+            pass
+
+        path = str(tmpdir.join('part'))
+        with streamer.get_next_part() as part:
+            part.content.read(4)
+            written = part.save_to(path, fsync=True)
+        expected = b'10\r\n34\r\n10\r\n25\r\n21\r\n26\r\n10'
+        assert written == len(expected)
+        with open(path, 'rb') as f:
+            assert f.read() == expected
+
+        path = str(tmpdir.join('fd'))
+        with open(path, 'wb') as f:
+            f.write(b'head')
+            f.flush()
+            with streamer.get_next_part() as part:
+                part.save_to(f.fileno(), chunk_size=16)
+        with open(path, 'rb') as f:
+            content = f.read()
+        assert content.startswith(b'headT2xkIE1hY0RvbmFsZCBoYWQgYSBmYXJt')
+        assert content.endswith(b'NrIHF1YWNrCkUgSSBFIEkgTwo=\r\n')
+
+    def test_save_to_preallocated(self, tmpdir):
+        raw = (b'--b\r\nContent-Length: 1000\r\n\r\n' + b'x' * 10 +
+               b'\r\n--b--\r\n')
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        path = str(tmpdir.join('part'))
+        with streamer.get_next_part() as part:
+            assert part.save_to(path) == 10
+        assert os.path.getsize(path) == 10
+
+    @pytest.mark.parametrize('length', [16, 10, 17, 18, 30, 1000])
+    def test_save_to_content_length(self, tmpdir, length):
+        data = b'\x89PNG\r\n\x1a\n' + b'\x00' * 8
+        raw = self._sized_message(data, length)
+        path = str(tmpdir.join('part'))
+        for preload in (False, True):
+            streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+            part = next(streamer.iter_parts(preload=preload))
+            assert part.save_to(path, chunk_size=3) == len(data)
+            with open(path, 'rb') as f:
+                assert f.read() == data
+
+        # The same as read, whatever the content length
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            part.strip_delimiter()
+            assert part.content.read() == data
+
+    def test_extract_all(self, tmpdir):
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(StringIO(raw))
+
+        extracted = streamer.extract_all(str(tmpdir), fsync_batch=1)
+        assert [cid for cid, _ in extracted] == [
+            '950120.aaCC@XIson.com', '950120.aaCB@XIson.com']
+        assert sorted(os.listdir(str(tmpdir))) == [
+            '950120.aaCB@XIson.com', '950120.aaCC@XIson.com']
+        with open(extracted[0][1], 'rb') as f:
+            assert f.read() == (
+                b'25\r\n10\r\n34\r\n10\r\n25\r\n21\r\n26\r\n10')
+
+    def _sized_message(self, data, length):
+        return (b'--b\r\nContent-Length: ' + str(length).encode() +
+                b'\r\n\r\n' + data + b'\r\n--b\r\nContent-ID: <next>\r\n'
+                b'\r\nnext\r\n--b--\r\n')
+
+    @pytest.mark.parametrize('length', [30000, 10, 29990, 30100, 'x', -1])
+    def test_content_length(self, length):
+        data = b'\r\n'.join([b'-' * 98] * 300)[:30000]
+        raw = self._sized_message(data, length)
+
+        for preload in (False, True):
+            streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+            parts = [(p.content_id, p.content if preload else p.content.read())
+                     for p in streamer.iter_parts(preload=preload)]
+            assert parts == [(None, data + b'\r\n'), ('next', b'next\r\n')]
+
+    def test_content_length_of_envelope(self):
+        body = (b'--b\r\nContent-ID: <a>\r\n\r\nAAA\r\n'
+                b'--b\r\nContent-ID: <next>\r\n\r\nnext\r\n--b--\r\n')
+        raw = (b'Content-Type: multipart/related; boundary=b\r\n'
+               b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' +
+               body)
+        for preload in (False, True):
+            streamer = MIMEStreamer(StringIO(raw))
+            parts = [(p.content_id, p.content if preload else p.content.read())
+                     for p in streamer.iter_parts(preload=preload)]
+            assert parts == [
+                (None, b''), ('a', b'AAA\r\n'), ('next', b'next\r\n')]
+
+    @pytest.mark.parametrize('size', [65532, 65533, 65534, 65535, 65536])
+    def test_content_length_past_boundary_across_blocks(self, size):
+        data = b'x' * size
+        raw = self._sized_message(data, size + 100)
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        parts = [(p.content_id, p.content.read())
+                 for p in streamer.iter_parts()]
+        assert parts == [(None, data + b'\r\n'), ('next', b'next\r\n')]
+
+    @pytest.mark.parametrize('data', [b'\r\n\r\ndata\r\n', b'\r\n', b''])
+    def test_content_starting_with_blank_line(self, data):
+        raw = (b'--b\r\nX-Foo: bar\r\n\r\n' + data + b'\r\n--b\r\n'
+               b'Content-ID: <next>\r\n\r\nnext\r\n--b--\r\n')
+        for preload in (False, True):
+            streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+            assert [p.content if preload else p.content.read()
+                    for p in streamer.iter_parts(preload=preload)] == [
+                data + b'\r\n', b'next\r\n']
+
+    @pytest.mark.parametrize('length', [None, 30000, 10, 30100])
+    @pytest.mark.parametrize('size', [1, 2, 3, 1000, -1])
+    def test_strip_delimiter(self, length, size):
+        data = b'\r\n'.join([b'-' * 98] * 300)[:30000] + b'\r\n\r\n'
+        raw = (self._sized_message(data, length) if length is not None else
+               b'--b\r\nX-Foo: bar\r\n\r\n' + data + b'\r\n--b--\r\n')
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            part.strip_delimiter()
+            chunks = iter(lambda: part.content.read(size), b'')
+            assert b''.join(chunks) == data
+            assert not part.content.delimited
+
+    def test_strip_delimiter_at_eof(self):
+        raw = b'--b\r\nX-Foo: bar\r\n\r\ndata\r\n'
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+        with streamer.get_next_part() as part:
+            part.strip_delimiter()
+            assert part.content.read() == b'data\r\n'
+
+    @pytest.mark.parametrize('strip', [False, True])
+    def test_preload_same_as_stream(self, strip):
+        raw = (b'--b\r\nContent-Length: 8\r\n\r\ndata\r\n\r\n\r\n'
+               b'--b\r\nX-Foo: bar\r\n\r\n\r\n--b\r\nX-Foo: bar\r\n\r\n'
+               b'--b\r\nX-Foo: bar\r\n\r\nlast\r\n')
+
+        def contents(preload):
+            result = []
+            for part in MIMEStreamer(StringIO(raw), boundary=b'b').iter_parts(
+                    preload=preload):
+                if strip:
+                    part.strip_delimiter()
+                content = part.content if preload else part.content.read()
+                result.append((content, part.delimited))
+            return result
+
+        assert contents(True) == contents(False)
+        assert [c for c, _ in contents(True)] == (
+            [b'data\r\n\r\n', b'', b'', b'last\r\n'] if strip else
+            [b'data\r\n\r\n\r\n', b'\r\n', b'', b'last\r\n'])
+
+    def test_content_length_reads_blocks(self):
+        class CountingStreamIO(StreamIO):
+            readlines = 0
+
+            def readline(self, length=None):
+                CountingStreamIO.readlines += 1
+                return super(CountingStreamIO, self).readline(length)
+
+        class CountingStreamer(MIMEStreamer):
+            def init_stream_io(self, stream):
+                return CountingStreamIO(stream)
+
+        data = b'\r\n'.join([b'0123456789'] * 1000)
+        streamer = CountingStreamer(
+            StringIO(self._sized_message(data, len(data))), boundary=b'b')
+        with streamer.get_next_part() as part:
+            assert part.content.read() == data + b'\r\n'
+        assert CountingStreamIO.readlines < 10
+
+    def test_checkpoint_resume(self):
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(StringIO(raw))
+
+        with streamer.get_next_part() as part:
+            pass
+
+        with streamer.get_next_part() as part:
+            head = part.content.read(5)
+            checkpoint = json.loads(json.dumps(streamer.checkpoint()))
+
+        assert checkpoint['part']['offset'] == 5
+        stream = StringIO(raw)
+        stream.seek(checkpoint['offset'])
+        streamer = MIMEStreamer(stream, checkpoint=checkpoint)
+
+        with streamer.get_next_part() as part:
+            assert part.headers['content-id'] == '<950120.aaCC@XIson.com>'
+            assert head + part.content.read() == (
+                b'25\r\n10\r\n34\r\n10\r\n25\r\n21\r\n26\r\n10\r\n')
+
+        with streamer.get_next_part() as part:
+            assert part.headers['content-id'] == '<950120.aaCB@XIson.com>'
+
+        with pytest.raises(NoPartError):
+            with streamer.get_next_part() as part:
+                pass
+
+    def test_checkpoint_resume_at_every_offset(self):
+        contents = [b'hello\r\n', b'a\rb\r\r\n\r\n', b'world']
+        raw = b''.join(
+            b'--B\r\nContent-ID: <' + str(index).encode() + b'>\r\n\r\n' +
+            data + b'\r\n' for index, data in enumerate(contents)) + b'--B--'
+
+        for index, data in enumerate(contents):
+            expected = data + b'\r\n'
+            for offset in range(len(expected) + 1):
+                streamer = MIMEStreamer(StringIO(raw), boundary=b'B')
+                for _ in range(index):
+                    with streamer.get_next_part():
+                        pass
+                with streamer.get_next_part() as part:
+                    head = part.content.read(offset) if offset else b''
+                    checkpoint = streamer.checkpoint()
+
+                stream = StringIO(raw)
+                stream.seek(checkpoint['offset'])
+                streamer = MIMEStreamer(stream, checkpoint=checkpoint)
+                parts = [(p.content_id, p.content.read())
+                         for p in streamer.iter_parts()]
+                assert parts[0] == (str(index), expected[offset:])
+                assert head + parts[0][1] == expected
+                assert [cid for cid, _ in parts[1:]] == [
+                    str(i) for i in range(index + 1, len(contents))]
+
+    def test_checkpoint_resume_stripped_at_every_offset(self):
+        data = b'a\r\n\r\nb\r\n'
+        raw = (b'--B\r\nX-Foo: bar\r\n\r\n' + data +
+               b'\r\n--B\r\nContent-ID: <next>\r\n\r\nnext\r\n--B--')
+        for offset in range(len(data) + 1):
+            streamer = MIMEStreamer(StringIO(raw), boundary=b'B')
+            with streamer.get_next_part() as part:
+                part.strip_delimiter()
+                head = part.content.read(offset) if offset else b''
+                checkpoint = streamer.checkpoint()
+
+            stream = StringIO(raw)
+            stream.seek(checkpoint['offset'])
+            streamer = MIMEStreamer(stream, checkpoint=checkpoint)
+            parts = [(p.content_id, p.content.read())
+                     for p in streamer.iter_parts()]
+            assert head == data[:offset]
+            assert parts == [(None, data[offset:] + b'\r\n'),
+                             ('next', b'next\r\n')]
+
+    @pytest.mark.parametrize('length', [30000, 'x'])
+    def test_seek(self, length):
+        data = b'\r\n'.join([b'-' * 98] * 300)[:30000]
+        streamer = MIMEStreamer(
+            StringIO(self._sized_message(data, length)), boundary=b'b')
+
+        with streamer.get_next_part() as part:
+            content = part.content
+            assert content.seekable()
+            assert content.read(10) == data[:10]
+            assert content.seek(-12, os.SEEK_END) == len(data) - 10
+            assert content.read() == data[-10:] + b'\r\n'
+            assert content.seek(50) == 50
+            assert content.tell() == 50
+            assert content.read(20) == data[50:70]
+            assert content.seek(10, os.SEEK_CUR) == 80
+            assert content.read(5) == data[80:85]
+            assert content.seek(1 << 20) == len(data) + 2
+            assert content.read() == b''
+            content.seek(100)
+
+            with pytest.raises(ValueError):
+                content.seek(-1)
+
+        with streamer.get_next_part() as part:
+            assert part.content_id == 'next'
+            assert part.content.read() == b'next\r\n'
+
+    @pytest.mark.parametrize('length', [30000, 'x'])
+    def test_seek_stripped(self, length):
+        data = b'\r\n'.join([b'-' * 98] * 300)[:30000]
+        streamer = MIMEStreamer(
+            StringIO(self._sized_message(data, length)), boundary=b'b')
+
+        with streamer.get_next_part() as part:
+            part.strip_delimiter()
+            content = part.content
+            assert content.seek(-10, os.SEEK_END) == len(data) - 10
+            assert content.read() == data[-10:]
+            assert content.seek(1 << 20) == len(data)
+            assert content.read() == b''
+
+        with streamer.get_next_part() as part:
+            assert part.content.read() == b'next\r\n'
+
+    def test_seek_zip_archive(self):
+        buff = io.BytesIO()
+        with zipfile.ZipFile(buff, 'w') as archive:
+            archive.writestr('a.txt', b'a' * 1000)
+            archive.writestr('b.txt', b'b' * 10)
+        data = buff.getvalue()
+
+        streamer = MIMEStreamer(
+            StringIO(self._sized_message(data, len(data))), boundary=b'b')
+        with streamer.get_next_part() as part:
+            with zipfile.ZipFile(part.content) as archive:
+                assert archive.read('b.txt') == b'b' * 10
+
+        with streamer.get_next_part() as part:
+            assert part.content.read() == b'next\r\n'
+
+    def test_seek_non_seekable_stream(self):
+        streamer = MIMEStreamer(
+            NonSeekableIO(self._sized_message(b'data', 4)), boundary=b'b')
+        with streamer.get_next_part() as part:
+            assert not part.content.seekable()
+            with pytest.raises(IOError):
+                part.content.seek(0)
+
+
+class NonSeekableIO(io.RawIOBase):
+    """Raw stream that cannot tell or seek, like a pipe."""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
 
-    responses.start()
+    def readable(self):
+        return True
 
-    yield url
+    def readinto(self, b):
+        data = self._data.read(len(b))
+        b[:len(data)] = data
+        return len(data)
 
-    responses.stop()
+
+class TestStreamIO(object):
+
+    raw = (b'a\ra\n\n\nb\r\n\r\r\n\n' + b'\n' * 20 + b'\r\n' +
+           b'x' * 30 + b'\r')
+
+    @pytest.mark.parametrize('block_size', [1, 2, 3, 7, 1 << 16])
+    def test_lines_split_at_crlf_only(self, block_size):
+        stream = StreamIO(io.BytesIO(self.raw))
+        stream.block_size = block_size
+        assert list(iter(stream.readline, b'')) == [
+            b'a\ra\n\n\nb\r\n', b'\r\r\n', b'\n' * 21 + b'\r\n',
+            b'x' * 30 + b'\r']
+
+    @pytest.mark.parametrize('block_size', [1, 3, 1 << 16])
+    def test_unread(self, block_size):
+        stream = StreamIO(io.BytesIO(self.raw))
+        stream.block_size = block_size
+        first = stream.readline()
+        second = stream.readline()
+        stream.unread(second)
+        stream.unread(first)
+        assert stream.tell() == 0
+        assert stream.readline() == first
+
+        data = stream.read(5)
+        stream.unread(data)
+        assert stream.read(5) == data
+        assert stream.tell() == len(first) + 5
+
+        line = stream.readline()
+        stream.rollback_line()
+        assert stream.readline() == line
+        pos = stream.tell()
+        assert stream.read(1 << 10) == self.raw[pos:]
+        assert stream.tell() == len(self.raw)
+
+    def test_non_seekable_stream(self):
+        stream = StreamIO(io.BufferedReader(NonSeekableIO(self.raw)))
+        assert stream.readline() == b'a\ra\n\n\nb\r\n'
+        assert stream.reaches_eof()
+        assert stream.tell() == 9
+
+        raw = load_raw('multipart_related_basic')
+        streamer = MIMEStreamer(io.BufferedReader(NonSeekableIO(raw)))
+        assert len([part.content.read() for part in streamer]) == 3
+
+    def test_pipe_read_as_available(self):
+        rfd, wfd = os.pipe()
+        got_first = threading.Event()
+        waited = []
+
+        def write():
+            with io.open(wfd, 'wb') as f:
+                f.write(b'--b\r\nX-Foo: bar\r\n\r\nfirst\r\n--b\r\n')
+                f.flush()
+                # The rest is written only once the first part is read,
+                # or in vain after a while
+                waited.append(got_first.wait(10))
+                f.write(b'X-Foo: bar\r\n\r\nsecond\r\n--b--\r\n')
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            with io.open(rfd, 'rb') as f:
+                streamer = MIMEStreamer(f, boundary=b'b')
+                with streamer.get_next_part() as part:
+                    assert part.content.read() == b'first\r\n'
+                got_first.set()
+                with streamer.get_next_part() as part:
+                    assert part.content.read() == b'second\r\n'
+        finally:
+            got_first.set()
+            writer.join()
+        assert waited == [True]
 
 
 class TestXOPResponseStreamer(object):
 
-    def test_xop_example(self, post_url):
-        resp = requests.post(post_url, stream=True)
+    def test_xop_example(self, xop_url):
+        resp = requests.post(xop_url, stream=True)
         assert resp.status_code == 200
 
         streamer = XOPResponseStreamer(resp)
@@ -135,3 +740,160 @@ class TestXOPResponseStreamer(object):
         with streamer.get_next_part() as part:
             assert part.headers['content-id'] == '<http://example.org/my.hsh>'
             assert part.content.read() == b'7923579\r\n'
+
+    def test_manifest_text_stream(self, xop_url):
+        streamer = XOPResponseStreamer(requests.get(xop_url, stream=True))
+        text = ''.join(streamer.manifest_part.text_stream(chunk_size=3))
+        assert streamer.manifest_part.delimited
+        assert text + u'\r\n' == (
+            streamer.manifest_part.content.decode('utf-8'))
+        assert text.endswith('</m:data>\r\n')
+
+        data = b'\r\n'.join([b'x' * 50] * 100)
+        raw = (b'--b\r\nContent-Length: ' + str(len(data)).encode() +
+               b'\r\n\r\n' + data + b'\r\n--b\r\nContent-ID: <next>\r\n'
+               b'\r\nnext\r\n--b--\r\n')
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'http://mockapi/sized', body=raw,
+                     content_type='multipart/mixed; boundary=b')
+            resp = requests.get('http://mockapi/sized', stream=True)
+            streamer = MIMEResponseStreamer(resp)
+            parts = [(p.content_id, p.content.read()) for p in streamer]
+        assert parts == [(None, data + b'\r\n'), ('next', b'next\r\n')]
+
+    @pytest.mark.parametrize('length', [0, 5, 6, 8, 10, 11, 13, 200])
+    @pytest.mark.parametrize('chunk_size', [1, 3, 512])
+    def test_response_wrong_content_length(self, length, chunk_size):
+        raw = (b'--b\r\nContent-ID: <a>\r\nContent-Length: ' +
+               str(length).encode() + b'\r\n\r\n\r\n\r\n--b\r\n'
+               b'Content-ID: <next>\r\n\r\nnext\r\n--b--\r\n')
+        expected = [(p.content_id, p.content.read()) for p in
+                    MIMEStreamer(StringIO(raw), boundary=b'b')]
+        assert expected[-1] == ('next', b'next\r\n')
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'http://mockapi/wrong', body=raw,
+                     content_type='multipart/mixed; boundary=b')
+            transport = RequestsTransport(
+                requests.get('http://mockapi/wrong', stream=True))
+            transport.chunk_size = chunk_size
+            streamer = MIMEResponseStreamer(transport)
+            parts = [(p.content_id, p.content.read()) for p in streamer]
+        assert parts == expected
+
+    def test_iter_parts_releases_response(self, xop_url):
+        resp = requests.get(xop_url, stream=True)
+        streamer = XOPResponseStreamer(resp)
+
+        parts = streamer.iter_parts(
+            content_ids=['cid:http%3A%2F%2Fexample.org%2Fme.png'])
+        assert [part.content.read() for part in parts] == [
+            b'23580\r\n\r\n']
+        assert resp.raw.closed
+
+
+class DroppingIO(io.RawIOBase):
+    """Raw stream dropping the connection after `size` bytes."""
+
+    def __init__(self, data, size):
+        self._data = data[:size]
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._pos >= len(self._data):
+            raise ProtocolError('Connection dropped')
+        n = min(len(b), len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+@pytest.fixture
+def range_server():
+    """A stand-in HTTP server honoring `Range` requests, optionally
+    dropping connections after given numbers of bytes.
+
+    """
+    url = 'http://mockapi/xop'
+    raw = load_raw('xop_example')
+    state = {'drops': [], 'requests': []}
+
+    def callback(req):
+        offset = 0
+        status = 200
+        headers = {}
+        if 'Range' in req.headers:
+            offset = int(req.headers['Range'].split('=')[1].split('-')[0])
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                offset, len(raw) - 1, len(raw))
+        state['requests'].append(offset)
+        body = raw[offset:]
+        if state['drops']:
+            body = io.BufferedReader(DroppingIO(body, state['drops'].pop(0)))
+        return status, headers, body
+
+    def reopen(offset):
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        return requests.get(url, stream=True, headers=headers)
+
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(responses.GET, url, callback=callback,
+                          content_type=XOP_CONTENT_TYPE)
+        yield reopen, state
+
+
+class TestResumableXOPResponseStreamer(object):
+
+    def _read_attachments(self, streamer):
+        contents = []
+        for _ in range(2):
+            with streamer.get_next_part() as part:
+                contents.append(part.content.read())
+        return contents
+
+    def test_reopen_on_dropped_connection(self, range_server):
+        reopen, state = range_server
+        state['drops'].extend([200, 150])
+
+        streamer = XOPResponseStreamer(reopen(0), reopen=reopen)
+        assert streamer.manifest_part.headers['content-id'] == (
+            '<mymessage.xml@example.org>')
+        assert self._read_attachments(streamer) == [
+            b'23580\r\n\r\n', b'7923579\r\n']
+        assert len(state['requests']) == 3
+
+    def test_dropped_connection_without_reopen(self, range_server):
+        reopen, state = range_server
+        state['drops'].append(200)
+
+        with pytest.raises(requests.exceptions.ChunkedEncodingError):
+            XOPResponseStreamer(reopen(0))
+
+    def test_resume_from_checkpoint(self, range_server):
+        reopen, state = range_server
+
+        streamer = XOPResponseStreamer(reopen(0), reopen=reopen)
+        with streamer.get_next_part() as part:
+            assert part.content.read(2) == b'23'
+            checkpoint = json.loads(json.dumps(streamer.checkpoint()))
+
+        streamer = XOPResponseStreamer.resume(checkpoint, reopen)
+        assert state['requests'][-1] == checkpoint['offset']
+        assert streamer.manifest_part.headers['content-id'] == (
+            '<mymessage.xml@example.org>')
+        assert b'xop:Include' in streamer.manifest_part.content
+        assert self._read_attachments(streamer) == [
+            b'580\r\n\r\n', b'7923579\r\n']
+
+    def test_resume_rejects_full_content(self, range_server):
+        reopen, state = range_server
+        streamer = XOPResponseStreamer(reopen(0), reopen=reopen)
+        checkpoint = streamer.checkpoint()
+
+        with pytest.raises(ResumeError):
+            XOPResponseStreamer.resume(
+                checkpoint, lambda offset: reopen(0))
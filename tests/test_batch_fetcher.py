@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+
+import pytest
+import requests
+import responses
+
+from mime_streamer.batch_fetcher import BatchFetcher
+
+from .helpers import XOP_CONTENT_TYPE
+
+
+@pytest.fixture
+def urls(xop_raw):
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        urls = []
+        for i in range(8):
+            url = 'http://mockapi/xop/{}'.format(i)
+            rsps.add(responses.GET, url, body=xop_raw,
+                     content_type=XOP_CONTENT_TYPE)
+            urls.append(url)
+        rsps.add(responses.GET, 'http://mockapi/error', status=500)
+        yield urls
+
+
+def read_first_attachment(spec, streamer):
+    with streamer.get_next_part() as part:
+        return part.headers['content-id'], part.content.read()
+
+
+class TestBatchFetcher(object):
+
+    def test_fetch(self, urls):
+        specs = [{'method': 'GET', 'url': url} for url in urls]
+        with BatchFetcher(pool_size=3) as fetcher:
+            results = fetcher.fetch(specs, read_first_attachment)
+
+        assert [r.spec for r in results] == specs
+        for result in results:
+            assert result.ok
+            assert result.value == ('<http://example.org/me.png>',
+                                    b'23580\r\n\r\n')
+            assert 0 <= result.latency <= result.elapsed
+
+    def test_iter_fetch(self, urls):
+        specs = [{'method': 'GET', 'url': url} for url in urls]
+        with BatchFetcher(pool_size=3) as fetcher:
+            results = list(fetcher.iter_fetch(specs, read_first_attachment))
+
+        assert sorted(r.spec['url'] for r in results) == sorted(urls)
+        assert all(r.ok for r in results)
+
+    def test_errors_are_reported_per_request(self, urls):
+        specs = [{'method': 'GET', 'url': 'http://mockapi/error'},
+                 {'method': 'GET', 'url': urls[0]}]
+
+        def callback(spec, streamer):
+            raise ValueError('callback failed')
+
+        with BatchFetcher(pool_size=2) as fetcher:
+            error, failed = fetcher.fetch(specs, callback)
+
+        assert isinstance(error.error, requests.HTTPError)
+        assert error.value is None
+        assert error.latency is not None
+        assert isinstance(failed.error, ValueError)
+
+    def test_shared_session(self, urls):
+        session = requests.Session()
+        with BatchFetcher(session=session) as fetcher:
+            assert fetcher.session is session
+            results = fetcher.fetch([{'method': 'GET', 'url': urls[0]}],
+                                    read_first_attachment)
+        assert results[0].ok
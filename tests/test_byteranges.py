@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+import io
+import os
+import random
+
+import pytest
+import requests
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+
+from mime_streamer.byteranges import ByteRangesStreamer
+from mime_streamer.byteranges import fetch_ranges
+from mime_streamer.byteranges import parse_content_range
+from mime_streamer.byteranges import split_ranges
+from mime_streamer.exceptions import InvalidContentType
+from mime_streamer.exceptions import RangeError
+
+
+BOUNDARY = 'THIS_STRING_SEPARATES_0123456789'
+
+
+def make_data(size, seed=0):
+    rand = random.Random(seed)
+    return bytes(bytearray(rand.choice(b'ab\r\n-') for _ in range(size)))
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves `server.data` honoring `Range` and `If-Range` requests."""
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status, headers, body):
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        data = self.server.data
+        etag = self.server.etag
+        spec = self.headers.get('Range')
+        self.server.requests.append(spec)
+        if (not spec or self.server.ignore_range or
+                self.headers.get('If-Range', etag) != etag):
+            return self.send_body(200, [('ETag', etag)], data)
+
+        ranges = []
+        for item in spec.split('=', 1)[1].split(','):
+            start, end = item.split('-')
+            ranges.append((int(start), min(int(end), len(data) - 1)))
+
+        # The sizes reported for successive ranges
+        totals = iter(self.server.totals or [])
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            return self.send_body(206, [
+                ('ETag', etag),
+                ('Content-Type', 'application/octet-stream'),
+                ('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, end, next(totals, len(data))))],
+                data[start:end + 1])
+
+        body = io.BytesIO()
+        for start, end in ranges:
+            body.write('\r\n--{}\r\n'.format(BOUNDARY).encode())
+            body.write(b'Content-Type: application/octet-stream\r\n')
+            body.write('Content-Range: bytes {}-{}/{}\r\n\r\n'.format(
+                start, end, next(totals, len(data))).encode())
+            body.write(data[start:end + 1])
+        body.write('\r\n--{}--\r\n'.format(BOUNDARY).encode())
+        self.send_body(206, [
+            ('ETag', etag),
+            ('Content-Type',
+             'multipart/byteranges; boundary=' + BOUNDARY)], body.getvalue())
+
+
+@pytest.fixture
+def server(serve):
+    """A local HTTP server standing in for the storage tier."""
+    httpd = serve(RangeHandler, data=make_data(100000), etag='"v1"',
+                  requests=[], ignore_range=False, totals=None)
+    httpd.url += '/object'
+    return httpd
+
+
+class TestParseContentRange(object):
+
+    def test_parse(self):
+        assert parse_content_range('bytes 0-99/1234') == (0, 99, 1234)
+        assert parse_content_range('bytes 5-5/*') == (5, 5, None)
+
+    @pytest.mark.parametrize('text', [None, '', 'bytes 9-1/10', 'bytes */10'])
+    def test_invalid(self, text):
+        with pytest.raises(RangeError):
+            parse_content_range(text)
+
+    def test_split_ranges(self):
+        assert split_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+        assert split_ranges(2, 4) == [(0, 0), (1, 1)]
+        assert split_ranges(0, 4) == []
+
+
+class TestByteRangesStreamer(object):
+
+    def test_write_to_buffer(self, server):
+        resp = requests.get(server.url, stream=True,
+                            headers={'Range': 'bytes=10-99,500-1499,0-4'})
+        buff = bytearray(len(server.data))
+        ranges = ByteRangesStreamer(resp).write_to(buff)
+        assert ranges == [(10, 99), (500, 1499), (0, 4)]
+        for start, end in ranges:
+            assert buff[start:end + 1] == server.data[start:end + 1]
+        assert buff[100:500] == b'\0' * 400
+
+    def test_write_to_file(self, server, tmpdir):
+        resp = requests.get(server.url, stream=True,
+                            headers={'Range': 'bytes=0-9,20-29'})
+        path = str(tmpdir.join('object'))
+        with open(path, 'wb') as f:
+            ByteRangesStreamer(resp).write_to(f)
+        with open(path, 'rb') as f:
+            written = f.read()
+        assert written[:10] == server.data[:10]
+        assert written[20:30] == server.data[20:30]
+
+    def test_iter_ranges(self, server):
+        resp = requests.get(server.url, stream=True,
+                            headers={'Range': 'bytes=0-9,20-29'})
+        assert [(start, end, total, part.content.read())
+                for start, end, total, part
+                in ByteRangesStreamer(resp).iter_ranges()] == [
+            (0, 9, 100000, server.data[:10]),
+            (20, 29, 100000, server.data[20:30])]
+
+    @pytest.mark.parametrize('totals, size', [
+        ([100000, 99999], None), ([100000, 100000], 99999)])
+    def test_size_changed(self, server, totals, size):
+        server.totals = totals
+        resp = requests.get(server.url, stream=True,
+                            headers={'Range': 'bytes=0-9,20-29'})
+        with pytest.raises(RangeError):
+            ByteRangesStreamer(resp).write_to(bytearray(100000), size=size)
+
+    def test_not_byteranges(self, server):
+        resp = requests.get(server.url, stream=True,
+                            headers={'Range': 'bytes=0-9'})
+        with pytest.raises((InvalidContentType, KeyError)):
+            ByteRangesStreamer(resp)
+
+
+class TestFetchRanges(object):
+
+    @pytest.mark.parametrize('parts, ranges_per_request', [
+        (1, 1), (7, 1), (8, 3), (16, 16)])
+    def test_fetch_into_buffer(self, server, parts, ranges_per_request):
+        data = fetch_ranges(server.url, parts=parts,
+                            ranges_per_request=ranges_per_request)
+        assert data == server.data
+        # The HEAD request and the range requests
+        assert len(server.requests) == 1 + -(-parts // ranges_per_request)
+
+    def test_fetch_into_file(self, server, tmpdir):
+        path = str(tmpdir.join('object'))
+        with open(path, 'wb') as f:
+            f.write(b'x' * (len(server.data) * 2))
+        assert fetch_ranges(server.url, target=path, parts=5) == path
+        with open(path, 'rb') as f:
+            assert f.read() == server.data
+
+    def test_fetch_into_fd_with_size(self, server, tmpdir):
+        path = str(tmpdir.join('object'))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            fetch_ranges(server.url, target=fd, size=len(server.data),
+                         parts=4)
+        finally:
+            os.close(fd)
+        with open(path, 'rb') as f:
+            assert f.read() == server.data
+        assert None not in server.requests
+
+    def test_fetch_into_numpy_array(self, server):
+        numpy = pytest.importorskip('numpy')
+        arr = numpy.zeros(len(server.data) // 4, dtype=numpy.uint32)
+        fetch_ranges(server.url, target=arr, size=arr.nbytes, parts=3,
+                     ranges_per_request=2)
+        assert arr.tobytes() == server.data[:arr.nbytes]
+
+    def test_range_ignored(self, server):
+        server.ignore_range = True
+        with pytest.raises(RangeError):
+            fetch_ranges(server.url, parts=2)
+
+    def test_object_size_changed_in_byteranges(self, server):
+        server.totals = [len(server.data) + 1]
+        with pytest.raises(RangeError):
+            fetch_ranges(server.url, size=len(server.data), parts=4,
+                         ranges_per_request=2)
+
+    def test_object_changed(self, server):
+        original = RangeHandler.do_HEAD
+
+        def do_HEAD(handler):
+            original(handler)
+            handler.server.etag = '"v2"'
+
+        RangeHandler.do_HEAD = do_HEAD
+        try:
+            with pytest.raises(RangeError):
+                fetch_ranges(server.url, parts=2)
+        finally:
+            RangeHandler.do_HEAD = original
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""Check that parsing work and memory grow linearly with the size of
+pathological payloads, so that hostile or broken content cannot stall
+the parser.
+
+The work is measured as the number of function calls, including calls
+into builtins such as :meth:`bytes.find`, and the number of bytes
+allocated, which catches quadratic copying such as growing a line with
+``line += s`` that no function call reveals. Both are deterministic.
+The wall-clock time is checked as well when the environment variable
+`MIME_STREAMER_TIMING` is set, as it is subject to noise on shared
+machines.
+
+"""
+from __future__ import absolute_import
+import os
+import sys
+from io import BytesIO
+from timeit import default_timer
+
+import pytest
+
+from mime_streamer import MIMEResponseStreamer
+from mime_streamer import MIMEStreamer
+from mime_streamer.feed_parser import parse_chunks
+from mime_streamer.mime_streamer import StreamIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Growing the payload by this factor must not grow the cost by more
+# than the factor times the tolerance; a quadratic cost grows by the
+# factor squared
+FACTOR = 4
+TOLERANCE = 2.5
+
+# The floor of time measurements to absorb timer noise
+MIN_TIME = 0.002
+
+# The payloads are shrunk by this factor when measuring the work, which
+# takes longer than timing but needs no large sizes to be exact
+WORK_SCALE = 8
+
+
+class FakeResponse(object):
+    """A minimal stand-in of :class:`requests.Response`."""
+
+    def __init__(self, raw, boundary):
+        self.raw = raw
+        self.headers = {
+            'content-type': 'multipart/mixed; boundary=' + boundary}
+
+    def iter_content(self, chunk_size=1, decode_unicode=None):
+        for i in range(0, len(self.raw), chunk_size):
+            yield self.raw[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+
+def consume(parts):
+    n = 0
+    for part in parts:
+        n += len(part.content.read())
+    return n
+
+
+def run_stream(raw, boundary):
+    return consume(MIMEStreamer(BytesIO(raw), boundary=boundary.encode()))
+
+
+def run_lines(raw, boundary):
+    return sum(1 for _ in iter(StreamIO(BytesIO(raw)).readline, b''))
+
+
+def run_response(raw, boundary):
+    return consume(MIMEResponseStreamer(FakeResponse(raw, boundary)))
+
+
+def run_feed(raw, boundary):
+    chunks = (raw[i:i + 4096] for i in range(0, len(raw), 4096))
+    return sum(1 for _ in parse_chunks(chunks, boundary=boundary))
+
+
+RUNNERS = [run_lines, run_stream, run_response, run_feed]
+
+
+def message(body, headers=b'Content-Type: application/octet-stream\r\n'):
+    return b'--b\r\n' + headers + b'\r\n' + body + b'\r\n--b--\r\n'
+
+
+def lf_only_body(n):
+    return message(b'\n' * n)
+
+
+def lf_heavy_lines(n):
+    return message((b'\n' * 4094 + b'\r\n') * (n // 4096))
+
+
+def boundary_prefix_lines(n):
+    return message(b'--\r\n--b\n-\r\n' * (n // 12))
+
+
+def long_line_body(n):
+    return message(b'a' * n)
+
+
+def many_header_lines(n):
+    return message(b'body', headers=b'X-Header: value\r\n' * (n // 17))
+
+
+def long_header_line(n):
+    return message(b'body', headers=b'X-Header: ' + b'v' * n + b'\r\n')
+
+
+def many_parts(n):
+    part = b'--b\r\nContent-ID: <id>\r\n\r\nx\r\n'
+    return part * (n // len(part)) + b'--b--\r\n'
+
+
+PAYLOADS = [
+    (lf_only_body, 20000),
+    (lf_heavy_lines, 50000),
+    (boundary_prefix_lines, 40000),
+    (long_line_body, 500000),
+    (many_header_lines, 50000),
+    (long_header_line, 500000),
+    (many_parts, 25000),
+]
+
+
+def best_time(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        started = default_timer()
+        func()
+        times.append(default_timer() - started)
+    return max(min(times), MIN_TIME)
+
+
+def measure_work(func):
+    """Count the function calls made by `func` and the bytes it
+    allocates.
+
+    The allocated bytes are summed from the rise of the traced memory
+    between profiler events, so that a buffer allocated and freed again
+    in a loop is counted on every iteration.
+
+    Returns:
+        tuple: The number of calls and the number of bytes allocated.
+
+    """
+    state = {'calls': 0, 'allocated': 0, 'current': 0}
+
+    def profile(frame, event, arg):
+        if event in ('call', 'c_call'):
+            state['calls'] += 1
+        current, peak = tracemalloc.get_traced_memory()
+        state['allocated'] += peak - state['current']
+        state['current'] = current
+        tracemalloc.reset_peak()
+
+    tracemalloc.start()
+    try:
+        sys.setprofile(profile)
+        try:
+            func()
+        finally:
+            sys.setprofile(None)
+        current, peak = tracemalloc.get_traced_memory()
+        return state['calls'], state['allocated'] + peak - state['current']
+    finally:
+        tracemalloc.stop()
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def ids(params):
+    return [getattr(p, '__name__', None) for p in params]
+
+
+@pytest.mark.parametrize('runner', RUNNERS, ids=ids(RUNNERS))
+@pytest.mark.parametrize('payload, size', PAYLOADS,
+                         ids=ids(p for p, _ in PAYLOADS))
+class TestLinearComplexity(object):
+
+    @pytest.mark.skipif(not hasattr(tracemalloc, 'reset_peak'),
+                        reason='Requires tracemalloc.reset_peak')
+    def test_work(self, runner, payload, size):
+        small = payload(size // WORK_SCALE)
+        large = payload(size // WORK_SCALE * FACTOR)
+
+        calls_small, bytes_small = measure_work(lambda: runner(small, 'b'))
+        calls_large, bytes_large = measure_work(lambda: runner(large, 'b'))
+        assert calls_large < calls_small * FACTOR * TOLERANCE
+        assert bytes_large < bytes_small * FACTOR * TOLERANCE
+
+    @pytest.mark.skipif(not os.environ.get('MIME_STREAMER_TIMING'),
+                        reason='Set MIME_STREAMER_TIMING to check timing')
+    def test_time(self, runner, payload, size):
+        small = payload(size)
+        large = payload(size * FACTOR)
+
+        t_small = best_time(lambda: runner(small, 'b'))
+        t_large = best_time(lambda: runner(large, 'b'))
+        assert t_large < t_small * FACTOR * TOLERANCE
+
+    @pytest.mark.skipif(tracemalloc is None, reason='Requires tracemalloc')
+    def test_memory(self, runner, payload, size):
+        small = payload(size)
+        large = payload(size * FACTOR)
+
+        m_small = peak_memory(lambda: runner(small, 'b'))
+        m_large = peak_memory(lambda: runner(large, 'b'))
+        assert m_large < max(m_small, 1 << 16) * FACTOR * TOLERANCE
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+from pkg_resources import resource_string
+
+import pytest
+
+from mime_streamer.exceptions import ParsingError
+from mime_streamer.feed_parser import MessageEnd
+from mime_streamer.feed_parser import MIMEFeedParser
+from mime_streamer.feed_parser import parse_chunks
+from mime_streamer.feed_parser import PartData
+from mime_streamer.feed_parser import PartEnd
+from mime_streamer.feed_parser import PartHeaders
+
+
+def load_raw(resource):
+    return resource_string(__name__, 'data/' + resource)
+
+
+def collect(events):
+    """Collect events into a list of (content-id, content) pairs."""
+    parts = []
+    for event in events:
+        if isinstance(event, PartHeaders):
+            parts.append([event.headers.get('content-id'), b''])
+        elif isinstance(event, PartData):
+            parts[-1][1] += event.data
+    return [tuple(part) for part in parts]
+
+
+def feed_in_chunks(raw, size, boundary=None):
+    parser = MIMEFeedParser(boundary=boundary)
+    events = []
+    for i in range(0, len(raw), size):
+        events.extend(parser.feed(raw[i:i + size]))
+    events.extend(parser.close())
+    return events
+
+
+class TestMIMEFeedParser(object):
+
+    @pytest.mark.parametrize('size', [1, 2, 3, 7, 16, 64, 4096])
+    def test_multipart_related_basic(self, size):
+        events = feed_in_chunks(load_raw('multipart_related_basic'), size)
+
+        parts = collect(events)
+        assert [cid for cid, _ in parts] == [
+            None, '<950120.aaCC@XIson.com>', '<950120.aaCB@XIson.com>']
+        assert parts[0][1] == b''
+        assert parts[1][1] == (
+            b'25\r\n10\r\n34\r\n10\r\n25\r\n21\r\n26\r\n10\r\n')
+        assert parts[2][1].endswith(b'NrIHF1YWNrCkUgSSBFIEkgTwo=\r\n\r\n')
+        assert isinstance(events[-1], MessageEnd)
+
+    @pytest.mark.parametrize('size', [1, 5, 13, 4096])
+    def test_xop_example(self, size):
+        events = feed_in_chunks(
+            load_raw('xop_example'), size, boundary='MIME_boundary')
+
+        parts = collect(events)
+        assert parts[1:] == [('<http://example.org/me.png>', b'23580\r\n\r\n'),
+                             ('<http://example.org/my.hsh>', b'7923579\r\n')]
+        assert [type(e) for e in events
+                if not isinstance(e, PartData)] == [
+            PartHeaders, PartEnd, PartHeaders, PartEnd, PartHeaders, PartEnd,
+            MessageEnd]
+
+    def test_text_html(self):
+        events = list(parse_chunks([load_raw('text_html')]))
+        assert isinstance(events[0], PartHeaders)
+        assert events[0].headers['content-type'].startswith('text/html')
+        assert b'<html>' in collect(events)[0][1]
+
+    def test_text_html_empty(self):
+        parser = MIMEFeedParser()
+        assert parser.feed(load_raw('text_html_empty')) == []
+        with pytest.raises(ParsingError):
+            parser.close()
+
+    def test_epilogue_is_ignored(self):
+        raw = (b'preamble\r\n--b\r\nContent-ID: <a>\r\n\r\nabc\r\n'
+               b'--b--\r\nepilogue\r\n')
+        parser = MIMEFeedParser(boundary='b')
+        events = parser.feed(raw)
+        assert collect(events) == [('<a>', b'abc\r\n')]
+        assert isinstance(events[-1], MessageEnd)
+        assert parser.feed(b'more') == []
+        assert parser.close() == []
+
+    def test_boundary_prefix_in_content(self):
+        raw = b'--b\r\n\r\nx--b\r\n-\r\n--\r\n--c\r\n--b--\r\n'
+        for size in range(1, len(raw) + 1):
+            assert collect(feed_in_chunks(raw, size, boundary='b')) == [
+                (None, b'x--b\r\n-\r\n--\r\n--c\r\n')]
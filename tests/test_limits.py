@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+from pkg_resources import resource_string
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+import pytest
+import requests
+import responses
+
+from mime_streamer import MIMEResponseStreamer
+from mime_streamer import MIMEStreamer
+from mime_streamer.exceptions import HeaderLimitExceeded
+from mime_streamer.exceptions import LineLengthExceeded
+from mime_streamer.exceptions import ParsingError
+from mime_streamer.exceptions import PartLimitExceeded
+from mime_streamer.exceptions import PartSizeExceeded
+from mime_streamer.exceptions import TotalSizeExceeded
+from mime_streamer.limits import Limits
+from mime_streamer.mime_streamer import READ_BLOCK_SIZE
+
+
+def make_streamer(**kwargs):
+    raw = resource_string(__name__, 'data/multipart_related_basic')
+    return MIMEStreamer(StringIO(raw), limits=Limits(**kwargs))
+
+
+def read_all(streamer, preload=False):
+    return [part.content if preload else part.content.read()
+            for part in streamer.iter_parts(preload=preload)]
+
+
+class TestLimits(object):
+
+    def test_within_limits(self):
+        contents = read_all(make_streamer(
+            max_header_bytes=1024, max_headers=4, max_parts=3,
+            max_line_length=80, max_part_size=256, max_total_bytes=1024))
+        assert len(contents) == 3
+        assert contents[1].startswith(b'25\r\n10\r\n')
+
+    @pytest.mark.parametrize('kwargs, exc', [
+        ({'max_header_bytes': 100}, HeaderLimitExceeded),
+        ({'max_headers': 1}, HeaderLimitExceeded),
+        ({'max_parts': 2}, PartLimitExceeded),
+        ({'max_line_length': 40}, LineLengthExceeded),
+        ({'max_part_size': 30}, PartSizeExceeded),
+        ({'max_total_bytes': 500}, TotalSizeExceeded),
+    ])
+    @pytest.mark.parametrize('preload', [False, True])
+    def test_limit_exceeded(self, kwargs, exc, preload):
+        with pytest.raises(exc) as excinfo:
+            read_all(make_streamer(**kwargs), preload=preload)
+        assert isinstance(excinfo.value, ParsingError)
+
+    def test_folded_header_lines_not_counted(self):
+        streamer = make_streamer(max_headers=2)
+        with streamer.get_next_part() as part:
+            assert 'boundary=example-1' in part.headers['content-type']
+        with streamer.get_next_part() as part:
+            assert part.content_id == '950120.aaCC@XIson.com'
+        with pytest.raises(HeaderLimitExceeded):
+            with streamer.get_next_part():
+                pass
+
+    def test_content_length_over_part_size(self):
+        raw = (b'--b\r\nContent-Length: 100\r\n\r\n' + b'x' * 100 +
+               b'\r\n--b--\r\n')
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b',
+                                limits=Limits(max_part_size=50))
+        with pytest.raises(PartSizeExceeded):
+            streamer.get_next_part().__enter__()
+
+    def test_runaway_line_bounded(self):
+        raw = b'--b\r\nX-Foo: bar\r\n\r\n' + b'\n' * (1 << 20)
+        streamer = MIMEStreamer(StringIO(raw), boundary=b'b',
+                                limits=Limits(max_line_length=1024))
+        with pytest.raises(LineLengthExceeded):
+            with streamer.get_next_part() as part:
+                part.content.read()
+        assert len(streamer.stream._buff) < 1024 + 2 * READ_BLOCK_SIZE
+
+
+class TestResponseLimits(object):
+
+    url = 'http://mockapi/limits'
+
+    def get(self, body, headers=None, **kwargs):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, self.url, body=body, headers=headers,
+                     content_type='multipart/related; boundary=b')
+            resp = requests.get(self.url, stream=True)
+        return MIMEResponseStreamer(resp, limits=Limits(**kwargs))
+
+    def test_runaway_line_bounded(self):
+        streamer = self.get(b'--b\r\nX-Foo: bar\r\n\r\n' + b'x' * (1 << 20),
+                            max_line_length=1024)
+        with pytest.raises(LineLengthExceeded):
+            read_all(streamer)
+        assert streamer.stream._received < 1024 * 4
+
+    def test_content_length_over_total(self):
+        body = b'--b\r\nX-Foo: bar\r\n\r\nabc\r\n--b--\r\n'
+        headers = {'Content-Length': str(len(body))}
+        with pytest.raises(TotalSizeExceeded):
+            self.get(body, headers=headers, max_total_bytes=len(body) - 1)
+        streamer = self.get(body, headers=headers, max_total_bytes=len(body))
+        assert read_all(streamer) == [b'abc\r\n']
+
+    def test_header_limit(self):
+        body = b'--b\r\n' + b'X-Foo: bar\r\n' * 100 + b'\r\nabc\r\n--b--\r\n'
+        with pytest.raises(HeaderLimitExceeded):
+            read_all(self.get(body, max_headers=50))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+import gc
+import threading
+
+import pytest
+import requests
+import responses
+
+from mime_streamer import XOPResponseStreamer
+from mime_streamer.exceptions import MemoryBudgetExceeded
+from mime_streamer.memory_budget import MemoryBudget
+from mime_streamer.memory_budget import RAISE
+
+from .helpers import XOP_CONTENT_TYPE
+
+
+@pytest.fixture
+def large_manifest_urls():
+    raw = (b'--MIME_boundary\r\n'
+           b'Content-Type: application/xop+xml; type="text/xml"\r\n'
+           b'Content-ID: <mymessage.xml@example.org>\r\n\r\n'
+           b'<m:data>' + b'x' * 4700 + b'</m:data>\r\n'
+           b'--MIME_boundary\r\nContent-ID: <data>\r\n\r\n' +
+           b'y' * 20000 + b'\r\n--MIME_boundary--\r\n')
+    urls = ['http://mockapi/xop1', 'http://mockapi/xop2']
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        for url in urls:
+            rsps.add(responses.GET, url, body=raw,
+                     content_type=XOP_CONTENT_TYPE)
+        yield urls
+
+
+class TestMemoryBudget(object):
+
+    def test_usage(self, xop_url):
+        budget = MemoryBudget(1 << 20)
+        resp = requests.get(xop_url, stream=True)
+        streamer = XOPResponseStreamer(resp, memory_budget=budget)
+
+        report = budget.report()
+        assert len(report) == 1
+        usage = list(report.values())[0]
+        assert usage == budget.usage
+        assert usage >= len(streamer.manifest_part.content)
+
+        with streamer.get_next_part() as part:
+            part.content.read()
+            assert 0 < budget.usage <= usage
+
+        # The block buffered is released at the end of content, leaving
+        # the manifest part held by the streamer
+        assert [p.content for p in streamer.iter_parts(
+            close=False, preload=True)] == [b'7923579\r\n']
+        assert budget.usage == len(streamer.manifest_part.content)
+
+        streamer.close()
+        assert budget.usage == 0
+        assert budget.report() == {}
+
+    def test_dropped_streamer_releases_usage(self, xop_url):
+        budget = MemoryBudget(1 << 20)
+        resp = requests.get(xop_url, stream=True)
+        XOPResponseStreamer(resp, memory_budget=budget)
+        gc.collect()
+        assert budget.usage == 0
+
+    def test_exceeded_by_single_streamer(self, xop_url):
+        budget = MemoryBudget(100)
+        resp = requests.get(xop_url, stream=True)
+        with pytest.raises(MemoryBudgetExceeded):
+            XOPResponseStreamer(resp, memory_budget=budget)
+
+    def test_raise_policy(self, xop_url):
+        budget = MemoryBudget(1 << 16, policy=RAISE)
+        other = budget.register('other')
+        other.charge('buffer', (1 << 16) - 100)
+
+        resp = requests.get(xop_url, stream=True)
+        with pytest.raises(MemoryBudgetExceeded):
+            XOPResponseStreamer(resp, memory_budget=budget)
+
+    def test_block_policy_timeout(self, xop_url):
+        budget = MemoryBudget(1 << 16, timeout=0.05)
+        other = budget.register('other')
+        other.charge('buffer', (1 << 16) - 100)
+
+        resp = requests.get(xop_url, stream=True)
+        with pytest.raises(MemoryBudgetExceeded):
+            XOPResponseStreamer(resp, memory_budget=budget)
+
+    def test_block_policy_fails_on_streamers_in_same_thread(
+            self, large_manifest_urls):
+        budget = MemoryBudget(8000)
+        first = XOPResponseStreamer(
+            requests.get(large_manifest_urls[0], stream=True),
+            memory_budget=budget)
+
+        # The first streamer cannot release its buffer while the second
+        # waits in the same thread
+        with pytest.raises(MemoryBudgetExceeded):
+            second = XOPResponseStreamer(
+                requests.get(large_manifest_urls[1], stream=True),
+                memory_budget=budget)
+            with second.get_next_part() as part:
+                part.content.read()
+        first.close()
+
+    def test_block_policy_fails_on_pinned_charges(self, xop_url):
+        budget = MemoryBudget(1 << 16)
+        other = budget.register('other')
+        other.charge('manifest', (1 << 16) - 100, pinned=True)
+
+        resp = requests.get(xop_url, stream=True)
+        errors = []
+
+        def stream():
+            try:
+                XOPResponseStreamer(resp, memory_budget=budget)
+            except MemoryBudgetExceeded as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=stream)
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert len(errors) == 1
+
+    def test_block_policy_waits_for_release(self, xop_url):
+        budget = MemoryBudget(1 << 16)
+        other = budget.register('other')
+        other.charge('buffer', (1 << 16) - 100)
+
+        resp = requests.get(xop_url, stream=True)
+        streamers = []
+        thread = threading.Thread(target=lambda: streamers.append(
+            XOPResponseStreamer(resp, memory_budget=budget)))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+
+        other.close()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert streamers[0].manifest_part is not None
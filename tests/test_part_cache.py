@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+import errno
+import multiprocessing
+import os
+
+import pytest
+import requests
+import responses
+
+from mime_streamer import part_cache
+from mime_streamer.exceptions import NoPartError
+from mime_streamer.mime_streamer import make_headers
+from mime_streamer.mime_streamer import Part
+from mime_streamer.part_cache import PartCache
+from mime_streamer.part_cache import response_key
+
+from .helpers import XOP_CONTENT_TYPE
+
+
+@pytest.fixture
+def get(xop_raw):
+    def get(body=xop_raw, headers=None):
+        url = 'http://mockapi/xop'
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, url, body=body, headers=headers,
+                     content_type=XOP_CONTENT_TYPE)
+            return requests.get(url, stream=True)
+
+    return get
+
+
+class FakeStreamer(object):
+    """A stand-in for a streamer with a manifest and attachments."""
+
+    def __init__(self, content, count=1):
+        self.manifest_part = Part(make_headers(
+            [('Content-Type', 'application/xop+xml')]))
+        self.manifest_part.content = b'<xml/>'
+        self._content = content
+        self._count = count
+
+    def iter_parts(self, close=True):
+        for i in range(self._count):
+            part = Part(make_headers(
+                [('Content-ID', '<{}@example.org>'.format(i))]))
+            part.content = self._content
+            yield part
+
+
+def store_many(directory, seed):
+    cache = PartCache(directory, max_size=4000)
+    for i in range(20):
+        key = 'k{}'.format((seed + i) % 7)
+        cache.store(FakeStreamer(b'x' * 1000), key=key)
+        message = cache.get('k{}'.format(i % 7))
+        if message is not None:
+            with message:
+                assert message.parts[0].content.read() == b'x' * 1000
+
+
+class TestPartCache(object):
+
+    def test_miss_then_hit(self, get, tmpdir):
+        cache = PartCache(str(tmpdir))
+        headers = {'ETag': '"v1"'}
+
+        with cache.open(get(headers=headers)) as message:
+            assert b'<xop:Include' in message.manifest_part.content
+            assert [part.content.read() for part in message] == [
+                b'23580\r\n\r\n', b'7923579\r\n']
+
+        # A hit does not read the response
+        resp = get(body=b'garbage', headers=headers)
+        with cache.open(resp) as message:
+            assert message.key == response_key(resp)
+            with message.get_next_part() as part:
+                assert part.content.read(5) == b'23580'
+            part = message.get_part('cid:http://example.org/me.png')
+            assert part.content.read() == b'23580\r\n\r\n'
+            with message.get_next_part():
+                pass
+            with pytest.raises(NoPartError):
+                with message.get_next_part():
+                    pass
+
+    def test_read_part_as_array(self, get, tmpdir):
+        numpy = pytest.importorskip('numpy')
+        with PartCache(str(tmpdir)).open(get()) as message:
+            part = message.get_part('<http://example.org/me.png>')
+            arr = part.read_array(numpy.uint8)
+            assert arr.tobytes() == b'23580\r\n'
+
+    def test_strip_delimiter(self, get, tmpdir):
+        with PartCache(str(tmpdir)).open(get()) as message:
+            pass
+        with PartCache(str(tmpdir)).get(message.key) as message:
+            contents = []
+            for part in message:
+                part.strip_delimiter()
+                contents.append(part.content.read())
+            # The last part ends at EOF without a closing boundary
+            assert contents == [b'23580\r\n', b'7923579\r\n']
+
+    def test_response_key(self, get):
+        assert response_key(get()) is None
+        assert response_key(get(headers={'ETag': 'W/"v1"'})) is None
+        assert response_key(get(headers={'ETag': '"v1"'})).endswith('"v1"')
+        assert response_key(get(headers={
+            'ETag': '"v1"', 'Digest': 'sha-256=abc'})) == (
+                'digest:sha-256=abc')
+
+    def test_content_hash_key(self, get, tmpdir):
+        cache = PartCache(str(tmpdir))
+        with cache.open(get()) as message:
+            key = message.key
+        assert key.startswith('sha256:')
+        with cache.open(get()) as message:
+            assert message.key == key
+        assert len([name for name in os.listdir(str(tmpdir))
+                    if not name.startswith('.')]) == 1
+        with cache.get(key) as message:
+            assert len(message.parts) == 2
+
+    def test_lru_eviction(self, tmpdir):
+        cache = PartCache(str(tmpdir), max_size=2500)
+        for i, key in enumerate(['a', 'b']):
+            cache.store(FakeStreamer(b'x' * 1000), key=key)
+            os.utime(cache._entry_path(key), (i, i))
+
+        # Use the oldest entry so that the other is evicted
+        message = cache.get('a')
+        cache.store(FakeStreamer(b'y' * 1000), key='c')
+        assert cache.get('b') is None
+        assert cache.get('c') is not None
+
+        # An opened message is not evicted until closed
+        cache.max_size = 0
+        assert cache.evict() == 1
+        assert message.parts[0].content.read() == b'x' * 1000
+        message.close()
+        assert cache.evict() == 1
+        assert os.listdir(str(tmpdir)) == ['.lock']
+
+    def test_parts_mapped_while_read(self, tmpdir):
+        cache = PartCache(str(tmpdir))
+        cache.store(FakeStreamer(b'data', count=3000), key='k')
+        with cache.get('k') as message:
+            assert len(message.parts) == 3000
+            previous = None
+            for part in message:
+                assert part.content.read() == b'data'
+                assert part.content.mapped
+                assert previous is None or not previous.content.mapped
+                previous = part
+
+            part = message.get_part('<5@example.org>')
+            assert part.content.read() == b'data'
+            assert [p.content.mapped for p in message.parts].count(True) == 1
+        assert not any(p.content.mapped for p in message.parts)
+
+    def test_corrupt_index_is_miss(self, tmpdir):
+        cache = PartCache(str(tmpdir))
+        cache.store(FakeStreamer(b'data'), key='k')
+        with open(os.path.join(cache._entry_path('k'), 'index.json'),
+                  'w') as f:
+            f.write('{"parts": ')
+        assert cache.get('k') is None
+
+    def test_open_error_is_not_miss(self, tmpdir, monkeypatch):
+        cache = PartCache(str(tmpdir))
+        cache.store(FakeStreamer(b'data'), key='k')
+
+        def fail(*args, **kwargs):
+            raise OSError(errno.EMFILE, 'Too many open files')
+
+        monkeypatch.setattr(part_cache.os, 'stat', fail)
+        with pytest.raises(OSError):
+            cache.get('k')
+
+    def test_first_store_kept(self, tmpdir):
+        cache = PartCache(str(tmpdir))
+        cache.store(FakeStreamer(b'first'), key='k')
+        cache.store(FakeStreamer(b'second'), key='k')
+        with cache.get('k') as message:
+            assert message.parts[0].content.read() == b'first'
+        assert len(os.listdir(str(tmpdir))) == 1
+
+    def test_processes_sharing_directory(self, tmpdir):
+        procs = [multiprocessing.Process(target=store_many,
+                                         args=(str(tmpdir), seed))
+                 for seed in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            assert proc.exitcode == 0
+
+        names = [name for name in os.listdir(str(tmpdir))
+                 if name != '.lock']
+        assert names
+        for name in names:
+            assert len(name) == 64
+            assert os.path.exists(os.path.join(str(tmpdir), name,
+                                               'index.json'))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+import multiprocessing
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import BytesIO as StringIO
+
+import pytest
+
+from mime_streamer import MIMEStreamer
+from mime_streamer.exceptions import MemoryBudgetExceeded
+from mime_streamer.memory_budget import RAISE
+from mime_streamer.shared_parts import attach
+from mime_streamer.shared_parts import SharedMemoryPool
+
+pytest.importorskip('multiprocessing.shared_memory')
+
+
+def make_message(contents, sized=False):
+    raw = b''
+    for index, data in enumerate(contents):
+        raw += b'--b\r\nContent-ID: <' + str(index).encode() + b'>\r\n'
+        if sized:
+            raw += b'Content-Length: ' + str(len(data)).encode() + b'\r\n'
+        raw += b'\r\n' + data + b'\r\n'
+    return raw + b'--b--\r\n'
+
+
+def read_shared(descriptor):
+    with attach(descriptor) as view:
+        return view.tobytes()
+
+
+class TestSharedMemoryPool(object):
+
+    @pytest.mark.parametrize('sized', [False, True])
+    def test_share_parts(self, sized):
+        contents = [b'a' * 100, b'b\r\n' * 50, b'', b'c' * 5000, b'd' * 10]
+        streamer = MIMEStreamer(StringIO(make_message(contents, sized)),
+                                boundary=b'b')
+        with SharedMemoryPool(segment_size=1024) as pool:
+            descriptors = list(streamer.share_parts(pool))
+            assert [read_shared(d) for d in descriptors] == contents
+            assert [dict(d.headers)['Content-ID'] for d in descriptors] == [
+                '<0>', '<1>', '<2>', '<3>', '<4>']
+
+            # Small parts are packed into a segment
+            assert descriptors[1].name == descriptors[0].name
+            assert descriptors[1].offset == 100
+            assert descriptors[3].name != descriptors[4].name
+
+            assert pool.segment_count == 2
+            pool.release(descriptors[3])
+            assert pool.segment_count == 1
+
+    @pytest.mark.parametrize('sized', [False, True])
+    def test_preloaded_parts(self, sized):
+        contents = [b'a' * 100, b'b\r\n' * 200, b'abc', b'']
+        for preload in (False, True):
+            streamer = MIMEStreamer(StringIO(make_message(contents, sized)),
+                                    boundary=b'b')
+            with SharedMemoryPool(segment_size=1024) as pool:
+                assert [read_shared(d) for d in streamer.share_parts(
+                    pool, preload=preload)] == contents
+
+    @pytest.mark.parametrize('length', [0, 50, 99, 101, 102, 2000])
+    def test_wrong_content_length(self, length):
+        data = b'a' * 100
+        raw = (b'--b\r\nContent-Length: ' + str(length).encode() +
+               b'\r\n\r\n' + data + b'\r\n--b\r\nContent-ID: <next>\r\n'
+               b'\r\nnext\r\n--b--\r\n')
+        for preload in (False, True):
+            streamer = MIMEStreamer(StringIO(raw), boundary=b'b')
+            with SharedMemoryPool(segment_size=1024) as pool:
+                assert [read_shared(d) for d in streamer.share_parts(
+                    pool, preload=preload)] == [data, b'next']
+
+    def test_segments_reused(self):
+        contents = [b'x' * 600] * 6
+        streamer = MIMEStreamer(StringIO(make_message(contents)),
+                                boundary=b'b')
+        with SharedMemoryPool(segment_size=1024, max_segments=2,
+                              policy=RAISE) as pool:
+            names = set()
+            for descriptor in streamer.share_parts(pool):
+                assert read_shared(descriptor) == b'x' * 600
+                names.add(descriptor.name)
+                pool.release(descriptor)
+            assert len(names) <= 2
+
+    def test_segments_exhausted(self):
+        contents = [b'x' * 600] * 3
+        streamer = MIMEStreamer(StringIO(make_message(contents)),
+                                boundary=b'b')
+        with SharedMemoryPool(segment_size=1024, max_segments=2,
+                              policy=RAISE) as pool:
+            with pytest.raises(MemoryBudgetExceeded):
+                list(streamer.share_parts(pool))
+
+    def test_close_unlinks_segments(self):
+        streamer = MIMEStreamer(StringIO(make_message([b'data'])),
+                                boundary=b'b')
+        with SharedMemoryPool(segment_size=1024) as pool:
+            descriptor, = list(streamer.share_parts(pool))
+        assert pool.segment_count == 0
+        with pytest.raises(OSError):
+            read_shared(descriptor)
+
+    def test_worker_processes(self):
+        contents = [bytes(bytearray(range(256))) * n for n in (1, 10, 100)]
+        streamer = MIMEStreamer(StringIO(make_message(contents)),
+                                boundary=b'b')
+        with SharedMemoryPool(segment_size=4096) as pool:
+            workers = multiprocessing.Pool(2)
+            try:
+                results = workers.map(read_shared, streamer.share_parts(pool))
+            finally:
+                workers.close()
+                workers.join()
+        assert results == contents
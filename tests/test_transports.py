@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+
+import pytest
+import requests
+import urllib3
+from six.moves import http_client
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.urllib.parse import urlsplit
+
+from mime_streamer import XOPResponseStreamer
+from mime_streamer.transports import HTTPClientTransport
+from mime_streamer.transports import HttpxTransport
+from mime_streamer.transports import make_transport
+from mime_streamer.transports import RequestsTransport
+from mime_streamer.transports import Urllib3Transport
+
+from .helpers import XOP_CONTENT_TYPE
+
+
+class XOPHandler(BaseHTTPRequestHandler):
+    """Serves the XOP example, chunked on `/chunked`, honoring `Range`
+    and dropping connections after `server.drops` bytes.
+
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        raw = self.server.raw
+        offset = 0
+        self.send_response(200 if 'Range' not in self.headers else 206)
+        if 'Range' in self.headers:
+            offset = int(self.headers['Range'].split('=')[1].split('-')[0])
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                offset, len(raw) - 1, len(raw)))
+        self.server.offsets.append(offset)
+        body = raw[offset:]
+        drop = self.server.drops.pop(0) if self.server.drops else None
+
+        # Unfolded, as folding is obsolete in HTTP
+        self.send_header('Content-Type', ' '.join(XOP_CONTENT_TYPE.split()))
+        self.send_header('Connection', 'close')
+        if self.path == '/chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 100):
+                chunk = body[i:i + 100]
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() +
+                                 chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body[:drop])
+
+
+@pytest.fixture
+def server(serve, xop_raw):
+    return serve(XOPHandler, raw=xop_raw, drops=[], offsets=[])
+
+
+def open_requests(url, headers):
+    return requests.get(url, headers=headers, stream=True)
+
+
+def open_urllib3(url, headers):
+    return urllib3.PoolManager().request('GET', url, headers=headers,
+                                         preload_content=False)
+
+
+def open_http_client(url, headers):
+    parts = urlsplit(url)
+    conn = http_client.HTTPConnection(parts.hostname, parts.port)
+    conn.request('GET', parts.path or '/', headers=headers)
+    return conn.getresponse()
+
+
+def open_httpx(url, headers):
+    httpx = pytest.importorskip('httpx')
+    client = httpx.Client()
+    return client.send(client.build_request('GET', url, headers=headers),
+                       stream=True)
+
+
+CLIENTS = [
+    (open_requests, RequestsTransport),
+    (open_urllib3, Urllib3Transport),
+    (open_http_client, HTTPClientTransport),
+    (open_httpx, HttpxTransport),
+]
+
+
+def read_parts(streamer):
+    return [(part.content_id, part.content.read()) for part in streamer]
+
+
+@pytest.mark.parametrize('client, transport_class', CLIENTS,
+                         ids=[c.__name__[5:] for c, _ in CLIENTS])
+class TestTransports(object):
+
+    expected = [('http://example.org/me.png', b'23580\r\n\r\n'),
+                ('http://example.org/my.hsh', b'7923579\r\n')]
+
+    @pytest.mark.parametrize('path', ['/', '/chunked'])
+    def test_stream(self, server, client, transport_class, path):
+        resp = client(server.url + path, {})
+        assert isinstance(make_transport(resp), transport_class)
+
+        streamer = XOPResponseStreamer(resp)
+        assert b'xop:Include' in streamer.manifest_part.content
+        assert read_parts(streamer) == self.expected
+
+    def test_reopen_dropped_connection(self, server, client,
+                                       transport_class):
+        def reopen(offset):
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+            return client(server.url + '/', headers)
+
+        server.drops = [600]
+        streamer = XOPResponseStreamer(reopen(0), reopen=reopen)
+        assert read_parts(streamer) == self.expected
+        # Reopened from the last byte received in whole chunks
+        assert len(server.offsets) == 2
+        assert server.offsets[1] <= 600
+
+
+def test_unsupported_response():
+    with pytest.raises(TypeError):
+        make_transport(object())
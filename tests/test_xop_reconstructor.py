@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# The MIT License (MIT)
+# Copyright (c) 2017-2018 Taro Sato
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import absolute_import
+import base64
+import io
+import os
+
+import pytest
+import requests
+import responses
+
+from mime_streamer import XOPResponseStreamer
+from mime_streamer import xop_reconstructor
+from mime_streamer.exceptions import ParsingError
+from mime_streamer.xop_reconstructor import find_includes
+from mime_streamer.xop_reconstructor import reconstruct
+
+from .helpers import XOP_CONTENT_TYPE
+
+
+INCLUDE = (b"<xop:Include xmlns:xop='http://www.w3.org/2004/08/xop/include' "
+           b"href='cid:{}'/>")
+
+
+def make_message(cids, attachments):
+    manifest = b'<m:data>' + b''.join(
+        b'<m:item>' + INCLUDE.replace(b'{}', cid) + b'</m:item>'
+        for cid in cids) + b'</m:data>'
+    raw = (b'--MIME_boundary\r\n'
+           b'Content-Type: application/xop+xml; type="text/xml"\r\n'
+           b'Content-ID: <mymessage.xml@example.org>\r\n\r\n' +
+           manifest + b'\r\n')
+    for cid, data in attachments:
+        raw += (b'--MIME_boundary\r\n'
+                b'Content-Type: application/octet-stream\r\n'
+                b'Content-ID: <' + cid + b'>\r\n\r\n' + data + b'\r\n')
+    return raw + b'--MIME_boundary--\r\n'
+
+
+def expected_xml(cids, attachments):
+    data = dict(attachments)
+    return b'<m:data>' + b''.join(
+        b'<m:item>' + base64.b64encode(data[cid]) + b'</m:item>'
+        for cid in cids) + b'</m:data>'
+
+
+def open_streamer(raw):
+    url = 'http://mockapi/xop'
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, url, body=raw, content_type=XOP_CONTENT_TYPE)
+        resp = requests.get(url, stream=True)
+    return XOPResponseStreamer(resp)
+
+
+@pytest.fixture
+def spools(monkeypatch):
+    created = []
+    factory = xop_reconstructor.SpooledTemporaryFile
+
+    def spool(*args, **kwargs):
+        f = factory(*args, **kwargs)
+        created.append(f)
+        return f
+
+    monkeypatch.setattr(xop_reconstructor, 'SpooledTemporaryFile', spool)
+    return created
+
+
+class TestFindIncludes(object):
+
+    def test_namespaces(self):
+        manifest = (
+            b'<a xmlns:x="http://www.w3.org/2004/08/xop/include">'
+            b'<x:Include href="cid:one"/>'
+            b'<y:Include href="cid:two"/>'
+            b'<Include xmlns="http://www.w3.org/2004/08/xop/include" '
+            b'href="cid:%3Cthree%3E"></Include>'
+            b'<Include href="cid:four"/></a>')
+        assert [(manifest[start:end], cid) for start, end, cid
+                in find_includes(manifest)] == [
+            (b'<x:Include href="cid:one"/>', 'one'),
+            (b'<Include xmlns="http://www.w3.org/2004/08/xop/include" '
+             b'href="cid:%3Cthree%3E"></Include>', 'three')]
+
+
+class TestReconstruct(object):
+
+    def test_xop_example(self, xop_raw):
+        streamer = open_streamer(xop_raw)
+        out = io.BytesIO()
+        n = reconstruct(streamer, out)
+        xml = out.getvalue()
+        assert n == len(xml)
+        assert b'Include' not in xml
+        assert base64.b64encode(b'23580\r\n') in xml
+        # The last part ends without a closing boundary
+        assert base64.b64encode(b'7923579\r\n') in xml
+        assert xml.endswith(b'</m:data>\r\n')
+
+    @pytest.mark.parametrize('chunk_size', [1, 2, 10, 3 << 16])
+    def test_in_order_not_spooled(self, spools, chunk_size):
+        attachments = [(b'a', os.urandom(100001)), (b'b', b'\r\n\r\n'),
+                       (b'c', b'')]
+        cids = [b'a', b'b', b'c']
+        out = io.BytesIO()
+        reconstruct(open_streamer(make_message(cids, attachments)), out,
+                    chunk_size=chunk_size)
+        assert out.getvalue() == expected_xml(cids, attachments)
+        assert spools == []
+
+    def test_out_of_order_spooled(self, spools, tmpdir):
+        attachments = [(b'a', os.urandom(5000)), (b'b', os.urandom(7)),
+                       (b'c', b'c' * 10), (b'unused', b'x')]
+        cids = [b'c', b'b', b'a', b'b']
+        out = io.BytesIO()
+        reconstruct(open_streamer(make_message(cids, attachments)), out,
+                    chunk_size=30, spool_max_size=1000,
+                    spool_dir=str(tmpdir))
+        assert out.getvalue() == expected_xml(cids, attachments)
+        # Attachments a and b arrive early; b is also included twice
+        assert len(spools) == 2
+        assert all(f.closed for f in spools)
+
+    def test_attachment_not_found(self):
+        streamer = open_streamer(make_message([b'a', b'z'],
+                                              [(b'a', b'data')]))
+        with pytest.raises(ParsingError):
+            reconstruct(streamer, io.BytesIO())